@@ -0,0 +1,2 @@
+"""Benchmarks for fahrplan, run them from the repository root, e.g.
+``python -m benchmarks.bench_timestamps``."""
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Latency of a merged departure board of many stations.
+
+Compares fetching the station boards one after the other and sorting all
+departures with :class:`fahrplan.board.Board`, which fetches them
+concurrently and merges the ordered boards with a heap. Refreshes are timed
+as well: they only revalidate the boards with conditional requests.
+"""
+import argparse
+import time
+
+from fahrplan import api, board
+from fahrplan.standin import StandInServer
+
+
+def sequential(client, stations, window):
+    departures = []
+    for station in stations:
+        data = client.request('stationboard', {'station': station, 'limit': window,
+                                               'fields[]': list(board.BOARD_FIELDS)})
+        departures.extend(board.parse_board(data, station))
+    departures.sort(key=lambda d: d.departure)
+    return departures[:window]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stations', type=int, default=40, help='Stations on the board')
+    parser.add_argument('--window', type=int, default=board.DEFAULT_WINDOW)
+    parser.add_argument('--workers', type=int, default=board.DEFAULT_WORKERS)
+    parser.add_argument('--latency', type=float, default=30, help='Stand-in latency in ms')
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    with StandInServer(latency=options.latency) as server, \
+            api.FahrplanClient(api_url=server.url, coalesce=False, pool_size=options.workers) as client:
+        # The stand-in makes up the stations it doesn't know
+        stations = [s['name'] for s in server.synthetic.stations[:options.stations]]
+        stations += ['Station {}'.format(i) for i in range(options.stations - len(stations))]
+        client.warmup()
+
+        def timed(func):
+            best = float('inf')
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        with board.Board(client, stations, options.window, options.workers) as merged:
+            results = [
+                ('sequential + sort', timed(lambda: sequential(client, stations, options.window))),
+                ('concurrent + merge', timed(lambda: board.Board(
+                    client, stations, options.window, options.workers).refresh())),
+            ]
+            merged.refresh()
+            results.append(('refresh', timed(merged.refresh)))
+        print('{} stations, {} departures, {:g} ms latency'.format(
+            len(stations), options.window, options.latency))
+        for name, seconds in results:
+            print('{:<20} {:10.1f} ms'.format(name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Latency of exploring the via variants of a query.
+
+Compares sending the query and its variants over the main hubs one after
+the other with :func:`fahrplan.explore.explore`, which sends them
+concurrently, against the single query. Also reports how many connections
+the Pareto front keeps of all the connections returned.
+"""
+import argparse
+import time
+
+from fahrplan import api, explore
+from fahrplan.standin import StandInServer
+
+
+def sequential(client, request):
+    connections = []
+    for variant in explore.variants(request):
+        connections.extend(client.get_connections(variant, keep_raw=False)['connections'])
+    return explore.pareto_front(connections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=explore.DEFAULT_WORKERS)
+    parser.add_argument('--latency', type=float, default=30, help='Stand-in latency in ms')
+    parser.add_argument('--repeat', type=int, default=3)
+    options = parser.parse_args()
+
+    request = {'from': 'Thun', 'to': 'Lugano', 'date': '2026/05/04', 'time': '08:00'}
+    with StandInServer(latency=options.latency) as server, \
+            api.FahrplanClient(api_url=server.url, coalesce=False, pool_size=options.workers) as client:
+        client.warmup()
+
+        def timed(func):
+            best = float('inf')
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                func()
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        results = [
+            ('single query', timed(lambda: client.get_connections(request, keep_raw=False))),
+            ('sequential variants', timed(lambda: sequential(client, request))),
+            ('concurrent variants', timed(lambda: explore.explore(client, request, workers=options.workers))),
+        ]
+        variants = explore.variants(request)
+        returned = sum(len(client.get_connections(v, keep_raw=False)['connections']) for v in variants)
+        front = explore.explore(client, request, workers=options.workers)
+    print('{} variants, {} connections, {} on the Pareto front, {:g} ms latency'.format(
+        len(variants), returned, len(front), options.latency))
+    for name, seconds in results:
+        print('{:<20} {:10.1f} ms'.format(name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Import time and query latency of the offline router.
+
+Generates a synthetic GTFS feed of ``--lines`` lines through a pool of
+``--stations`` stations (so that lines cross), served in both directions
+every ``--headway`` minutes from 05:00 to midnight, imports it and times
+random departure and arrival time queries.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from fahrplan import offline
+
+
+def write_feed(directory, stations, lines, stops, headway, seed=0):
+    rnd = random.Random(seed)
+
+    def write(name, header, rows):
+        with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+            f.write(header + '\n')
+            f.writelines(','.join(str(v) for v in row) + '\n' for row in rows)
+
+    write('agency.txt', 'agency_id,agency_name,agency_url,agency_timezone',
+          [(1, 'Synthetic', 'https://example.org', 'Europe/Zurich')])
+    write('stops.txt', 'stop_id,stop_name,parent_station,platform_code',
+          [(i, 'Station {}'.format(i), '', '') for i in range(stations)])
+    write('routes.txt', 'route_id,agency_id,route_short_name,route_desc,route_type',
+          [(i, 1, 'S{}'.format(i), 'S', 2) for i in range(lines)])
+    write('calendar.txt', 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,'
+          'start_date,end_date', [('all', 1, 1, 1, 1, 1, 1, 1, 20200101, 20991231)])
+    trips, stop_times = [], []
+    for line in range(lines):
+        path = rnd.sample(range(stations), stops)
+        for direction in (path, path[::-1]):
+            for start in range(5 * 60, 24 * 60, headway):
+                trip = len(trips)
+                trips.append((line, 'all', trip, trip))
+                for sequence, stop in enumerate(direction):
+                    t = (start + 3 * sequence) * 60
+                    hms = '{:02d}:{:02d}:00'.format(t // 3600, t // 60 % 60)
+                    stop_times.append((trip, hms, hms, stop, sequence))
+    write('trips.txt', 'route_id,service_id,trip_id,trip_short_name', trips)
+    write('stop_times.txt', 'trip_id,arrival_time,departure_time,stop_id,stop_sequence', stop_times)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--stations', type=int, default=400)
+    parser.add_argument('--lines', type=int, default=40)
+    parser.add_argument('--stops', type=int, default=30, help='Stops per line')
+    parser.add_argument('--headway', type=int, default=10, help='Minutes between trips')
+    parser.add_argument('--queries', type=int, default=100)
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        feed = os.path.join(directory, 'feed')
+        os.mkdir(feed)
+        write_feed(feed, options.stations, options.lines, options.stops, options.headway)
+        path = os.path.join(directory, 'timetable.sqlite')
+        start = time.perf_counter()
+        counts = offline.import_gtfs(feed, path)
+        elapsed = time.perf_counter() - start
+        print('Imported {connections} connections of {trips} trips in {0:.1f} s, {1:.1f} MiB'.format(
+            elapsed, os.path.getsize(path) / 2 ** 20, **counts))
+
+        rnd = random.Random(1)
+        with offline.OfflineClient(path) as client:
+            for arrival in (False, True):
+                latencies, found = [], 0
+                for _ in range(options.queries):
+                    a, b = rnd.sample(range(options.stations), 2)
+                    request = {'from': str(a), 'to': str(b), 'date': '2026/05/04',
+                               'time': '{:02d}:{:02d}'.format(rnd.randint(6, 20), rnd.randint(0, 59)),
+                               'isArrivalTime': int(arrival), 'limit': 1}
+                    start = time.perf_counter()
+                    found += bool(client.get_connections(request)['connections'])
+                    latencies.append(time.perf_counter() - start)
+                print('{:<10} median {:7.1f} ms  p95 {:7.1f} ms  ({} of {} found)'.format(
+                    'arrival' if arrival else 'departure', percentile(latencies, 0.5) * 1000,
+                    percentile(latencies, 0.95) * 1000, found, options.queries))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Measure the throughput of the query parser.
+
+Parses a multilingual corpus of queries with ``parse_input`` (one call per
+query) and with ``parse_input_many`` (one batch sharing a clock snapshot).
+"""
+import argparse
+import itertools
+import time
+
+from fahrplan.parser import parse_input, parse_input_many
+
+ROUTES = [
+    'von bern nach basel',
+    'von zürich, helvetiaplatz nach basel via bern',
+    'from zürich to genève via olten',
+    'from thun to burgdorf',
+    'de lausanne à vevey',
+    'de genève à sion via lausanne',
+    'da lugano a locarno',
+    'da bellinzona a chur via zürich',
+    'zürich basel',
+]
+TIMES = [
+    '', 'ab 15:35', 'an 1945', 'departure now', 'departure at noon', 'arrivée minuit',
+    'ab morgen 08:00', 'departure monday 13:00', 'départ lundi 12:00',
+    'ab in 3 tagen 09:00', 'departure 22/10 13:00', 'ab 22/10/2025 13:00',
+    'partenza alle 12:00', 'partenza domani 08:15', 'ab um mittag',
+]
+
+# Multilingual queries, every route combined with every time specification.
+CORPUS = [' '.join(filter(None, q)) for q in itertools.product(ROUTES, TIMES)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=100000, help='Number of queries to parse')
+    options = parser.parse_args()
+
+    queries = [q.split() for q in itertools.islice(itertools.cycle(CORPUS), options.size)]
+
+    start = time.perf_counter()
+    results = []
+    for tokens in queries:
+        try:
+            results.append(parse_input(tokens))
+        except ValueError as e:
+            results.append(e)
+    single = time.perf_counter() - start
+    del results
+
+    start = time.perf_counter()
+    parse_input_many(queries, errors='return')
+    batch = time.perf_counter() - start
+
+    print('parse_input       {:10.0f} queries/s'.format(len(queries) / single))
+    print('parse_input_many  {:10.0f} queries/s'.format(len(queries) / batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Throughput against a rate limited API with and without the client limiter.
+
+Runs a batch of queries against a local stand-in which answers requests
+beyond ``--api-rate`` per second with HTTP 429, and reports the achieved
+throughput, the number of throttled requests and of failed queries. With the
+limiter, the latency of an interactive query sent while the batch is running
+is reported as well.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from fahrplan import api, batch
+from fahrplan.ratelimit import RateLimiter
+from fahrplan.standin import StandInServer
+
+from .bench_parser import ROUTES
+
+
+def run(server, count, workers, retries, rate=None):
+    limiter = None
+    if rate:
+        limiter = RateLimiter(rate, path=os.path.join(tempfile.mkdtemp(), 'ratelimit.state'))
+    client = api.FahrplanClient(api_url=server.url, rate_limiter=limiter, retries=retries,
+                                coalesce=False, pool_size=workers + 1)
+    server.throttled = 0
+    lines = [ROUTES[i % len(ROUTES)] for i in range(count)]
+    interactive = []
+
+    def interactive_query():
+        time.sleep(1)
+        start = time.perf_counter()
+        client.get_connections({'from': 'bern', 'to': 'thun'})
+        interactive.append(time.perf_counter() - start)
+
+    thread = threading.Thread(target=interactive_query)
+    thread.start()
+    start = time.perf_counter()
+    results = list(batch.iter_results(client, lines, workers=workers))
+    elapsed = time.perf_counter() - start
+    thread.join()
+    failed = len([r for r in results if 'error' in r])
+    return count / elapsed, server.throttled, failed, interactive[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=150, help='Queries in the batch')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--api-rate', type=float, default=25, help='Requests per second the API allows')
+    parser.add_argument('--latency', type=float, default=20, help='Stand-in latency in ms')
+    options = parser.parse_args()
+
+    scenarios = [
+        ('no limiter, no retries', 0, None),
+        ('no limiter, 3 retries', 3, None),
+        ('limiter at API rate', 3, options.api_rate),
+    ]
+    with StandInServer(latency=options.latency, rate_limit=options.api_rate, retry_after=1) as server:
+        print('{:<24} {:>10} {:>8} {:>8} {:>16}'.format(
+            'scenario', 'queries/s', '429s', 'failed', 'interactive [ms]'))
+        for name, retries, rate in scenarios:
+            time.sleep(1)  # Let the stand-in's bucket refill
+            throughput, throttled, failed, interactive = run(server, options.count, options.workers,
+                                                             retries, rate)
+            print('{:<24} {:10.1f} {:8d} {:8d} {:16.1f}'.format(
+                name, throughput, throttled, failed, interactive * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Compare the rich table with the plain renderer.
+
+Renders the connections of a synthetic ``/v1/connections`` payload with all
+sections (``--full``) into memory and reports the time per connection and
+the time until the first connection has been written.
+"""
+import argparse
+import io
+import time
+import timeit
+
+import rich.console
+
+from fahrplan import api
+from fahrplan.display import Formats, connectionsTable, printPlainTable
+from fahrplan.standin import SyntheticData
+
+
+class FirstWrite(io.StringIO):
+    """Remember the time of the first write."""
+    first = None
+
+    def write(self, text):
+        if self.first is None:
+            self.first = time.perf_counter()
+        return io.StringIO.write(self, text)
+
+
+def render_rich(connections, out):
+    rich.console.Console(file=out, width=120).print(connectionsTable(connections, Formats.FULL))
+
+
+def render_plain(connections, out):
+    printPlainTable(iter(connections), out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, default=200)
+    parser.add_argument('--sections', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    options = parser.parse_args()
+
+    synthetic = SyntheticData(connections=options.connections, sections=options.sections, walks=1)
+    payload = synthetic.connections({'from': 'bern', 'to': 'zürich', 'time': '07:00'})
+
+    def parsed():
+        return [api._parse_connection(c, True) for c in payload['connections']]
+
+    results = {}
+    for name, render in [('rich', render_rich), ('plain', render_plain)]:
+        total = min(timeit.repeat(lambda: render(parsed(), io.StringIO()), repeat=options.repeat, number=1))
+        first = []
+        for _ in range(options.repeat):
+            out = FirstWrite()
+            start = time.perf_counter()
+            render(parsed(), out)
+            first.append(out.first - start)
+        results[name] = total
+        print('{:<6} {:8.1f} us/connection, first output after {:7.1f} ms'.format(
+            name, total / options.connections * 1e6, min(first) * 1000))
+    print('speedup {:7.1f}x ({} connections with {} sections)'.format(
+        results['rich'] / results['plain'], options.connections, options.sections + 1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Query latency from a snapshot, the response cache and the API.
+
+Builds a snapshot of ``--routes`` routes for a day from a local stand-in and
+times the same queries answered from the snapshot (opened for every query, as
+by a fresh process, and kept open as by the daemon), from a warm response
+cache and from the stand-in.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import date
+
+from fahrplan import api, snapshot
+from fahrplan.cache import ResponseCache
+from fahrplan.standin import StandInServer
+
+from .bench_parser import ROUTES
+
+
+def timed(func, requests):
+    start = time.perf_counter()
+    for request in requests:
+        func(request)
+    return (time.perf_counter() - start) / len(requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--routes', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0, help='Stand-in latency in ms')
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    day = date(2026, 5, 4)
+    routes = snapshot.read_routes(ROUTES[:options.routes])
+    rnd = random.Random(0)
+    requests = [{'from': origin, 'to': destination, 'date': day.strftime('%Y/%m/%d'),
+                 'time': '{:02d}:{:02d}'.format(rnd.randint(5, 20), rnd.randint(0, 59))}
+                for origin, destination in (rnd.choice(routes) for _ in range(options.queries))]
+    try:
+        with StandInServer(latency=options.latency) as server, \
+                api.FahrplanClient(api_url=server.url, coalesce=False) as client:
+            path = os.path.join(directory, 'snapshot.bin')
+            start = time.perf_counter()
+            count, failed = snapshot.build(client, routes, day, path)
+            print('Built a snapshot of {} connections in {:.2f} s, {:.1f} KiB'.format(
+                count, time.perf_counter() - start, os.path.getsize(path) / 1024))
+
+            def from_snapshot(request):
+                with snapshot.Snapshot(path) as snap:
+                    assert snap.lookup(request) is not None
+
+            opened = snapshot.Snapshot(path)
+            cache = ResponseCache(os.path.join(directory, 'cache.sqlite'), ttl=3600)
+            for request in requests:
+                client.get_connections(request, cache=cache, keep_raw=False)
+            results = [
+                ('snapshot (open + lookup)', timed(from_snapshot, requests)),
+                ('snapshot (lookup)', timed(opened.lookup, requests)),
+                ('response cache', timed(lambda r: client.get_connections(r, cache=cache, keep_raw=False),
+                                         requests)),
+                ('API (stand-in)', timed(lambda r: client.get_connections(r, keep_raw=False), requests)),
+            ]
+            opened.close()
+        for name, seconds in results:
+            print('{:<26} {:10.1f} us'.format(name, seconds * 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
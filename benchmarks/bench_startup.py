@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Measure the startup time of the ``fahrplan`` command line client.
+
+Every phase is run in a fresh interpreter several times and the fastest run
+is reported. Queries are answered by a local stand-in of the API, so the
+numbers don't depend on the network.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+from fahrplan.standin import StandInServer
+
+PHASES = [
+    ('interpreter', ['-c', 'pass']),
+    ('import fahrplan.main', ['-c', 'import fahrplan.main']),
+    ('import fahrplan.api', ['-c', 'import fahrplan.api']),
+    ('import fahrplan.parser', ['-c', 'import fahrplan.parser']),
+    ('import rich.table', ['-c', 'import rich, rich.table']),
+    ('fahrplan --version', ['-m', 'fahrplan.main', '--version']),
+    ('fahrplan --help', ['-m', 'fahrplan.main', '--help']),
+    ('fahrplan (argument error)', ['-m', 'fahrplan.main', 'von', 'bern']),
+    ('fahrplan query', ['-m', 'fahrplan.main', '--api-url', '{url}', 'von', 'bern', 'nach', 'basel']),
+]
+
+
+def measure(args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def import_times(args, count):
+    """Return the ``count`` modules with the highest cumulative import time."""
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = [s.strip() for s in line.split(':', 1)[1].split('|')]
+        rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per phase')
+    parser.add_argument('--latency', type=float, default=0, help='Stand-in latency in ms')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help='Also show the N slowest imports of a query')
+    options = parser.parse_args()
+
+    with StandInServer(latency=options.latency) as server:
+        print('{:<28} {:>10}'.format('phase', 'time [ms]'))
+        for name, args in PHASES:
+            args = [a.format(url=server.url) for a in args]
+            print('{:<28} {:10.1f}'.format(name, measure(args, options.repeat) * 1000))
+        if options.importtime:
+            print('\n{:<40} {:>12} {:>12}'.format('module', 'cumul. [ms]', 'self [ms]'))
+            args = [a.format(url=server.url) for a in PHASES[-1][1]]
+            for cumulative, self_, name in import_times(args, options.importtime):
+                print('{:<40} {:12.1f} {:12.1f}'.format(name, cumulative / 1000.0, self_ / 1000.0))
+
+
+if __name__ == '__main__':
+    main()
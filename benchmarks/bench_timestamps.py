@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Compare timestamp decoding with dateutil and the fast path.
+
+Decodes all section timestamps of a synthetic ``/v1/connections`` payload
+with ``dateutil.parser.parse`` and with ``fahrplan.helpers.parse_timestamp``.
+"""
+import argparse
+import timeit
+
+import dateutil.parser
+
+from fahrplan.helpers import parse_timestamp
+from fahrplan.standin import SyntheticData
+
+
+def timestamps(connections, sections):
+    synthetic = SyntheticData(connections=connections, sections=sections, walks=1)
+    payload = synthetic.connections({'from': 'bern', 'to': 'zürich', 'time': '07:00'})
+    values = []
+    for connection in payload['connections']:
+        for section in connection['sections']:
+            values.append(section['departure']['departure'])
+            values.append(section['arrival']['arrival'])
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--sections', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=200)
+    options = parser.parse_args()
+
+    values = timestamps(options.connections, options.sections)
+    assert [parse_timestamp(v) for v in values] == [dateutil.parser.parse(v) for v in values]
+
+    results = {}
+    for name, func in [('dateutil', dateutil.parser.parse), ('fast path', parse_timestamp)]:
+        best = min(timeit.repeat(lambda: [func(v) for v in values],
+                                 repeat=options.repeat, number=options.number))
+        results[name] = best / (options.number * len(values))
+        print('{:<10} {:8.3f} us/timestamp'.format(name, results[name] * 1e6))
+    print('speedup    {:8.1f}x ({} timestamps per payload)'.format(
+        results['dateutil'] / results['fast path'], len(values)))
+
+
+if __name__ == '__main__':
+    main()
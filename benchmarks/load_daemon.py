@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Drive the ``fahrplan`` daemon with concurrent clients.
+
+Starts a local stand-in of the API and a daemon (``fahrplan --daemon``), then
+runs the given number of queries from ``--clients`` concurrent clients and
+reports the latency percentiles and the throughput. Modes:
+
+* ``socket``: the clients talk to the daemon socket directly
+* ``client``: every query spawns ``fahrplan-client``, like a script would
+* ``cold``: every query spawns ``fahrplan`` without a daemon, for comparison
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fahrplan import daemon
+from fahrplan.standin import StandInServer
+
+from .bench_parser import CORPUS
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def start_daemon(path, api_url, extra_args):
+    process = subprocess.Popen([sys.executable, '-m', 'fahrplan.main', '--daemon', '--socket', path,
+                                '--api-url', api_url] + extra_args)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            daemon.request(['--version'], path)
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError('The daemon did not start')
+
+
+def run_load(mode, path, api_url, clients, count):
+    """Run ``count`` queries from ``clients`` threads, return the latencies."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    queries = iter(range(count))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(queries, None)
+            if i is None:
+                return
+            argv = CORPUS[i % len(CORPUS)].split()
+            start = time.perf_counter()
+            if mode == 'socket':
+                status = daemon.request(argv, path)['status']
+            else:
+                command = ['-m', 'fahrplan.daemon', '--socket', path] if mode == 'client' else \
+                          ['-m', 'fahrplan.main', '--api-url', api_url]
+                status = subprocess.run([sys.executable] + command + argv, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL).returncode
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if status == 0 else errors).append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['socket', 'client', 'cold'], action='append',
+                        help='Load mode (repeatable, default: all)')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--count', type=int, default=200, help='Queries per mode')
+    parser.add_argument('--latency', type=float, default=20, help='Stand-in latency in ms')
+    parser.add_argument('--cache', action='store_true', help='Start the daemon with --cache')
+    options = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'fahrplan.sock')
+    with StandInServer(latency=options.latency) as server:
+        process = start_daemon(path, server.url, ['--cache'] if options.cache else [])
+        try:
+            print('{:<8} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+                'mode', 'queries', 'p50 [ms]', 'p99 [ms]', 'queries/s', 'errors'))
+            for mode in options.mode or ['socket', 'client', 'cold']:
+                latencies, errors, elapsed = run_load(mode, path, server.url, options.clients, options.count)
+                if not latencies:
+                    print('{:<8} all {} queries failed'.format(mode, len(errors)))
+                    continue
+                print('{:<8} {:8d} {:10.1f} {:10.1f} {:10.1f} {:8d}'.format(
+                    mode, len(latencies), percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000,
+                    len(latencies) / elapsed, len(errors)))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of the hot paths with baselines and regression checks.
+
+Measures the throughput of parsing connections (summary and with all
+sections, both including the lazily decoded sections and timestamps),
+parsing single sections, parsing the multilingual query corpus and
+rendering tables. The connections come from a synthetic
+``/v1/connections`` payload of configurable size.
+
+Every benchmark is timed ``--repeat`` times and the best run is kept. The
+runs of the benchmarks are interleaved, so that a temporarily busy machine
+slows down one run of every benchmark rather than all runs of one. The
+results can be saved as a JSON baseline and later compared against it; the
+comparison fails (exit status 1) if the throughput of a benchmark dropped by
+more than ``--threshold``::
+
+    python -m benchmarks.suite --save baseline.json
+    # ... change the code ...
+    python -m benchmarks.suite --compare baseline.json
+
+Baselines are only comparable on the same machine, Python version and payload
+size.
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import timeit
+
+import rich.console
+
+from fahrplan import api
+from fahrplan.display import Formats, connectionsTable, printPlainTable
+from fahrplan.parser import parse_input
+from fahrplan.standin import SyntheticData
+
+from .bench_parser import CORPUS
+
+# Version 2: parse benchmarks include decoding the sections
+FORMAT_VERSION = 2
+
+
+def payload(connections, sections, walks):
+    """Return a synthetic ``/v1/connections`` response of the given size."""
+    synthetic = SyntheticData(connections=connections, sections=sections, walks=walks)
+    return synthetic.connections({'from': 'bern', 'to': 'zürich', 'time': '07:00'})
+
+
+def benchmarks(data):
+    """Return ``(name, function, items per call, unit)`` of all benchmarks."""
+    raw = data['connections']
+    sections = [(s, c) for c in raw for s in c['sections']]
+    parsed = [api._parse_connection(c, True) for c in raw]
+    queries = [q.split() for q in CORPUS]
+
+    # Sections are decoded lazily, so access them (and a timestamp) to time
+    # the whole parse
+    def parse_connection():
+        for connection in raw:
+            api._parse_connection(connection).sections[0].departure
+
+    def parse_connection_sections():
+        for connection in raw:
+            api._parse_connection(connection, True).sections[-1].arrival
+
+    def parse_section():
+        for section, connection in sections:
+            api._parse_section(section, connection)
+
+    def parse_queries():
+        for tokens in queries:
+            try:
+                parse_input(tokens)
+            except ValueError:
+                pass
+
+    def connections_table():
+        console = rich.console.Console(file=io.StringIO(), width=120)
+        console.print(connectionsTable(parsed, Formats.FULL))
+
+    def plain_table():
+        printPlainTable(parsed, io.StringIO())
+
+    return [
+        ('parse_connection', parse_connection, len(raw), 'connections/s'),
+        ('parse_connection_sections', parse_connection_sections, len(raw), 'connections/s'),
+        ('parse_section', parse_section, len(sections), 'sections/s'),
+        ('parse_input', parse_queries, len(queries), 'queries/s'),
+        ('connections_table', connections_table, len(parsed), 'connections/s'),
+        ('plain_table', plain_table, len(parsed), 'connections/s'),
+    ]
+
+
+def measure(selected, repeat, min_time):
+    """Return the best time of one call of each function in seconds.
+
+    Each timed run calls a function as often as fits into ``min_time``.
+    """
+    timers = []
+    for func in selected:
+        timer = timeit.Timer(func)
+        number, elapsed = timer.autorange()
+        timers.append((timer, max(1, int(number * min_time / max(elapsed, 1e-9)))))
+    best = [float('inf')] * len(timers)
+    for _ in range(repeat):
+        for i, (timer, number) in enumerate(timers):
+            best[i] = min(best[i], timer.timeit(number) / number)
+    return best
+
+
+def run(options):
+    """Run the selected benchmarks and return the results document."""
+    data = payload(options.connections, options.sections, options.walks)
+    selected = [b for b in benchmarks(data) if not options.filter or options.filter in b[0]]
+    results = {}
+    timings = measure([func for name, func, items, unit in selected], options.repeat, options.min_time)
+    for (name, func, items, unit), seconds in zip(selected, timings):
+        results[name] = {'throughput': items / seconds, 'unit': unit}
+        print('{:<26} {:14,.0f} {}'.format(name, items / seconds, unit))
+    return {
+        'version': FORMAT_VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'payload': {'connections': options.connections, 'sections': options.sections,
+                    'walks': options.walks},
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print the change of every benchmark against a baseline.
+
+    Returns:
+        The names of the benchmarks whose throughput dropped by more than
+        ``threshold`` (a fraction, e.g. 0.1).
+
+    """
+    for key in ('python', 'implementation', 'payload'):
+        if baseline.get(key) != current.get(key):
+            print('Warning: {} differs from the baseline ({!r} != {!r})'.format(
+                key, baseline.get(key), current.get(key)), file=sys.stderr)
+    regressions = []
+    print()
+    print('{:<26} {:>14} {:>14} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            print('{:<26} {:>14} {:14,.0f} {:>8}'.format(name, '-', result['throughput'], 'new'))
+            continue
+        change = result['throughput'] / base['throughput'] - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(name)
+        print('{:<26} {:14,.0f} {:14,.0f} {:+7.1%}{}'.format(
+            name, base['throughput'], result['throughput'], change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=16, help='Connections in the payload')
+    parser.add_argument('--sections', type=int, default=3, help='Journey sections per connection')
+    parser.add_argument('--walks', type=int, default=1, help='Walk sections per connection')
+    parser.add_argument('--repeat', type=int, default=10, help='Timed runs per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.1, help='Minimum seconds per timed run')
+    parser.add_argument('-k', '--filter', help='Only run benchmarks whose name contains this')
+    parser.add_argument('--save', metavar='FILE', help='Write the results to FILE as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with the baseline in FILE')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Allowed throughput drop before failing the comparison (default 0.15)')
+    options = parser.parse_args()
+
+    baseline = None
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('version') != FORMAT_VERSION:
+            parser.error('Unsupported baseline format in {}'.format(options.compare))
+
+    current = run(options)
+
+    if options.save:
+        with open(options.save, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if baseline is not None:
+        regressions = compare(baseline, current, options.threshold)
+        if regressions:
+            print('\n{} benchmark(s) regressed by more than {:.0%}: {}'.format(
+                len(regressions), options.threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""asyncio variant of the API client.
+
+Requires ``aiohttp`` (``pip install fahrplan[async]``). Responses are parsed
+with the same functions as :mod:`fahrplan.api`, so the results of both
+clients are interchangeable.
+"""
+import asyncio
+import logging
+import functools
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from .api import (API_URL, DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, NetworkError,
+                  RequestTimeout, ServerError, InvalidResponseError, _parse_connection,
+                  _with_connections, _copy_result, _connection_params)
+from .cache import make_key
+from .decoding import loads
+from .ratelimit import (DEFAULT_RETRIES, DEFAULT_BACKOFF, MAX_RETRY_DELAY, RETRY_STATUSES,
+                        current_priority, backoff_delay, retry_after_delay)
+
+# Default maximum number of requests in flight per client.
+DEFAULT_MAX_CONCURRENCY = 10
+
+
+def _encode_params(params):
+    """Convert request parameters into a list of pairs aiohttp accepts.
+
+    Values are converted like ``requests`` does it: lists are expanded into
+    repeated parameters, everything else that is not a string or number is
+    converted with ``str``.
+    """
+    pairs = []
+    for key, value in params.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for v in values:
+            if not isinstance(v, (str, int, float)) or isinstance(v, bool):
+                v = str(v)
+            pairs.append((key, v))
+    return pairs
+
+
+class AsyncFahrplanClient(object):
+    """asyncio client for the transport.opendata.ch API.
+
+    The underlying ``aiohttp.ClientSession`` (and its connection pool) is
+    created lazily on first use and shared by all requests of the client.
+    At most ``max_concurrency`` requests are in flight at the same time.
+
+    Args:
+        api_url: Base URL of the API (default ``API_URL``).
+        timeout: Request timeout in seconds.
+        pool_size: Maximum number of pooled connections.
+        max_concurrency: Maximum number of requests in flight.
+        proxy: Optional HTTP proxy (``host:port``).
+        coalesce: Whether identical connection queries running at the same
+            time share one API request (default True).
+        select_fields: Whether connection queries only request the members
+            of the response the client reads if the rest of the response is
+            not kept (default True).
+        rate_limiter: Optional :class:`fahrplan.ratelimit.RateLimiter`.
+        retries: How often transient errors are retried, see
+            :class:`fahrplan.api.FahrplanClient`.
+        backoff: Base delay of the exponential backoff in seconds.
+
+    """
+
+    def __init__(self, api_url=None, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, proxy=None, coalesce=True,
+                 rate_limiter=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 select_fields=True):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for fahrplan.aio (pip install fahrplan[async])')
+        self.api_url = api_url or API_URL
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        self.proxy = 'http://{}'.format(proxy) if proxy and '://' not in proxy else proxy
+        self.coalesce = coalesce
+        self.select_fields = select_fields
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._semaphore = None
+        self._inflight = {}  # key -> [task, number of waiters]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, action, params):
+        """Perform an API request and return the decoded JSON response.
+
+        Raises the same exceptions as :meth:`fahrplan.api.FahrplanClient.request`.
+        Transient errors are retried like there. Cancelling the calling task
+        aborts the request.
+        """
+        url = "{}/{}".format(self.api_url, action)
+        attempt = 0
+        while True:
+            try:
+                content = await self._get(url, params)
+            except RequestTimeout:
+                raise
+            except ServerError as e:
+                if e.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    raise
+                delay = e.retry_after
+                if e.status_code == 429 and self.rate_limiter is not None:
+                    self.rate_limiter.throttled(delay)
+                if (delay or 0) > MAX_RETRY_DELAY:
+                    raise
+                delay = (delay or 0) + backoff_delay(attempt if delay is None else 0, self.backoff)
+            except NetworkError:
+                if attempt >= self.retries:
+                    raise
+                delay = backoff_delay(attempt, self.backoff)
+            else:
+                break
+            attempt += 1
+            logging.debug('Retrying {0} in {1:.2f}s (attempt {2})'.format(url, delay, attempt))
+            await asyncio.sleep(delay)
+        try:
+            return loads(content)
+        except ValueError:
+            logging.debug('Response content: {0!r}'.format(content))
+            raise InvalidResponseError('Invalid API response (invalid JSON)')
+
+    async def _acquire(self):
+        """Wait until the rate limiter allows a request.
+
+        Polls the limiter instead of blocking a thread in ``acquire``, so
+        that a cancelled task doesn't take a token.
+        """
+        priority = current_priority()
+        while True:
+            delay = self.rate_limiter.try_acquire(priority)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    async def _get(self, url, params):
+        session = self._get_session()
+        async with self._semaphore:
+            if self.rate_limiter is not None:
+                await self._acquire()
+            try:
+                async with session.get(url, params=_encode_params(params), proxy=self.proxy) as response:
+                    logging.debug('Response status: {0!r}'.format(response.status))
+                    if response.status >= 400:
+                        raise ServerError(response.status, retry_after_delay(response.headers))
+                    content = await response.read()
+            except asyncio.TimeoutError:
+                raise RequestTimeout('Request timed out.')
+            except aiohttp.ClientError:
+                raise NetworkError('Could not reach network.')
+        if self.rate_limiter is not None:
+            self.rate_limiter.succeeded()
+        return content
+
+    async def get_connections(self, request, include_sections=False, keep_raw=True):
+        """Get the connections of a request.
+
+        See :meth:`fahrplan.api.FahrplanClient.get_connections`. Identical
+        queries running at the same time share one request, which is only
+        cancelled when all callers waiting for it are cancelled.
+        """
+        if not self.coalesce:
+            return await self._get_connections(request, include_sections, keep_raw)
+        key = make_key(self.api_url, 'connections', request, include_sections, keep_raw)
+        flight = self._inflight.get(key)
+        leader = flight is None
+        if leader:
+            task = asyncio.ensure_future(self._get_connections(request, include_sections, keep_raw))
+            flight = self._inflight[key] = [task, 0]
+            task.add_done_callback(functools.partial(self._landed, key))
+        else:
+            logging.debug('Joining in-flight request {0}'.format(key))
+        flight[1] += 1
+        try:
+            result = await asyncio.shield(flight[0])
+        except asyncio.CancelledError:
+            if flight[1] == 1:
+                flight[0].cancel()
+            raise
+        finally:
+            flight[1] -= 1
+        return result if leader else _copy_result(result)
+
+    def _landed(self, key, task):
+        flight = self._inflight.get(key)
+        if flight is not None and flight[0] is task:
+            del self._inflight[key]
+
+    async def _get_connections(self, request, include_sections, keep_raw):
+        data = await self.request("connections", _connection_params(request, keep_raw, self.select_fields))
+        connections = [_parse_connection(c, include_sections) for c in data["connections"]]
+        return _with_connections(data, connections, keep_raw)
+
+    async def gather_connections(self, requests, include_sections=False, return_exceptions=False,
+                                 keep_raw=True):
+        """Get the connections of many requests concurrently.
+
+        Args:
+            requests: Iterable of request dictionaries.
+            include_sections: Whether to parse all sections (default False).
+            keep_raw: Whether to keep the rest of the API responses.
+            return_exceptions: If True, errors are returned in place of the
+                result of the failing request instead of being raised.
+
+        Returns:
+            A list of results in the order of ``requests``. If a request fails
+            and ``return_exceptions`` is False, the remaining requests are
+            cancelled and the error is raised.
+
+        """
+        tasks = [asyncio.ensure_future(self.get_connections(r, include_sections, keep_raw))
+                 for r in requests]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+async def get_connections(request, include_sections=False, proxy=None, keep_raw=True):
+    """
+    Get the connections of a request
+    """
+    async with AsyncFahrplanClient(proxy=proxy) as client:
+        return await client.get_connections(request, include_sections, keep_raw)
+
+
+async def gather_connections(requests, include_sections=False, proxy=None,
+                             max_concurrency=DEFAULT_MAX_CONCURRENCY, keep_raw=True):
+    """
+    Get the connections of many requests concurrently over one connection pool
+    """
+    async with AsyncFahrplanClient(proxy=proxy, max_concurrency=max_concurrency) as client:
+        return await client.gather_connections(requests, include_sections, keep_raw=keep_raw)
@@ -1,73 +1,633 @@
 # -*- coding: utf-8 -*-
+import os
+import socket
+import hashlib
 import requests
+import requests.adapters
+import urllib3
+import time
 import logging
-import json
-import dateutil.parser
-import sys
-from .helpers import perror
+import threading
+from concurrent.futures import Future
+from .cache import normalize_request, make_key
+from .ratelimit import (DEFAULT_RETRIES, DEFAULT_BACKOFF, MAX_RETRY_DELAY, RETRY_STATUSES,
+                        backoff_delay, retry_after_delay)
+from .models import Connection, section_fields, decode_section
+from .decoding import loads, ArrayStream
+from .profiling import timed, count, active as profiling_active
 
-API_URL = 'http://transport.opendata.ch/v1'
+# Base URL of the API, can be overridden with the FAHRPLAN_API_URL environment
+# variable (e.g. to point it to a local stand-in, see fahrplan.standin).
+API_URL = os.environ.get('FAHRPLAN_API_URL', 'http://transport.opendata.ch/v1')
+
+# Default number of keep-alive connections per client and request timeout
+# in seconds.
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+
+# Size of the chunks read from streamed responses.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Members of a connections response read by ``_parse_connection``. Only these
+# are requested (``fields[]``) when the rest of the response is not kept,
+# which leaves out pass lists, coordinates, capacities, etc.
+CONNECTION_FIELDS = (
+    'connections/transfers',
+    'connections/sections/walk',
+    'connections/sections/journey/category',
+    'connections/sections/journey/number',
+    'connections/sections/departure/station/name',
+    'connections/sections/departure/departure',
+    'connections/sections/departure/platform',
+    'connections/sections/arrival/station/name',
+    'connections/sections/arrival/arrival',
+    'connections/sections/arrival/platform',
+)
+
+
+class FahrplanError(Exception):
+    """Base class for all errors raised while talking to the API."""
+
+
+class NetworkError(FahrplanError):
+    """The API could not be reached."""
+
+
+class RequestTimeout(NetworkError):
+    """The API did not answer within the configured timeout."""
+
+
+class ServerError(FahrplanError):
+    """The API answered with a non-OK HTTP status.
+
+    ``retry_after`` is the delay in seconds the API asked for with a
+    ``Retry-After`` header, or None.
+    """
+
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.retry_after = retry_after
+        verbose_status = requests.status_codes._codes.get(status_code, ('unknown',))[0]
+        super(ServerError, self).__init__('HTTP {} ({})'.format(status_code, verbose_status))
+
+
+class InvalidResponseError(FahrplanError):
+    """The API answered with something that is not valid JSON."""
+
+
+class _TimedConnection(urllib3.connection.HTTPConnection):
+    """Connection reporting the time spent resolving and connecting.
+
+    The host is resolved separately to time it, then the addresses are
+    tried in order like urllib3 does.
+    """
+
+    def _new_conn(self):
+        if not profiling_active():
+            return super(_TimedConnection, self)._new_conn()
+        host = self._dns_host
+        with timed('dns'):
+            try:
+                addresses = [a[4][0] for a in socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)]
+            except OSError:
+                addresses = [host]  # Let urllib3 report the error
+        with timed('connect'):
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super(_TimedConnection, self)._new_conn()
+                except urllib3.exceptions.HTTPError:
+                    if i == len(addresses) - 1:
+                        raise
+                finally:
+                    self._dns_host = host
+
+
+class _TimedHTTPSConnection(_TimedConnection, urllib3.connection.HTTPSConnection):
+    """Connection reporting the time of the TLS handshake as well."""
+
+    def connect(self):
+        with timed('tls'):
+            super(_TimedHTTPSConnection, self).connect()
+
+
+class _TimedConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TimedConnection
+
+
+class _TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class RequestsTransport(object):
+    """HTTP transport backed by a keep-alive ``requests.Session``.
+
+    A transport has a single ``get(url, params, timeout)`` method returning a
+    response object with ``status_code``, ``headers`` and ``content``
+    attributes. It is responsible for translating its own low level errors
+    into :class:`NetworkError`. Any object following that contract can be
+    passed to :class:`FahrplanClient`. Transports supporting streamed
+    responses accept ``stream=True`` and return responses with
+    ``iter_content(chunk_size)`` and ``close()``, those supporting
+    conditional requests accept additional request ``headers``.
+
+    Args:
+        pool_size: Number of keep-alive connections kept per host.
+        proxy: Optional HTTP proxy (``host:port``).
+
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, proxy=None):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+        if proxy is not None:
+            self.session.proxies = {'http': proxy}
+        self._warmup_lock = threading.Lock()
+        self._warmup_started = False  # Also set by the first request
+        self._warmup_done = threading.Event()
+
+    def get(self, url, params, timeout, stream=False, headers=None):
+        if not self._warmup_done.is_set():
+            with self._warmup_lock:
+                warming = self._warmup_started
+                if not warming:
+                    # Used before any warmup, there's nothing to wait for
+                    self._warmup_started = True
+                    self._warmup_done.set()
+            if warming:
+                with timed('warmup_wait'):
+                    self._warmup_done.wait(timeout)
+        try:
+            with timed('first_byte'):
+                response = self.session.get(url, params=params, timeout=timeout, stream=True,
+                                            headers=headers)
+            if not stream:
+                with timed('download'):
+                    _log_transfer(response, len(response.content))
+            return response
+        except requests.exceptions.Timeout:
+            raise RequestTimeout('Request timed out.')
+        except requests.exceptions.RequestException:
+            raise NetworkError('Could not reach network.')
+
+    def warmup(self, url, background=False):
+        """Open a pooled connection to the host of ``url`` ahead of time.
+
+        Best effort: errors are ignored, the request will simply open its own
+        connection. Nothing is done when a proxy is used, or if the transport
+        was warmed up or used before. With ``background`` the connection is
+        opened in a thread; requests started meanwhile wait for it instead
+        of opening a second connection.
+        """
+        if self.session.proxies:
+            return
+        with self._warmup_lock:
+            if self._warmup_started:
+                return
+            self._warmup_started = True
+        if background:
+            threading.Thread(target=self._warmup, args=(url,), daemon=True).start()
+        else:
+            self._warmup(url)
+
+    def _warmup(self, url):
+        try:
+            # Use the same connection pool as requests will for the request
+            settings = self.session.merge_environment_settings(url, {}, None, None, None)
+            if requests.utils.select_proxy(url, settings['proxies']):
+                return
+            adapter = self.session.get_adapter(url)
+            if hasattr(adapter, 'get_connection_with_tls_context'):
+                request = requests.Request('GET', url).prepare()
+                pool = adapter.get_connection_with_tls_context(
+                    request, settings['verify'], settings['proxies'], settings['cert'])
+            else:
+                pool = adapter.get_connection(url, settings['proxies'])
+            conn = pool._get_conn()
+            try:
+                # Only connect a new connection, never replace an open one
+                if getattr(conn, 'sock', None) is None:
+                    conn.connect()
+            finally:
+                pool._put_conn(conn)
+        except Exception as e:
+            logging.debug('Warmup failed: {0!r}'.format(e))
+        finally:
+            self._warmup_done.set()
+
+    def close(self):
+        self.session.close()
+
+
+class FahrplanClient(object):
+    """Client for the transport.opendata.ch API.
+
+    The client keeps its transport (and thus its connection pool) alive
+    between requests, so it should be created once and reused.
+
+    Args:
+        api_url: Base URL of the API (default ``API_URL``).
+        timeout: Request timeout in seconds.
+        pool_size: Number of keep-alive connections (ignored if a custom
+            transport is given).
+        proxy: Optional HTTP proxy (ignored if a custom transport is given).
+        transport: Optional transport object, see :class:`RequestsTransport`.
+        cache: Optional :class:`fahrplan.cache.ResponseCache` used for
+            connection queries.
+        station_index: Optional :class:`fahrplan.stations.StationIndex` used
+            to resolve station names to IDs before connection queries.
+        coalesce: Whether identical connection queries running at the same
+            time share one API request (default True).
+        select_fields: Whether connection queries only request the members
+            of the response the client reads (``CONNECTION_FIELDS``) if the
+            rest of the response is not kept (default True).
+        rate_limiter: Optional :class:`fahrplan.ratelimit.RateLimiter` all
+            requests have to pass.
+        retries: How often requests failing with a network error or one of
+            ``RETRY_STATUSES`` are retried. The delay follows ``Retry-After``
+            if the API sends it, else jittered exponential backoff starting
+            at ``backoff`` seconds.
+
+    """
+
+    def __init__(self, api_url=None, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE,
+                 proxy=None, transport=None, cache=None, station_index=None, coalesce=True,
+                 rate_limiter=None, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 select_fields=True):
+        self.api_url = api_url or API_URL
+        self.timeout = timeout
+        self.cache = cache
+        self.station_index = station_index
+        self.coalesce = coalesce
+        self.select_fields = select_fields
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self._inflight = {}  # key -> Future of the running call
+        self._inflight_lock = threading.Lock()
+        if transport is None:
+            transport = RequestsTransport(pool_size, proxy)
+        self.transport = transport
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        close = getattr(self.transport, 'close', None)
+        if close is not None:
+            close()
+
+    def warmup(self, background=False):
+        """Open a connection to the API ahead of the first request.
+
+        Does nothing if the transport does not support it.
+        """
+        warmup = getattr(self.transport, 'warmup', None)
+        if warmup is not None:
+            warmup(self.api_url, background)
+
+    def request(self, action, params, timeout=None):
+        """Perform an API request and return the decoded JSON response.
+
+        Raises:
+            NetworkError: If the API could not be reached.
+            ServerError: If the API answered with an error status.
+            InvalidResponseError: If the response is not valid JSON.
+
+        """
+        url = "{}/{}".format(self.api_url, action)
+        response = self._send(url, params, self.timeout if timeout is None else timeout)
+        return self._decode(response)
+
+    def request_if_changed(self, action, params, validator=None, timeout=None):
+        """Perform an API request unless its response did not change.
+
+        The ``ETag`` of the previous response is sent as ``If-None-Match``.
+        If the API doesn't support conditional requests, a digest of the
+        response is compared instead, so that an unchanged response is not
+        decoded again either.
+
+        Args:
+            validator: The validator returned with the previous response.
+
+        Returns:
+            A ``(data, validator)`` tuple, ``data`` is None if the response
+            did not change.
+
+        Raises:
+            The same exceptions as :meth:`request`.
+
+        """
+        etag, digest = validator or (None, None)
+        url = "{}/{}".format(self.api_url, action)
+        headers = {'If-None-Match': etag} if etag else None
+        response = self._send(url, params, self.timeout if timeout is None else timeout,
+                              headers=headers)
+        if response.status_code == 304:
+            logging.debug('Response not modified')
+            return None, validator
+        if response.status_code >= 400:
+            return self._decode(response), validator  # Raises ServerError
+        validator = (response.headers.get('ETag'), hashlib.sha1(response.content).digest())
+        if validator[1] == digest:
+            logging.debug('Response unchanged')
+            return None, validator
+        return self._decode(response), validator
+
+    def _decode(self, response):
+        # Check response status
+        logging.debug('Response status: {0!r}'.format(response.status_code))
+        if response.status_code >= 400:
+            raise ServerError(response.status_code, retry_after_delay(getattr(response, 'headers', None)))
+
+        # Convert response to json
+        try:
+            with timed('decode'):
+                return loads(response.content)
+        except ValueError:
+            logging.debug('Response status code: {0}'.format(response.status_code))
+            logging.debug('Response content: {0!r}'.format(response.content))
+            raise InvalidResponseError('Invalid API response (invalid JSON)')
+
+    def stream(self, action, params, key, timeout=None):
+        """Perform an API request and decode the response incrementally.
+
+        Yields the items of the top level array ``key`` of the response (e.g.
+        ``connections``) as soon as they have been received.
+
+        Raises:
+            The same exceptions as :meth:`request`.
+
+        """
+        url = "{}/{}".format(self.api_url, action)
+        response = self._send(url, params, self.timeout if timeout is None else timeout, stream=True)
+        try:
+            logging.debug('Response status: {0!r}'.format(response.status_code))
+            if response.status_code >= 400:
+                raise ServerError(response.status_code, retry_after_delay(response.headers))
+            download = _Download(response.iter_content(STREAM_CHUNK_SIZE))
+            items = iter(ArrayStream(download, key))
+            try:
+                while True:
+                    with timed('decode'):
+                        item = next(items, _END)
+                    if item is _END:
+                        break
+                    yield item
+                _log_transfer(response, download.size)
+            except ValueError:
+                raise InvalidResponseError('Invalid API response (invalid JSON)')
+            except requests.exceptions.RequestException:
+                raise NetworkError('Connection lost while reading the response.')
+        finally:
+            response.close()
+
+    def _send(self, url, params, timeout, stream=False, headers=None):
+        """Send a request through the rate limiter, retrying transient errors."""
+        limiter = self.rate_limiter
+        attempt = 0
+        while True:
+            if limiter is not None:
+                with timed('rate_limit'):
+                    limiter.acquire()
+            try:
+                if stream:
+                    response = self.transport.get(url, params, timeout, stream=True)
+                elif headers:
+                    response = self.transport.get(url, params, timeout, headers=headers)
+                else:
+                    response = self.transport.get(url, params, timeout)
+            except RequestTimeout:
+                raise
+            except NetworkError:
+                if attempt >= self.retries:
+                    raise
+                delay = backoff_delay(attempt, self.backoff)
+            else:
+                status = response.status_code
+                if status not in RETRY_STATUSES:
+                    if limiter is not None:
+                        limiter.succeeded()
+                    return response
+                delay = retry_after_delay(getattr(response, 'headers', None))
+                if status == 429 and limiter is not None:
+                    limiter.throttled(delay)
+                if attempt >= self.retries or (delay or 0) > MAX_RETRY_DELAY:
+                    return response
+                if delay is None:
+                    delay = backoff_delay(attempt, self.backoff)
+                elif status != 429 or limiter is None:
+                    # Spread the retries of concurrent requests
+                    delay += backoff_delay(0, self.backoff)
+                if stream:
+                    response.close()
+            attempt += 1
+            logging.debug('Retrying {0} in {1:.2f}s (attempt {2})'.format(url, delay, attempt))
+            with timed('retry_wait'):
+                time.sleep(delay)
+
+    def iter_connections(self, request, include_sections=False):
+        """Get the connections of a request while they are being received.
+
+        Like :meth:`get_connections`, but yields parsed connections one at a
+        time as they are decoded from the response stream. The response cache
+        is not used.
+        """
+        if self.station_index is not None:
+            request = self.station_index.resolve_request(request, self)
+        params = _connection_params(request, False, self.select_fields)
+        for connection in self.stream("connections", params, "connections"):
+            with timed('parse'):
+                connection = _parse_connection(connection, include_sections)
+            yield connection
+
+    def get_connections(self, request, include_sections=False, cache=None, keep_raw=True):
+        """Get the connections of a request.
+
+        Args:
+            request: Request dictionary as returned by ``parse_input``.
+            include_sections: Whether to parse all sections (default False).
+            cache: Optional response cache overriding the client's cache.
+            keep_raw: Whether to keep the rest of the API response (default
+                True). If False, only the ``connections`` are returned.
+
+        Returns:
+            The API response with the ``connections`` list replaced by parsed
+            connections (see ``_parse_connection``).
+
+        If the same query is already running in another thread, its result
+        is awaited and shared instead of sending a second request (unless
+        ``coalesce`` is disabled).
+
+        """
+        if self.station_index is not None:
+            request = self.station_index.resolve_request(request, self)
+        if cache is None:
+            cache = self.cache
+        if cache is not None:
+            request = normalize_request(request)
+        key = make_key(self.api_url, 'connections', request, include_sections, keep_raw)
+        if not self.coalesce:
+            return self._get_connections(key, request, include_sections, cache, keep_raw)
+        return self._single_flight(key, self._get_connections, key, request, include_sections,
+                                   cache, keep_raw)
+
+    def _get_connections(self, key, request, include_sections, cache, keep_raw):
+        if cache is not None:
+            with timed('cache'):
+                data = cache.get(key)
+            if data is not None:
+                return data
+        data = self.request("connections", _connection_params(request, keep_raw, self.select_fields))
+        with timed('parse'):
+            connections = [_parse_connection(c, include_sections) for c in data["connections"]]
+        data = _with_connections(data, connections, keep_raw)
+        if cache is not None:
+            with timed('cache'):
+                cache.set(key, data)
+        return data
+
+    def _single_flight(self, key, func, *args):
+        """Call ``func(*args)`` unless a call with the same key is running.
+
+        Callers arriving while the call is running wait for it and get a
+        copy of its result, or its exception.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            logging.debug('Joining in-flight request {0}'.format(key))
+            return _copy_result(future.result())
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+
+_END = object()
+
+
+class _Download(object):
+    """Iterate over the chunks of a streamed response.
+
+    Times the download of every chunk and sums up their ``size``.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.size = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with timed('download'):
+            chunk = next(self._chunks, None)
+        if chunk is None:
+            raise StopIteration
+        self.size += len(chunk)
+        return chunk
+
+
+def _log_transfer(response, size):
+    """Log and count the size of a response body on the wire and decoded.
+
+    Does nothing for responses which don't know the number of bytes they
+    received (``raw.tell()``), e.g. those of custom transports.
+    """
+    tell = getattr(getattr(response, 'raw', None), 'tell', None)
+    if tell is None:
+        return
+    wire = tell()
+    encoding = response.headers.get('Content-Encoding', 'identity')
+    count('bytes_wire', wire)
+    count('bytes_decoded', size)
+    logging.debug('Response body: {0} bytes on the wire ({1}), {2} bytes decoded'.format(
+        wire, encoding, size))
+    if encoding == 'identity' and wire >= 1024:
+        logging.debug('The response was not compressed')
+
+
+def _connection_params(request, keep_raw, select_fields=True):
+    """Return the query parameters of a connections request.
+
+    Unless the whole response is kept, only ``CONNECTION_FIELDS`` are
+    requested.
+    """
+    if keep_raw or not select_fields:
+        return request
+    return dict(request, **{'fields[]': list(CONNECTION_FIELDS)})
+
+
+def _copy_result(data):
+    """Copy a result of ``get_connections`` for another caller.
+
+    The connection records themselves are shared, only the containers the
+    caller might modify are copied.
+    """
+    return dict(data, connections=list(data["connections"]))
+
+
+def _with_connections(data, connections, keep_raw=True):
+    """Replace the raw connections of a response by the parsed ones."""
+    if not keep_raw:
+        return {"connections": connections}
+    data["connections"] = connections
+    return data
+
+
+# Shared clients used by the module level functions, one per proxy setting.
+_default_clients = {}
+_default_clients_lock = threading.Lock()
+
+
+def _get_default_client(proxy=None):
+    with _default_clients_lock:
+        client = _default_clients.get(proxy)
+        if client is None:
+            client = _default_clients[proxy] = FahrplanClient(proxy=proxy)
+        return client
 
 
 def _api_request(action, params, proxy=None):
     """
     Perform an API request on transport.opendata.ch
     """
-    # Send request
-    url = "{}/{}".format(API_URL, action)
-    kwargs = {'params': params}
-    if proxy is not None:
-        kwargs['proxies'] = {'http': proxy}
-    try:
-        response = requests.get(url, **kwargs)
-    except requests.exceptions.ConnectionError:
-        perror('Error: Could not reach network.')
-        sys.exit(1)
-
-    # Check response status
-    logging.debug('Response status: {0!r}'.format(response.status_code))
-    if not response.ok:
-        verbose_status = requests.status_codes._codes[response.status_code][0]
-        perror('Server Error: HTTP {} ({})'.format(response.status_code, verbose_status))
-        sys.exit(1)
-
-    # Convert response to json
-    try:
-        return json.loads(response.text)
-    except ValueError:
-        logging.debug('Response status code: {0}'.format(response.status_code))
-        logging.debug('Response content: {0!r}'.format(response.content))
-        perror('Error: Invalid API response (invalid JSON)')
-        sys.exit(1)
+    return _get_default_client(proxy).request(action, params)
 
 
 def _parse_section(con_section, connection):
     """
     Parse the section of a connection
     """
-    departure = con_section['departure']
-    arrival = con_section['arrival']
-    journey = con_section.get('journey')
-    walk = con_section.get('walk')
-    section = {}
-    section['station_from'] = departure['station']['name']
-    section['station_to'] = arrival['station']['name']
-    if journey is not None:
-        section['travelwith'] = '{} {}'.format(journey['category'], journey['number'])
-    else:
-        section['travelwith'] = ''
-    section['departure'] = dateutil.parser.parse(departure['departure'])
-    section['arrival'] = dateutil.parser.parse(arrival['arrival'])
-    section['platform_from'] = "" if walk else departure['platform']
-    section['platform_to'] = arrival['platform']
-    return section
+    return decode_section(section_fields(con_section))
 
 
 def _parse_connection(connection, include_sections=False):
     """Parse a connection.
 
     Process a connection object as returned from the API and return a
-    dictionary with cleaned data.
+    compact :class:`fahrplan.models.Connection` record with cleaned data.
 
     Args:
         connection: A connection dictionary as returned by the JSON API.
@@ -75,54 +635,32 @@ def _parse_connection(connection, include_sections=False):
             sections in the returned data set or not (default False).
 
     Returns:
-        A dictionary containing cleaned data. If sections are enabled, they are
-        contained in a list.
+        A connection record. If sections are enabled, they are contained in a
+        list, otherwise the list only contains one summary section. Sections
+        are decoded lazily on first access.
     """
-    data = {}
-    walk = False
-
-    def keyfunc(s):
-        return s['departure']['departure']
-    data['change_count'] = str(connection['transfers'])
-    data['travelwith'] = ', '.join(
-        '{} {}'.format(section['journey']['category'], section['journey']['number'])
-        for section
-        in connection['sections']
-        if section['journey'] is not None
-    )
-
-    # Sections
-    con_sections = sorted(connection['sections'], key=keyfunc)
-    data['sections'] = []
+    con_sections = connection['sections']
+    fields = [section_fields(s) for s in con_sections]
+    change_count = str(connection['transfers'])
+    travelwith = ', '.join(f[2] for f in fields if f[2])
+
+    # Sections, ordered by departure
+    fields.sort(key=lambda f: f[3])
     if include_sections:
         # Full display
-        for con_section in con_sections:
-            section = _parse_section(con_section, connection)
-            if con_section.get('walk'):
-                walk = True
-            data["sections"].append(section)
-    else:
-        # Shortened display, parse only departure and arrivals sections
-        section = _parse_section(con_sections[0], connection)
-        to = _parse_section(con_sections[-1], connection)
-        for p in ["station_to", "arrival"]:
-            section[p] = to[p]
-        # Get information from connection
-        for p in ["travelwith", "change_count"]:
-            section[p] = data[p]
-        data['sections'] = [section]
-
-    # Walk
-    if walk:
-        data['travelwith'] += ', Walk'
+        if any(s.get('walk') for s in con_sections):
+            travelwith += ', Walk'
+        return Connection(change_count, travelwith, tuple(fields))
 
-    return data
+    # Shortened display, only departure of the first and arrival of the last
+    # section, with information from the connection
+    first, last = fields[0], fields[-1]
+    summary = (first[0], last[1], travelwith, first[3], last[4], first[5], first[6])
+    return Connection(change_count, travelwith, (summary,), summary=True)
 
 
-def get_connections(request, include_sections=False, proxy=None):
+def get_connections(request, include_sections=False, proxy=None, cache=None, keep_raw=True):
     """
     Get the connections of a request
     """
-    data = _api_request("connections", request, proxy)
-    data["connections"] = [_parse_connection(c, include_sections) for c in data["connections"]]
-    return data
+    return _get_default_client(proxy).get_connections(request, include_sections, cache, keep_raw)
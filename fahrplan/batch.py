@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Batch mode (``fahrplan --batch FILE``).
+
+Every line of the input is a query as accepted on the command line. The
+queries are fetched concurrently with one shared client, so all requests use
+the same pool of keep-alive connections. The requests run with ``BULK``
+priority, so a rate limiter shared with interactive queries lets those go
+first. One JSON object is written per query (newline-delimited JSON),
+either in input order or as soon as a result is available.
+
+Successful queries produce ``{"line": 1, "query": "...", "request": {...},
+"connections": [...]}``, failed ones ``{"line": 2, "query": "...",
+"error": "..."}``. Blank lines and lines starting with ``#`` are skipped.
+"""
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from .api import FahrplanError
+from .output import dumps
+from .parser import parse_input
+from .ratelimit import priority, BULK
+
+DEFAULT_WORKERS = 4
+
+
+def _queries(lines):
+    """Yield ``(line number, query)`` of the non-empty, non-comment lines."""
+    for number, line in enumerate(lines, 1):
+        query = line.strip()
+        if query and not query.startswith('#'):
+            yield number, query
+
+
+def _run_query(client, number, query, include_sections, now):
+    result = {'line': number, 'query': query}
+    try:
+        request, language = parse_input(query.split(), now)
+        result['request'] = request
+        with priority(BULK):
+            data = client.get_connections(request, include_sections, keep_raw=False)
+    except (ValueError, FahrplanError) as e:
+        logging.debug('Batch line {0}: {1}'.format(number, e))
+        result['error'] = str(e)
+        return result
+    except Exception as e:
+        # A bug or e.g. a broken cache must not end the whole batch
+        logging.exception('Batch line %d failed', number)
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        return result
+    result['connections'] = data['connections']
+    return result
+
+
+def iter_results(client, lines, workers=DEFAULT_WORKERS, ordered=True, include_sections=False):
+    """Run the queries of a batch concurrently.
+
+    The input is consumed lazily, at most ``2 * workers`` queries are in
+    flight at any time.
+
+    Args:
+        client: The :class:`fahrplan.api.FahrplanClient` to use.
+        lines: Iterable of query strings, e.g. an open file.
+        workers: Number of concurrent requests.
+        ordered: Whether to yield the results in input order (default) or as
+            soon as they are available.
+        include_sections: Whether to include all sections of a connection.
+
+    Returns:
+        An iterator of result dictionaries (see the module documentation).
+
+    """
+    now = datetime.now()
+    queries = _queries(lines)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fahrplan-batch') as executor:
+        while True:
+            for number, query in queries:
+                pending.append(executor.submit(_run_query, client, number, query, include_sections, now))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+
+
+def run(client, lines, out, workers=DEFAULT_WORKERS, ordered=True, include_sections=False):
+    """Write the results of a batch to ``out`` as newline-delimited JSON.
+
+    Returns:
+        The number of failed queries.
+
+    """
+    failed = 0
+    for result in iter_results(client, lines, workers, ordered, include_sections):
+        if 'error' in result:
+            failed += 1
+        out.write(dumps(result) + '\n')
+        out.flush()
+    return failed
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Departure boards of several stations (``fahrplan board STATION...``).
+
+The boards (``/v1/stationboard``) of all stations are fetched concurrently
+over the pooled client and merged into one stream ordered by departure time
+with a k-way heap merge, so the combined board is never sorted as a whole.
+
+:class:`Board` keeps a bounded window of the upcoming departures and
+refreshes it incrementally: the boards are fetched with conditional
+requests, so unchanged boards are not parsed again, departures are dropped
+as they leave and a station that can't be reached keeps its last board.
+"""
+import heapq
+import itertools
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .api import FahrplanError
+from .display import _format_time, _plain_line
+from .helpers import perror
+from .models import decode_departure
+
+# Members of a station board response used for departures.
+BOARD_FIELDS = (
+    'station/name',
+    'stationboard/stop/departure',
+    'stationboard/stop/delay',
+    'stationboard/stop/platform',
+    'stationboard/stop/prognosis/platform',
+    'stationboard/category',
+    'stationboard/number',
+    'stationboard/to',
+)
+
+# Default number of departures kept and concurrent requests.
+DEFAULT_WINDOW = 40
+DEFAULT_WORKERS = 8
+
+# Columns of the board: (title, width). The last column isn't padded.
+BOARD_COLUMNS = (
+    ('Time', 5),
+    ('Delay', 5),
+    ('Station', 24),
+    ('Platform', 8),
+    ('With', 8),
+    ('To', 0),
+)
+
+
+def _departure_key(departure):
+    return departure.departure
+
+
+def parse_board(data, station=None):
+    """Return the departures of a station board response, in departure order."""
+    station = (data.get('station') or {}).get('name') or station
+    departures = [decode_departure(entry, station) for entry in data.get('stationboard') or []]
+    # The API sends the departures in order, so this is a single pass
+    departures.sort(key=_departure_key)
+    return departures
+
+
+def merge(boards, window=None):
+    """Merge ordered lists of departures into one ordered list.
+
+    Args:
+        boards: Iterable of lists of departures, each in departure order.
+        window: Maximum number of departures returned.
+
+    """
+    return list(itertools.islice(heapq.merge(*boards, key=_departure_key), window))
+
+
+class Board(object):
+    """Merged departure board of several stations.
+
+    Args:
+        client: The :class:`fahrplan.api.FahrplanClient` to use, its pool
+            size should be at least ``workers``.
+        stations: Names of the stations.
+        window: Number of upcoming departures kept (also requested per
+            station, no station can contribute more).
+        workers: Number of concurrent requests.
+
+    Attributes:
+        departures: The upcoming departures after the last refresh.
+        errors: Dictionary of station name to the error of its last fetch.
+
+    """
+
+    def __init__(self, client, stations, window=DEFAULT_WINDOW, workers=DEFAULT_WORKERS):
+        self.client = client
+        self.stations = list(stations)
+        self.window = window
+        self.departures = []
+        self.errors = {}
+        self._boards = {}  # station -> departures
+        self._validators = {}  # station -> validator of the last response
+        self._params = {}  # station -> request parameters
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fahrplan-board')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _request_params(self, station):
+        params = self._params.get(station)
+        if params is None:
+            params = {'station': station, 'limit': self.window, 'fields[]': list(BOARD_FIELDS)}
+            index = self.client.station_index
+            id = index.resolve(station, self.client) if index is not None else None
+            if id is not None:
+                params = dict(params, id=id)
+                del params['station']
+            self._params[station] = params
+        return params
+
+    def _fetch(self, station):
+        """Return the departures of a station, or None if unchanged."""
+        data, self._validators[station] = self.client.request_if_changed(
+            'stationboard', self._request_params(station), self._validators.get(station))
+        if data is None:
+            return None
+        return parse_board(data, station)
+
+    def refresh(self, now=None):
+        """Fetch the boards and return the merged upcoming departures.
+
+        Departures which have left before ``now`` (including their delay)
+        are dropped. Stations failing to load keep their previous board, the
+        errors are stored in ``errors``.
+        """
+        futures = [(station, self._executor.submit(self._fetch, station)) for station in self.stations]
+        self.errors = {}
+        for station, future in futures:
+            try:
+                departures = future.result()
+            except FahrplanError as e:
+                logging.debug('Board of {0!r} failed: {1}'.format(station, e))
+                self.errors[station] = e
+                continue
+            if departures is not None:
+                self._boards[station] = departures[:self.window]
+        now = now or datetime.now(timezone.utc)
+        for station, departures in self._boards.items():
+            if departures and departures[0].expected < now:
+                self._boards[station] = [d for d in departures if d.expected >= now]
+        self.departures = merge(self._boards.values(), self.window)
+        return self.departures
+
+
+def board_lines(departures):
+    """Return the lines of a board table."""
+    lines = [_plain_line([title for title, width in BOARD_COLUMNS], BOARD_COLUMNS),
+             _plain_line(['-' * (width or len(title)) for title, width in BOARD_COLUMNS], BOARD_COLUMNS)]
+    for departure in departures:
+        lines.append(_plain_line([
+            _format_time(departure.departure),
+            '+{}'.format(departure.delay) if departure.delay else '',
+            departure.station,
+            departure.platform or '-',
+            departure.travelwith,
+            departure.to,
+        ], BOARD_COLUMNS))
+    return [line.rstrip('\n') for line in lines]
+
+
+def run(client, stations, window=DEFAULT_WINDOW, workers=DEFAULT_WORKERS, output_format='table',
+        out=None, err=None, interval=None, width=None, tty=None):
+    """Show the merged departure board of several stations.
+
+    Args:
+        output_format: ``table`` or ``plain`` for a table, ``json`` or
+            ``ndjson`` for departure objects.
+        interval: Refresh the board every ``interval`` seconds until
+            interrupted (tables only).
+        width: Width of the terminal, see :class:`fahrplan.watch.Screen`.
+        tty: Whether ``out`` is a terminal, see :class:`fahrplan.watch.Screen`.
+
+    Returns:
+        The exit status.
+
+    """
+    from .watch import Screen
+    out = out or sys.stdout
+    err = err or sys.stderr
+    screen = Screen(out, tty, width)
+    with Board(client, stations, window, workers) as board:
+        try:
+            while True:
+                start = time.time()
+                departures = board.refresh()
+                for station, error in sorted(board.errors.items()):
+                    perror('Error: {}: {}'.format(station, error), file=err)
+                if len(board.errors) == len(stations) and not departures:
+                    return 1
+                if output_format in ('json', 'ndjson'):
+                    from . import output
+                    output.WRITERS[output_format](departures, out)
+                    return 0
+                if interval is None:
+                    if departures:
+                        screen.update(board_lines(departures))
+                    else:
+                        print('No departures found', file=out)
+                    return 0
+                lines = board_lines(departures)
+                if screen.tty:
+                    lines += ['', 'Updated {}, every {:g}s (Ctrl-C to stop)'.format(
+                        time.strftime('%H:%M:%S'), interval)]
+                screen.update(lines)
+                time.sleep(max(0, interval - (time.time() - start)))
+        except KeyboardInterrupt:
+            return 0
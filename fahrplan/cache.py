@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Persistent response cache shared between processes.
+
+Parsed API responses are pickled into a SQLite database running in WAL mode,
+so any number of CLI processes and worker threads can read and write the
+same cache file concurrently. A hit skips both the HTTP round trip and the
+JSON decoding.
+"""
+import os
+import json
+import time
+import pickle
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+# Default time to live of a cache entry in seconds and maximum number of
+# entries before the least recently used ones are evicted.
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1000
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+'''
+
+
+def default_cache_path():
+    """Return the default cache file location (honours ``XDG_CACHE_HOME``)."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'fahrplan', 'responses.sqlite')
+
+
+def normalize_request(request, now=None):
+    """Resolve relative dates and times of a request to absolute values.
+
+    ``parse_input`` leaves the time out if none was given (meaning "now") and
+    returns relative dates like "tomorrow" as ``datetime`` objects. Both are
+    replaced by absolute ``%Y/%m/%d`` and ``%H:%M`` strings, so identical
+    queries issued in the same minute produce identical requests.
+
+    Args:
+        request: Request dictionary as returned by ``parse_input``.
+        now: Reference time (default ``datetime.now()``).
+
+    Returns:
+        A new, normalized request dictionary.
+
+    """
+    if now is None:
+        now = datetime.now()
+    data = dict(request)
+    date = data.get('date')
+    if isinstance(date, datetime):
+        data['date'] = date.strftime('%Y/%m/%d')
+    elif date is None:
+        data['date'] = now.strftime('%Y/%m/%d')
+    if data.get('time') is None:
+        data['time'] = now.strftime('%H:%M')
+    return data
+
+
+def make_key(*parts):
+    """Build a stable cache key from JSON serializable parts."""
+    return json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+
+
+class ResponseCache(object):
+    """SQLite backed cache with TTL expiry and LRU size eviction.
+
+    Values are stored pickled, so only point this at a cache file you own.
+
+    Args:
+        path: Path of the cache database (default ``default_cache_path()``).
+        ttl: Time to live of an entry in seconds.
+        max_entries: Maximum number of entries kept in the cache.
+
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def _connect(self):
+        # sqlite3 connections must not be shared between threads or forked
+        # processes, so keep one per thread and process.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """Return the cached value for ``key`` or None if missing or expired."""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if now - created > self.ttl:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        logging.debug('Cache hit: {0}'.format(key))
+        try:
+            return pickle.loads(value)
+        except Exception:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            return None
+
+    def set(self, key, value):
+        """Store ``value`` under ``key`` and evict old entries if needed."""
+        conn = self._connect()
+        now = time.time()
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO responses (key, value, created, accessed) '
+                         'VALUES (?, ?, ?, ?)', (key, sqlite3.Binary(blob), now, now))
+            conn.execute('DELETE FROM responses WHERE created < ?', (now - self.ttl,))
+            conn.execute('DELETE FROM responses WHERE key IN ('
+                         'SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def clear(self):
+        """Remove all entries."""
+        self._connect().execute('DELETE FROM responses')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""Daemon mode (``fahrplan --daemon``) and its client (``fahrplan-client``).
+
+The daemon is a long-lived process which keeps the parser, the HTTP
+connection pools, the response cache and the station index warm and serves
+queries over a Unix domain socket. ``fahrplan-client`` accepts the same
+arguments as ``fahrplan``, forwards them to the daemon and prints the
+result. If no daemon is running, the query is run in-process instead.
+
+The protocol is one JSON object per line in both directions. The client
+sends ``{"argv": [...], "width": 120, "color": true}`` and the daemon answers
+with ``{"stdout": "...", "stderr": "...", "status": 0}``. A connection may be
+used for any number of queries.
+
+This module is imported by every ``fahrplan-client`` call and only imports
+the rest of the package when it runs a query itself.
+"""
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import threading
+import socketserver
+
+# Arguments which are never forwarded to the daemon, the query is run in the
+# client process instead (profiling measures the local process).
+LOCAL_ARGS = frozenset(['--daemon', '--interactive', '-I', '--watch', '-w', '--batch', '--profile',
+                        '--profile-cpu', '--profile-memory', '--offline', 'import-gtfs', '--snapshot',
+                        'snapshot'])
+
+
+def default_socket_path():
+    """Return the socket path of the daemon.
+
+    ``$FAHRPLAN_SOCKET`` if set, else ``fahrplan.sock`` in
+    ``$XDG_RUNTIME_DIR`` or in a private per-user directory in the temporary
+    directory (see :func:`_private_directory`).
+    """
+    path = os.environ.get('FAHRPLAN_SOCKET')
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'fahrplan.sock')
+    return os.path.join(_private_directory(), 'fahrplan.sock')
+
+
+def _private_directory():
+    return os.path.join(os.environ.get('TMPDIR') or '/tmp', 'fahrplan-{}'.format(os.getuid()))
+
+
+def _check_private_directory(directory):
+    """Make sure only the current user can access ``directory``.
+
+    Raises:
+        RuntimeError: If it belongs to another user or others may access it.
+
+    """
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError('{} is not a private directory of the current user'.format(directory))
+
+
+def _check_peer(sock, path, uid=None):
+    """Make sure the daemon at the other end of ``sock`` runs as ``uid``.
+
+    Another user could create the socket first and answer with forged
+    output. The peer credentials are checked where available, else the
+    owner of the socket file.
+
+    Raises:
+        PermissionError: If the daemon belongs to another user.
+
+    """
+    uid = os.getuid() if uid is None else uid
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        owner = struct.unpack('3i', creds)[1]
+    else:
+        owner = os.stat(path).st_uid
+    if owner != uid:
+        raise PermissionError('The daemon on {} belongs to another user'.format(path))
+
+
+def request(argv, path=None, width=None, color=None, timeout=None):
+    """Run a query in the daemon.
+
+    Args:
+        argv: Command line arguments as passed to ``fahrplan``.
+        path: Socket of the daemon (default ``default_socket_path()``).
+        width: Width of the output (default 80).
+        color: Whether the output may contain terminal colors.
+        timeout: Socket timeout in seconds (default: none).
+
+    Returns:
+        A dictionary with the ``stdout``, ``stderr`` and ``status`` of the
+        query.
+
+    Raises:
+        OSError: If no daemon of the current user is listening on the socket
+            or the connection failed.
+
+    """
+    message = json.dumps({'argv': list(argv), 'width': width, 'color': color})
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        path = path or default_socket_path()
+        sock.connect(path)
+        _check_peer(sock, path)
+        with sock.makefile('rwb') as f:
+            f.write(message.encode('utf-8') + b'\n')
+            f.flush()
+            line = f.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise ConnectionError('The daemon closed the connection')
+    return json.loads(line.decode('utf-8'))
+
+
+def _pop_socket_arg(argv):
+    """Remove ``--socket PATH`` from the arguments, return the path."""
+    for i, arg in enumerate(argv):
+        if arg == '--socket' and i + 1 < len(argv):
+            path = argv[i + 1]
+            del argv[i:i + 2]
+            return path
+        if arg.startswith('--socket='):
+            del argv[i]
+            return arg.split('=', 1)[1]
+    return None
+
+
+def client_main():
+    """Entry point of ``fahrplan-client``."""
+    argv = sys.argv[1:]
+    if not LOCAL_ARGS.intersection(arg.split('=', 1)[0] for arg in argv):
+        remote_argv = list(argv)
+        path = _pop_socket_arg(remote_argv)
+        tty = sys.stdout.isatty()
+        width = os.get_terminal_size(sys.stdout.fileno()).columns if tty else None
+        try:
+            response = request(remote_argv, path, width=width, color=tty or None)
+        except OSError:
+            pass  # No daemon running, run the query in-process
+        else:
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            sys.exit(response['status'])
+    from .main import main
+    main(argv)
+
+
+def _serve_client(server, rfile, wfile):
+    """Answer the queries sent over one connection."""
+    import io
+    import logging
+    from . import main
+    for line in rfile:
+        stdout, stderr = io.StringIO(), io.StringIO()
+        try:
+            message = json.loads(line.decode('utf-8'))
+            argv = [str(arg) for arg in message['argv']]
+        except (ValueError, KeyError, TypeError) as e:
+            stderr.write('Error: Invalid request: {}\n'.format(e))
+            status = 2
+        else:
+            try:
+                status = main.run(argv, stdout, stderr, client_factory=server.client,
+                                  width=message.get('width'), color=message.get('color'),
+                                  interactive=False)
+            except Exception as e:
+                logging.exception('Query %r failed', argv)
+                stderr.write('Error: {}\n'.format(e))
+                status = 1
+            server.save_index()
+        response = {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'status': status}
+        wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        wfile.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            _serve_client(self.server, self.rfile, self.wfile)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server running queries with shared clients.
+
+    Args:
+        path: Socket path. A stale socket file is replaced.
+        options: Command line options of the daemon. ``--cache``,
+            ``--resolve``, ``--api-url`` and ``--rate`` are applied to all
+            queries.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, path, options):
+        self.path = path
+        self.options = options
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._cache = None
+        self._station_index = None
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if directory == _private_directory():
+            _check_private_directory(directory)
+        _remove_stale_socket(path)
+        # Only the owner may connect
+        umask = os.umask(0o177)
+        try:
+            socketserver.ThreadingUnixStreamServer.__init__(self, path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def client(self, options):
+        """Return the shared ``FahrplanClient`` for the options of a query."""
+        from .api import FahrplanClient
+        api_url = options.api_url or self.options.api_url
+        use_cache = options.cache or self.options.cache
+        resolve = options.resolve or self.options.resolve
+        rate = options.rate or self.options.rate
+        burst = options.burst or self.options.burst
+        key = (api_url, options.proxy, use_cache, resolve, rate, burst, options.retries)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                if use_cache and self._cache is None:
+                    from .cache import ResponseCache, DEFAULT_TTL
+                    self._cache = ResponseCache(
+                        ttl=DEFAULT_TTL if self.options.cache_ttl is None else self.options.cache_ttl)
+                if resolve and self._station_index is None:
+                    from .stations import StationIndex
+                    self._station_index = StationIndex.load()
+                rate_limiter = None
+                if rate:
+                    # Limiters with the same state file share one budget
+                    from .ratelimit import RateLimiter, default_state_path
+                    rate_limiter = RateLimiter(rate, burst, default_state_path())
+                client = self._clients[key] = FahrplanClient(
+                    api_url=api_url, proxy=options.proxy,
+                    cache=self._cache if use_cache else None,
+                    station_index=self._station_index if resolve else None,
+                    rate_limiter=rate_limiter, retries=options.retries)
+                # Once per client, later queries reuse its pooled connections
+                client.warmup(background=True)
+        return client
+
+    def save_index(self):
+        """Store the station index if queries have added to it."""
+        with self._lock:
+            if self._station_index is not None and self._station_index.dirty:
+                self._station_index.save()
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.save_index()
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+def _remove_stale_socket(path):
+    """Remove a socket file left behind by a daemon which is gone.
+
+    Raises:
+        RuntimeError: If a daemon is still listening on the socket.
+
+    """
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        os.unlink(path)
+    else:
+        raise RuntimeError('A daemon is already listening on {}'.format(path))
+    finally:
+        sock.close()
+
+
+def create_server(options, path=None):
+    """Create (but don't start) the daemon server for the command line options."""
+    return DaemonServer(path or options.socket or default_socket_path(), options)
+
+
+def serve(options):
+    """Run the daemon until it is interrupted or terminated.
+
+    Returns:
+        The exit status.
+
+    """
+    import signal
+    import logging
+    from .helpers import perror
+    try:
+        server = create_server(options)
+    except (RuntimeError, OSError) as e:
+        perror('Error:', e)
+        return 1
+    # Terminate cleanly (removing the socket) on SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logging.info('Listening on %s', server.path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    client_main()
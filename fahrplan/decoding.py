@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""JSON decoding of API responses.
+
+Whole responses are decoded with a pluggable backend: ``orjson`` (decodes
+straight from bytes, ``pip install fahrplan[fast]``) if it is installed,
+the standard library ``json`` module otherwise.
+
+:class:`ArrayStream` decodes the items of one top level array of a
+response (e.g. ``connections``) one at a time while the body is still
+being downloaded.
+"""
+import re
+import json
+import codecs
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+BACKENDS = {'json': json.loads}
+if orjson is not None:
+    BACKENDS['orjson'] = orjson.loads
+
+_backend = 'orjson' if orjson is not None else 'json'
+_loads = BACKENDS[_backend]
+
+
+def set_backend(name):
+    """Select the JSON backend used by ``loads`` (one of ``BACKENDS``)."""
+    global _backend, _loads
+    if name not in BACKENDS:
+        raise ValueError('Unknown or unavailable JSON backend: "%s"' % name)
+    _backend, _loads = name, BACKENDS[name]
+
+
+def get_backend():
+    """Return the name of the JSON backend in use."""
+    return _backend
+
+
+def loads(data):
+    """Decode a JSON document given as bytes or str.
+
+    Raises:
+        ValueError: If the document is not valid JSON.
+
+    """
+    return _loads(data)
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class ArrayStream(object):
+    """Incrementally decode the items of a top level array of a JSON object.
+
+    Iterating yields the items of the array stored under ``key`` as soon as
+    they are complete. All other members of the top level object are
+    available in ``members`` once the iteration is finished.
+
+    Args:
+        chunks: Iterable of ``bytes`` chunks of a UTF-8 encoded document.
+        key: Name of the top level member containing the array.
+
+    Raises:
+        ValueError: (while iterating) If the document is not valid JSON.
+
+    """
+
+    def __init__(self, chunks, key):
+        self.key = key
+        self.members = {}
+        self._chunks = iter(chunks)
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Append the next chunk to the buffer, return False at the end."""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            text = self._text.decode(chunk)
+            if text:
+                self._buf = self._buf[self._pos:] + text
+                self._pos = 0
+                return True
+        self._buf = self._buf[self._pos:] + self._text.decode(b'', final=True)
+        self._pos = 0
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Skip whitespace and return the next character."""
+        while True:
+            self._pos = _whitespace.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON document')
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError('Expected one of {!r} at position {}, got {!r}'.format(chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next complete value, reading more data as needed."""
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                value, end = None, None
+            # A value ending at the end of the buffer (e.g. a number) might
+            # continue in the next chunk.
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            # Read at least as much as is buffered to stay linear on large
+            # values.
+            pending = len(self._buf) - self._pos
+            while len(self._buf) - self._pos < 2 * pending and self._fill():
+                pass
+            if end is None and self._eof and len(self._buf) - self._pos == pending:
+                raise ValueError('Invalid or truncated JSON document')
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            name = self._value()
+            self._expect(':')
+            if name == self.key and self._peek() == '[':
+                self._pos += 1
+                if self._peek() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.members[name] = self._value()
+            if self._expect(',}') == '}':
+                return
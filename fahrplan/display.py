@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-from rich.table import Table
 
 
 # Output formats
@@ -8,34 +7,60 @@ class Formats(object):
     FULL = 1
 
 
+# Columns of the plain renderer: (title, width). The last column isn't padded.
+PLAIN_COLUMNS = (
+    ('#', 3),
+    ('Station', 28),
+    ('Platform', 8),
+    ('Date', 8),
+    ('Time', 5),
+    ('Duration', 8),
+    ('Changes', 7),
+    ('With', 0),
+)
+
+
+def _format_date(value):
+    return '%02d/%02d/%02d' % (value.day, value.month, value.year % 100)
+
+
+def _format_time(value):
+    return '%02d:%02d' % (value.hour, value.minute)
+
+
+def _section_cells(section):
+    """
+    Format the cells of a section once.
+
+    Returns the station, platform, date, time, duration and "with" cells as
+    (departure line, arrival line) tuples.
+    """
+    departure = section['departure']
+    arrival = section['arrival']
+    return (
+        (section['station_from'], section['station_to']),
+        (section.get('platform_from') or '-', section.get('platform_to') or '-'),
+        (_format_date(departure), _format_date(arrival)),
+        (_format_time(departure), _format_time(arrival)),
+        (str(arrival - departure).rsplit(':', 1)[0], ' '),
+        (section['travelwith'], ' '),
+    )
+
+
 def _get_connection_row(i, connection):
     """
     Get table row for connection.
     """
-    sections = connection['sections']
-    # Create row
-    row = [str(i)]
-    for p in [
-            lambda x: [x['station_from'], x['station_to']],  # Station
-            lambda x: [x.get('platform_from') or '-', x.get('platform_to') or '-'],  # Platform
-            lambda x: [x[q].strftime('%d/%m/%y') for q in ['departure', 'arrival']],  # Date
-            lambda x: [x[q].strftime('%H:%M') for q in ['departure', 'arrival']],  # Time
-            lambda x: [str((x['arrival'] - x['departure'])).rsplit(':', 1)[0], ' '],  # Duration
-            None,
-            lambda x: [x['travelwith'], ' '],  # With
-    ]:
-        if p is None:
-            row.append(connection['change_count'])
-        else:
-            inner = ['\n'.join(p(s)) for s in sections]
-            row.append('\n \n'.join(inner))
-    return row
+    cells = [_section_cells(s) for s in connection['sections']]
+    columns = ['\n \n'.join('\n'.join(c[column]) for c in cells) for column in range(6)]
+    return [str(i)] + columns[:5] + [connection['change_count'], columns[5]]
 
 
 def connectionsTable(connections, output_format):
     """
     Get connections in the given output format.
     """
+    from rich.table import Table
     table = Table(show_lines=True)
     # Alignments
     # Define columns
@@ -52,3 +77,46 @@ def connectionsTable(connections, output_format):
         table.add_row(*_get_connection_row(i, connection))
     # Display
     return table
+
+
+def _plain_line(values, columns=PLAIN_COLUMNS):
+    parts = []
+    for (title, width), value in zip(columns, values):
+        if width and len(value) > width:
+            value = value[:width - 1] + '…'
+        parts.append(value.ljust(width))
+    return '  '.join(parts).rstrip() + '\n'
+
+
+def printPlainTable(connections, out):
+    """
+    Write connections as a plain text table with fixed column widths.
+
+    Every connection is written as soon as it is taken from the
+    ``connections`` iterable, nothing is measured in advance. Returns the
+    number of connections written; the header is only written if there is
+    at least one. All sections of a connection are written, so the output
+    format is chosen by fetching the sections or not.
+    """
+    count = 0
+    for i, connection in enumerate(connections):
+        lines = []
+        if not i:
+            lines.append(_plain_line([title for title, width in PLAIN_COLUMNS]))
+            lines.append(_plain_line(['-' * (width or len(title)) for title, width in PLAIN_COLUMNS]))
+        else:
+            lines.append('\n')
+        for j, cells in enumerate(_section_cells(s) for s in connection['sections']):
+            for k in range(2):
+                first = not j and not k
+                lines.append(_plain_line([
+                    str(i) if first else '',
+                    cells[0][k], cells[1][k], cells[2][k], cells[3][k],
+                    cells[4][k].strip(),
+                    connection['change_count'] if first else '',
+                    cells[5][k].strip(),
+                ]))
+        out.write(''.join(lines))
+        out.flush()
+        count += 1
+    return count
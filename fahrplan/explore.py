@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Exploration of via variants of a query (``--explore``).
+
+The API returns a handful of connections per query, chosen by its own
+criteria, so a connection over a different hub that arrives earlier or
+needs fewer changes may never be returned. Exploring sends the query
+itself together with one variant per via station concurrently over the
+pooled client, so it takes about as long as the slowest single request.
+
+Journeys returned by several variants are counted once, and only the
+Pareto-optimal ones are kept: a connection is dropped if another one is at
+least as good in arrival time, number of changes and duration, and better
+in one of them. For arrival time queries the departure time (as late as
+possible) takes the place of the arrival time.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import FahrplanError
+from .stations import fold
+
+# Via stations tried if none are given: the main hubs of the Swiss network.
+DEFAULT_VIAS = (
+    'Zürich HB',
+    'Bern',
+    'Basel SBB',
+    'Olten',
+    'Luzern',
+    'Lausanne',
+    'Genève',
+    'Biel/Bienne',
+    'Fribourg/Freiburg',
+    'Aarau',
+    'Zug',
+    'Arth-Goldau',
+    'Winterthur',
+    'Spiez',
+    'Visp',
+    'Bellinzona',
+)
+
+DEFAULT_WORKERS = 8
+
+
+def variants(request, vias=None):
+    """Return the request followed by one variant per via station.
+
+    Via stations matching the origin, the destination or the request's own
+    via are skipped, as are duplicates. Names match if one is a prefix of
+    the other after folding, so "basel" skips "Basel SBB".
+    """
+    seen = [fold(request[key]) for key in ('from', 'to', 'via') if request.get(key)]
+    requests = [request]
+    for via in DEFAULT_VIAS if vias is None else vias:
+        folded = fold(via)
+        if any(folded.startswith(name) or name.startswith(folded) for name in seen):
+            continue
+        seen.append(folded)
+        requests.append(dict(request, via=via))
+    return requests
+
+
+def journey_key(connection):
+    """Return a key identifying the journey of a connection."""
+    return (connection.travelwith,) + tuple(
+        (s.station_from, s.departure, s.station_to, s.arrival) for s in connection.sections)
+
+
+def objectives(connection, arrival_time=False):
+    """Return the criteria minimized by :func:`pareto_front`.
+
+    That is the arrival time (or the negated departure time for arrival time
+    queries), the number of changes and the duration in seconds.
+    """
+    sections = connection.sections
+    departure, arrival = sections[0].departure, sections[-1].arrival
+    first = -departure.timestamp() if arrival_time else arrival.timestamp()
+    return (first, int(connection.change_count or 0), (arrival - departure).total_seconds())
+
+
+def pareto_front(connections, arrival_time=False):
+    """Return the connections not dominated by another one, by departure.
+
+    Journeys occurring more than once are returned once.
+    """
+    candidates = {}
+    for connection in connections:
+        candidates.setdefault(journey_key(connection), connection)
+    scored = sorted(((objectives(c, arrival_time), c) for c in candidates.values()),
+                    key=lambda item: item[0])
+    front = []
+    for score, connection in scored:
+        # Sorted lexicographically, a dominating connection comes first
+        if not any(kept[1] <= score[1] and kept[2] <= score[2] and kept != score for kept, _ in front):
+            front.append((score, connection))
+    return sorted((c for _, c in front), key=lambda c: c.sections[0].departure)
+
+
+def explore(client, request, vias=None, workers=DEFAULT_WORKERS, include_sections=False):
+    """Query the via variants of a request concurrently and merge them.
+
+    Args:
+        client: The client to use, its pool size should be at least
+            ``workers``.
+        request: Request dictionary as returned by ``parse_input``.
+        vias: Via stations to try (default ``DEFAULT_VIAS``).
+        workers: Number of concurrent requests.
+        include_sections: Whether to parse all sections.
+
+    Returns:
+        The Pareto-optimal connections, see :func:`pareto_front`.
+
+    Raises:
+        FahrplanError: If the request itself fails. Failing variants (e.g.
+            via stations that aren't found) are skipped.
+
+    """
+    requests = variants(request, vias)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fahrplan-explore') as executor:
+        futures = [executor.submit(client.get_connections, r, include_sections, keep_raw=False)
+                   for r in requests]
+    connections = []
+    for variant, future in zip(requests, futures):
+        try:
+            connections.extend(future.result()['connections'])
+        except FahrplanError as e:
+            if variant is request:
+                raise
+            logging.debug('Variant via {0!r} failed: {1}'.format(variant['via'], e))
+    return pareto_front(connections, bool(int(request.get('isArrivalTime') or 0)))
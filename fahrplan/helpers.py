@@ -1,7 +1,43 @@
 # -*- coding: utf-8 -*-
 import functools
 import sys
+from datetime import datetime, timedelta, timezone
 
 
 # Helper function to print directly to sys.stderr
 perror = functools.partial(print, file=sys.stderr)
+
+
+# Cache of tzinfo objects by UTC offset string (e.g. "+0200")
+_tzinfos = {}
+
+
+def _tzinfo(offset):
+    tz = _tzinfos.get(offset)
+    if tz is None:
+        if offset[0] not in '+-' or not offset[1:].isdigit():
+            return None
+        minutes = int(offset[1:3]) * 60 + int(offset[3:5])
+        tz = timezone(timedelta(minutes=-minutes if offset[0] == '-' else minutes))
+        _tzinfos[offset] = tz
+    return tz
+
+
+def parse_timestamp(value):
+    """Parse a timestamp as sent by the API.
+
+    The API always uses the format ``2024-10-16T15:02:00+0200``, which is
+    decoded directly with a cached tzinfo object. Anything else falls back to
+    the (much slower) ``dateutil.parser.parse``.
+    """
+    if (len(value) == 24 and value[4] == '-' and value[7] == '-' and value[10] == 'T'
+            and value[13] == ':' and value[16] == ':'):
+        tz = _tzinfo(value[19:])
+        if tz is not None:
+            try:
+                return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                                int(value[11:13]), int(value[14:16]), int(value[17:19]), 0, tz)
+            except ValueError:
+                pass
+    import dateutil.parser
+    return dateutil.parser.parse(value)
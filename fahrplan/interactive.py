@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Interactive shell (``fahrplan --interactive``).
+
+All queries of a session share one process, one HTTP session and one result
+cache. While a page of connections is displayed, the previous and the next
+page are fetched in the background, so ``earlier`` and ``later`` are
+usually answered instantly.
+"""
+import cmd
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import meta
+from .api import FahrplanError, ServerError
+from .cache import normalize_request, make_key
+from .display import Formats, connectionsTable
+from .parser import parse_input
+from .ratelimit import priority, INTERACTIVE, BULK
+
+# Number of queries whose pages are kept in memory.
+MAX_QUERIES = 20
+
+
+class InteractiveShell(cmd.Cmd):
+    """Read queries from the user and display their connections.
+
+    Args:
+        client: The :class:`fahrplan.api.FahrplanClient` to use.
+        output_format: One of the ``Formats`` constants.
+        stdin: Input stream (default ``sys.stdin``).
+        stdout: Output stream (default ``sys.stdout``).
+
+    """
+    intro = ('{} {} interactive mode. Enter a query like "from bern to basel", '
+             '"later", "earlier" or "quit".'.format(meta.title, meta.version))
+    prompt = 'fahrplan> '
+
+    def __init__(self, client, output_format=Formats.SIMPLE, stdin=None, stdout=None):
+        cmd.Cmd.__init__(self, stdin=stdin, stdout=stdout)
+        if stdin is not None:
+            self.use_rawinput = False
+        self.client = client
+        self.output_format = output_format
+        self.request = None
+        self.page = 0
+        self._pages = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fahrplan-prefetch')
+        import rich.console
+        self.console = rich.console.Console(file=self.stdout)
+
+    def _fetch(self, request, page, request_priority):
+        params = dict(request)
+        if page:
+            params['page'] = page
+        with priority(request_priority):
+            return self.client.get_connections(params, self.output_format == Formats.FULL, keep_raw=False)
+
+    def _future(self, page, request_priority=INTERACTIVE):
+        """Return the (possibly prefetched) future of a page of the current query."""
+        pages = self._pages[make_key(self.request)]
+        future = pages.get(page)
+        if future is None:
+            future = pages[page] = self._executor.submit(self._fetch, self.request, page, request_priority)
+        return future
+
+    def _error(self, message):
+        self.stdout.write(message + '\n')
+
+    def show(self):
+        """Display the current page and prefetch its neighbours."""
+        future = self._future(self.page)
+        for page in (self.page + 1, self.page - 1):
+            # The first page starts at the time of the query
+            if page >= 0:
+                self._future(page, BULK)
+        try:
+            connections = future.result()['connections']
+        except ServerError as e:
+            del self._pages[make_key(self.request)][self.page]
+            return self._error('Server Error: {}'.format(e))
+        except FahrplanError as e:
+            del self._pages[make_key(self.request)][self.page]
+            return self._error('Error: {}'.format(e))
+        if not connections:
+            return self._error('No connections found')
+        self.console.print(connectionsTable(connections, self.output_format))
+
+    def default(self, line):
+        try:
+            request, language = parse_input(line.split())
+        except ValueError as e:
+            return self._error('Error: {}'.format(e))
+        if not request:
+            return self._error('Error: Unknown command or query: {}'.format(line))
+        # Resolve "now", so all pages of the query refer to the same time
+        self.request = normalize_request(request)
+        self.page = 0
+        key = make_key(self.request)
+        if key in self._pages:
+            self._pages.move_to_end(key)
+        else:
+            self._pages[key] = {}
+            while len(self._pages) > MAX_QUERIES:
+                self._pages.popitem(last=False)
+        logging.debug('Interactive query: {0!r}'.format(self.request))
+        self.show()
+
+    def _turn(self, offset):
+        if self.request is None:
+            return self._error('Error: Enter a query first.')
+        if self.page + offset < 0:
+            return self._error('Error: No earlier pages, enter the query with an earlier time.')
+        self.page += offset
+        self.show()
+
+    def do_later(self, arg):
+        """Show later connections."""
+        self._turn(1)
+
+    def do_earlier(self, arg):
+        """Show earlier connections."""
+        self._turn(-1)
+
+    def do_quit(self, arg):
+        """Leave the interactive mode."""
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, arg):
+        self.stdout.write('\n')
+        return True
+
+    def emptyline(self):
+        pass
+
+    def postloop(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        index = self.client.station_index
+        if index is not None and index.dirty:
+            index.save()
+
+
+def run(client, output_format=Formats.SIMPLE, request=None):
+    """Start the interactive shell, optionally with a first query."""
+    shell = InteractiveShell(client, output_format)
+    if request:
+        shell.intro = None
+        shell.default(' '.join(request))
+    try:
+        shell.cmdloop()
+    except KeyboardInterrupt:
+        shell.postloop()
+        shell.stdout.write('\n')
@@ -17,25 +17,34 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import sys
 import logging
 import argparse
 
 from . import meta
-from .parser import parse_input
-from .api import get_connections
-from .display import Formats, connectionsTable
+from .display import Formats
 from .helpers import perror
+from .profiling import Profile, timed
 
-import rich
+# Heavy dependencies (requests, rich, ...) are imported where they are first
+# needed, so that e.g. "fahrplan -v" starts quickly.
 
 
-def main():
-    output_format = Formats.SIMPLE
-    proxy_host = None
+class _UsageError(Exception):
+    pass
 
-    # 1. Parse command line arguments
-    parser = argparse.ArgumentParser(epilog='Arguments:\n'
+
+class _ArgumentParser(argparse.ArgumentParser):
+    """Argument parser raising errors instead of exiting the process."""
+
+    def error(self, message):
+        raise _UsageError(message)
+
+
+def build_parser():
+    """Return the argument parser of the command line interface."""
+    parser = _ArgumentParser(epilog='Arguments:\n'
                 + ' You can use natural language arguments using the following\n'
                 + ' keywords in your desired language:\n'
                 + ' en -- from, to, via, departure, arrival\n'
@@ -53,52 +62,421 @@ def main():
                 + ' fahrplan de lausanne à vevey arrivée minuit\n'
                 + ' fahrplan from Bern to Zurich departure 13:00 monday\n'
                 + ' fahrplan -p proxy.mydomain.ch:8080 de lausanne à vevey arrivée minuit\n'
+                + ' fahrplan --interactive from bern to basel\n'
+                + ' fahrplan --watch 30 from bern to basel departure 17:00\n'
+                + ' fahrplan --explore --explore-via olten --explore-via luzern from bern to lugano\n'
+                + ' fahrplan --window 20 board bern "zürich hb" basel\n'
+                + ' fahrplan import-gtfs gtfs_fp2026.zip  (then use --offline)\n'
+                + ' fahrplan snapshot build routes.txt tomorrow  (then use --snapshot)\n'
+                + ' fahrplan --daemon --cache &  (then use fahrplan-client like fahrplan)\n'
+                + ' fahrplan --batch queries.txt --workers 8 > connections.ndjson\n'
+                + ' fahrplan --format csv --full from Bern to Zurich > connections.csv\n'
+                + ' fahrplan --profile --profile-cpu fahrplan.prof from Bern to Zurich\n'
                 + '\n', formatter_class=argparse.RawDescriptionHelpFormatter, prog=meta.title, description=meta.description, add_help=False)
     parser.add_argument("--full", "-f", action="store_true", help="Show full connection info, including changes")
+    parser.add_argument("--format", choices=["table", "plain", "json", "ndjson", "csv", "tsv"],
+                        default="table", help="Output format (default table)")
     parser.add_argument("--info", "-i", action="store_true", help="Verbose output")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug output")
     parser.add_argument("--help", "-h", action="store_true", help="Show this help")
     parser.add_argument("--version", "-v", action="store_true", help="Show version number")
     parser.add_argument("--proxy", "-p", help="Use proxy for network connections (host:port)")
+    parser.add_argument("--api-url", help="Base URL of the API (default $FAHRPLAN_API_URL or transport.opendata.ch)")
+    parser.add_argument("--cache", "-c", action="store_true", help="Cache responses on disk")
+    parser.add_argument("--cache-ttl", type=int, metavar="SECONDS",
+                        help="Lifetime of cached responses in seconds")
+    parser.add_argument("--resolve", "-r", action="store_true",
+                        help="Resolve station names with the local station index")
+    parser.add_argument("--rate", type=float, metavar="N",
+                        help="Send at most N requests per second, shared by all fahrplan processes")
+    parser.add_argument("--burst", type=int, metavar="N",
+                        help="Requests that may be sent at once with --rate (default 1)")
+    parser.add_argument("--retries", type=int, default=3, metavar="N",
+                        help="Retries of requests failing with a network or transient server error (default 3)")
+    parser.add_argument("--offline", action="store_true",
+                        help="Answer queries from the timetable imported with fahrplan import-gtfs FEED")
+    parser.add_argument("--timetable", metavar="FILE",
+                        help="Timetable database of --offline and import-gtfs (default in the cache directory)")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="Answer queries of the routes in the snapshot from it, others from the API")
+    parser.add_argument("--snapshot-file", metavar="FILE",
+                        help="Snapshot file of --snapshot and snapshot build (default in the cache directory)")
+    parser.add_argument("--explore", action="store_true",
+                        help="Also query via the main hubs concurrently and show the best connections")
+    parser.add_argument("--explore-via", action="append", metavar="STATION",
+                        help="Via station tried by --explore instead of the main hubs (repeatable, implies --explore)")
+    parser.add_argument("--interactive", "-I", action="store_true", help="Start an interactive shell")
+    parser.add_argument("--watch", "-w", type=float, metavar="SECONDS",
+                        help="Poll the query every SECONDS and show delays until all connections have departed")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Serve queries of fahrplan-client over a Unix socket")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="Socket of the daemon (default $FAHRPLAN_SOCKET or a per-user path)")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Run the queries in FILE (one per line, - for stdin), print NDJSON")
+    parser.add_argument("--workers", type=int, default=4, metavar="N",
+                        help="Concurrent requests in batch, board and explore mode (default 4)")
+    parser.add_argument("--window", type=int, default=40, metavar="N",
+                        help="Departures shown by fahrplan board STATION... (default 40)")
+    parser.add_argument("--unordered", action="store_true",
+                        help="Print batch results as they complete instead of in input order")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent in each phase of the query to stderr")
+    parser.add_argument("--profile-cpu", metavar="FILE",
+                        help="Write cProfile statistics to FILE (implies --profile)")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Report the peak memory and biggest allocations (implies --profile)")
     parser.add_argument("request", nargs=argparse.REMAINDER)
-    options = parser.parse_args()
+    return parser
+
+
+def make_client(options):
+    """Create a ``FahrplanClient`` as configured by the command line options.
+
+    API clients start opening their connection in the background.
+    """
+    if options.offline:
+        from .offline import OfflineClient
+        return OfflineClient(options.timetable)
+    if options.snapshot:
+        from .snapshot import Snapshot, SnapshotClient
+        return SnapshotClient(Snapshot(options.snapshot_file), lambda: _api_client(options))
+    return _api_client(options)
+
+
+def _api_client(options):
+    from .api import FahrplanClient, DEFAULT_POOL_SIZE
+    cache = None
+    station_index = None
+    rate_limiter = None
+    if options.cache:
+        from .cache import ResponseCache, DEFAULT_TTL
+        cache = ResponseCache(ttl=DEFAULT_TTL if options.cache_ttl is None else options.cache_ttl)
+    if options.resolve:
+        from .stations import StationIndex
+        station_index = StationIndex.load()
+    if options.rate:
+        from .ratelimit import RateLimiter, default_state_path
+        rate_limiter = RateLimiter(options.rate, options.burst, default_state_path())
+    client = FahrplanClient(api_url=options.api_url, proxy=options.proxy, cache=cache,
+                            station_index=station_index,
+                            pool_size=max(DEFAULT_POOL_SIZE, options.workers),
+                            rate_limiter=rate_limiter, retries=options.retries)
+    # Open the connection to the API in the background
+    client.warmup(background=True)
+    return client
+
+
+def run(argv=None, stdout=None, stderr=None, client_factory=None, width=None, color=None,
+        interactive=True):
+    """Run the command line interface.
+
+    Args:
+        argv: Command line arguments (default ``sys.argv[1:]``).
+        stdout: Stream for regular output (default ``sys.stdout``).
+        stderr: Stream for error messages (default ``sys.stderr``).
+        client_factory: Callable returning the ``FahrplanClient`` to use for
+            the parsed options. Defaults to ``make_client``, the client is
+            closed when done in that case.
+        width: Width of the output (default: width of the terminal).
+        color: Force (True) or suppress (False) terminal colors.
+        interactive: Whether the interactive, the watch, the daemon and the
+            batch mode may be started and the run may be profiled.
+
+    Returns:
+        The exit status.
+
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    output_format = Formats.SIMPLE
+
+    # 1. Parse command line arguments
+    parser = build_parser()
+    try:
+        options = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    except _UsageError as e:
+        parser.print_usage(stderr)
+        perror('{}: error: {}'.format(parser.prog, e), file=stderr)
+        return 2
 
     # Version
     if options.version:
-        print('{meta.title} {meta.version}'.format(meta=meta))
-        sys.exit(0)
+        print('{meta.title} {meta.version}'.format(meta=meta), file=stdout)
+        return 0
 
     # No request or help
-    if len(options.request) == 0 or options.help:
-        parser.print_help()
-        sys.exit(0)
+    if (len(options.request) == 0 and not (options.interactive or options.daemon or options.batch)) \
+            or options.help:
+        parser.print_help(stdout)
+        return 0
 
     # Options
     if options.full:
         output_format = Formats.FULL
     if options.debug:
         logging.basicConfig(level=logging.DEBUG)
-    if options.proxy is not None:
-        proxy_host = options.proxy
+    profiled = options.profile or options.profile_cpu or options.profile_memory
+    if (options.interactive or options.watch or options.daemon or options.batch or profiled) \
+            and not interactive:
+        perror('Error: --interactive, --watch, --daemon, --batch and --profile are not available here',
+               file=stderr)
+        return 2
+    if (options.offline or options.snapshot) and (options.watch or options.request[:1] == ['board']):
+        perror('Error: --offline and --snapshot are not available with --watch and board', file=stderr)
+        return 2
+    options.explore = options.explore or bool(options.explore_via)
+    if options.explore and (options.interactive or options.watch or options.batch
+                            or options.request[:1] == ['board']):
+        perror('Error: --explore is not available with --interactive, --watch, --batch and board',
+               file=stderr)
+        return 2
+    if options.watch is not None and options.watch <= 0:
+        perror('Error: --watch must be positive', file=stderr)
+        return 2
+    if options.workers < 1 or options.window < 1:
+        perror('Error: --workers and --window must be at least 1', file=stderr)
+        return 2
+    if (options.rate is not None and options.rate <= 0) or options.retries < 0:
+        perror('Error: --rate must be positive and --retries must not be negative', file=stderr)
+        return 2
+
+    if not profiled:
+        return _run(options, output_format, stdout, stderr, client_factory, width, color)
+    profile = Profile(cpu=options.profile_cpu, memory=options.profile_memory).start()
+    try:
+        return _run(options, output_format, stdout, stderr, client_factory, width, color)
+    finally:
+        profile.stop()
+        profile.report(stderr)
+
+
+def _run(options, output_format, stdout, stderr, client_factory, width, color):
+    """Run the mode or query selected by the parsed options, see ``run``."""
+    # Daemon mode
+    if options.daemon:
+        from . import daemon
+        return daemon.serve(options)
 
-    # Parse user request
+    # Batch mode
+    if options.batch:
+        from . import batch
+        from .api import FahrplanError
+        try:
+            lines = sys.stdin if options.batch == '-' else open(options.batch, encoding='utf-8')
+            client = (client_factory or make_client)(options)
+        except (IOError, FahrplanError) as e:
+            perror('Error:', e, file=stderr)
+            return 1
+        try:
+            failed = batch.run(client, lines, stdout, options.workers, not options.unordered,
+                               output_format == Formats.FULL)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+            if client_factory is None:
+                if client.station_index is not None and client.station_index.dirty:
+                    client.station_index.save()
+                client.close()
+        return 1 if failed else 0
+
+    # Timetable import
+    if options.request and options.request[0] == 'import-gtfs' and not options.interactive:
+        return _import_gtfs(options, stdout, stderr)
+
+    # Snapshot build
+    if options.request[:2] == ['snapshot', 'build'] and not options.interactive:
+        return _build_snapshot(options, stdout, stderr, client_factory)
+
+    # Station boards
+    if options.request and options.request[0] == 'board' and not options.interactive:
+        return _board(options, stdout, stderr, client_factory, width)
+
+    # Create the client first, its connection to the API is opened in the
+    # background while the request is parsed and the remaining modules are
+    # imported
+    with timed('import'):
+        from .api import FahrplanError, ServerError
+    owns_client = client_factory is None
     try:
-        args, language = parse_input(options.request)
-    except ValueError as e:
-        perror('Error:', e)
-        sys.exit(1)
+        client = (client_factory or make_client)(options)
+    except FahrplanError as e:
+        perror('Error:', e, file=stderr)
+        return 1
+    station_index = client.station_index
+
+    if not options.interactive:
+        from .parser import parse_input
+        try:
+            with timed('parse_input'):
+                args, language = parse_input(options.request)
+        except ValueError as e:
+            perror('Error:', e, file=stderr)
+            if owns_client:
+                client.close()
+            return 1
+
+    # Interactive mode
+    if options.interactive:
+        from . import interactive
+        try:
+            interactive.run(client, output_format, options.request)
+        finally:
+            if owns_client:
+                if station_index is not None and station_index.dirty:
+                    station_index.save()
+                client.close()
+        return 0
+
+    # Watch mode
+    if options.watch:
+        from . import watch
+        try:
+            return watch.run(client, args, options.watch, output_format == Formats.FULL, stdout,
+                             stderr, width=width)
+        finally:
+            if owns_client:
+                if station_index is not None and station_index.dirty:
+                    station_index.save()
+                client.close()
+
+    with timed('import'):
+        if options.format == 'table':
+            import rich.console
+            from .display import connectionsTable
+        elif options.format == 'plain':
+            from .display import printPlainTable
+        else:
+            from . import output
 
     # 2. API request
-    data = get_connections(args, (output_format == Formats.FULL), proxy_host)
-    connections = data["connections"]
+    include_sections = output_format == Formats.FULL
+    try:
+        if options.explore:
+            from .explore import explore
+            connections = explore(client, args, options.explore_via, options.workers, include_sections)
+        elif options.format == 'table' or client.cache is not None:
+            connections = client.get_connections(args, include_sections, keep_raw=False)["connections"]
+        else:
+            # Write the connections while the response is being received
+            connections = client.iter_connections(args, include_sections)
+        if options.format == 'plain':
+            with timed('render'):
+                count = printPlainTable(connections, stdout)
+            if not count:
+                print("No connections found", file=stdout)
+            return 0
+        if options.format != 'table':
+            with timed('render'):
+                output.write(connections, options.format, stdout)
+            return 0
+    except ServerError as e:
+        perror('Server Error:', e, file=stderr)
+        return 1
+    except FahrplanError as e:
+        perror('Error:', e, file=stderr)
+        return 1
+    finally:
+        if owns_client:
+            if station_index is not None and station_index.dirty:
+                station_index.save()
+            client.close()
 
     if not connections:
-        print("No connections found")
-        sys.exit(0)
+        print("No connections found", file=stdout)
+        return 0
 
     # 3. Output data
-    table = connectionsTable(connections, output_format)
-    rich.print(table)
+    with timed('render'):
+        table = connectionsTable(connections, output_format)
+        console = rich.console.Console(file=stdout, width=width, force_terminal=color)
+        console.print(table)
+    return 0
+
+
+def _import_gtfs(options, stdout, stderr):
+    """Import the GTFS feed of ``fahrplan import-gtfs FEED``."""
+    if len(options.request) != 2:
+        perror('Error: import-gtfs needs the path of a GTFS feed (zip file or directory)', file=stderr)
+        return 1
+    from .offline import import_gtfs, default_timetable_path
+    path = options.timetable or default_timetable_path()
+    try:
+        counts = import_gtfs(options.request[1], path)
+    except (IOError, ValueError) as e:
+        perror('Error:', e, file=stderr)
+        return 1
+    print('Imported {stations} stations, {trips} trips and {connections} connections into {path}'.format(
+        path=path, **counts), file=stdout)
+    return 0
+
+
+def _build_snapshot(options, stdout, stderr, client_factory):
+    """Build the snapshot of ``fahrplan snapshot build ROUTES [DATE]``."""
+    from datetime import date as date_, datetime, timedelta
+    if len(options.request) not in (3, 4):
+        perror('Error: usage: snapshot build ROUTES [today|tomorrow|YYYY-MM-DD]', file=stderr)
+        return 1
+    day = options.request[3] if len(options.request) == 4 else 'today'
+    try:
+        if day in ('today', 'tomorrow'):
+            day = date_.today() + timedelta(days=int(day == 'tomorrow'))
+        else:
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+    except ValueError:
+        perror('Error: invalid date {!r}, use today, tomorrow or YYYY-MM-DD'.format(day), file=stderr)
+        return 1
+    from . import snapshot
+    try:
+        with open(options.request[2], encoding='utf-8') as f:
+            routes = snapshot.read_routes(f)
+    except (IOError, ValueError) as e:
+        perror('Error:', e, file=stderr)
+        return 1
+    path = options.snapshot_file or snapshot.default_snapshot_path()
+    client = (client_factory or _api_client)(options)
+    try:
+        count, failed = snapshot.build(client, routes, day, path, options.workers, stderr)
+    finally:
+        if client_factory is None:
+            client.close()
+    print('Wrote {} connections of {} routes on {} to {}'.format(
+        count, len(routes) - len(failed), day.isoformat(), path), file=stdout)
+    return 1 if failed else 0
+
+
+def _board(options, stdout, stderr, client_factory, width):
+    """Show the merged departure board of ``fahrplan board STATION...``."""
+    stations = options.request[1:]
+    if not stations:
+        perror('Error: board needs at least one station', file=stderr)
+        return 1
+    if options.format in ('csv', 'tsv') or (options.watch and options.format not in ('table', 'plain')):
+        perror('Error: --format {} is not available for boards'.format(options.format), file=stderr)
+        return 2
+    from . import board
+    client = (client_factory or make_client)(options)
+    try:
+        return board.run(client, stations, options.window, options.workers, options.format, stdout,
+                         stderr, interval=options.watch, width=width)
+    finally:
+        if client_factory is None:
+            if client.station_index is not None and client.station_index.dirty:
+                client.station_index.save()
+            client.close()
+
+
+def main(argv=None):
+    try:
+        status = run(argv)
+    except BrokenPipeError:
+        # The output was closed early (e.g. piped into head), silence the
+        # error on flushing stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        status = 1
+    if status:
+        sys.exit(status)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Compact records for parsed connections and departures.
+
+The records use ``__slots__`` and interned strings to keep the memory
+footprint of large result sets low. For backwards compatibility they also
+support the read-only mapping interface of the plain dictionaries used
+before (``connection['sections']``, ``section.get('platform_from')``).
+"""
+import sys
+from datetime import timedelta
+
+from .helpers import parse_timestamp
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class _Record(object):
+    """Base class providing read-only mapping access to the public fields."""
+    __slots__ = ()
+    fields = ()
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.fields)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(self[f] == other[f] for f in self.fields)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(f, self[f]) for f in self.fields))
+
+    def __getstate__(self):
+        return {s: getattr(self, s) for s in self.__slots__}
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+
+class Section(_Record):
+    """A section (one vehicle or walk) of a connection.
+
+    ``change_count`` is only set on the summary section of connections
+    parsed without sections.
+    """
+    __slots__ = ('station_from', 'station_to', 'travelwith', 'departure', 'arrival',
+                 'platform_from', 'platform_to', 'change_count')
+    fields = __slots__
+
+    def __init__(self, station_from, station_to, travelwith, departure, arrival,
+                 platform_from, platform_to, change_count=None):
+        self.station_from = station_from
+        self.station_to = station_to
+        self.travelwith = travelwith
+        self.departure = departure
+        self.arrival = arrival
+        self.platform_from = platform_from
+        self.platform_to = platform_to
+        self.change_count = change_count
+
+    def to_dict(self):
+        return {f: self[f] for f in self.fields}
+
+
+def section_fields(con_section):
+    """Extract the undecoded fields of a section object from the API.
+
+    Returns:
+        A tuple of interned strings in the argument order of
+        :class:`Section`, with the timestamps still undecoded.
+
+    """
+    departure = con_section['departure']
+    arrival = con_section['arrival']
+    journey = con_section.get('journey')
+    if journey is not None:
+        travelwith = sys.intern('{} {}'.format(journey['category'], journey['number']))
+    else:
+        travelwith = ''
+    return (
+        _intern(departure['station']['name']),
+        _intern(arrival['station']['name']),
+        travelwith,
+        departure['departure'],
+        arrival['arrival'],
+        '' if con_section.get('walk') else _intern(departure['platform']),
+        _intern(arrival['platform']),
+    )
+
+
+def decode_section(fields, change_count=None):
+    """Build a :class:`Section` from a tuple returned by ``section_fields``."""
+    (station_from, station_to, travelwith, departure, arrival,
+     platform_from, platform_to) = fields
+    return Section(station_from, station_to, travelwith,
+                   parse_timestamp(departure), parse_timestamp(arrival),
+                   platform_from, platform_to, change_count)
+
+
+class Connection(_Record):
+    """A parsed connection.
+
+    The sections are stored as compact tuples and only decoded into
+    :class:`Section` records on first access of ``sections``.
+    """
+    __slots__ = ('change_count', 'travelwith', '_sections', '_pending', '_summary')
+    fields = ('change_count', 'travelwith', 'sections')
+
+    def __init__(self, change_count, travelwith, pending, summary=False):
+        self.change_count = change_count
+        self.travelwith = travelwith
+        self._sections = None
+        self._pending = pending
+        self._summary = summary
+
+    @classmethod
+    def decoded(cls, change_count, travelwith, sections):
+        """Build a connection from already decoded :class:`Section` records."""
+        connection = cls(change_count, travelwith, None)
+        connection._sections = sections
+        return connection
+
+    @property
+    def sections(self):
+        if self._sections is None:
+            if self._summary:
+                # Only the summary section, carrying the connection data
+                self._sections = [decode_section(self._pending[0], self.change_count)]
+            else:
+                self._sections = [decode_section(s) for s in self._pending]
+            self._pending = None
+        return self._sections
+
+    def to_dict(self):
+        return {
+            'change_count': self.change_count,
+            'travelwith': self.travelwith,
+            'sections': [s.to_dict() for s in self.sections],
+        }
+
+
+class Departure(_Record):
+    """A departure from a station board.
+
+    ``delay`` is the expected delay in minutes (0 if on time, None if
+    unknown); ``expected`` is the departure including the delay.
+    """
+    __slots__ = ('station', 'departure', 'delay', 'platform', 'travelwith', 'to')
+    fields = __slots__
+
+    def __init__(self, station, departure, delay, platform, travelwith, to):
+        self.station = station
+        self.departure = departure
+        self.delay = delay
+        self.platform = platform
+        self.travelwith = travelwith
+        self.to = to
+
+    @property
+    def expected(self):
+        if not self.delay:
+            return self.departure
+        return self.departure + timedelta(minutes=self.delay)
+
+    def to_dict(self):
+        return {f: self[f] for f in self.fields}
+
+
+def decode_departure(entry, station):
+    """Build a :class:`Departure` from an entry of a station board."""
+    stop = entry['stop']
+    prognosis = stop.get('prognosis') or {}
+    return Departure(
+        _intern(station),
+        parse_timestamp(stop['departure']),
+        stop.get('delay'),
+        _intern(prognosis.get('platform') or stop.get('platform') or ''),
+        sys.intern('{} {}'.format(entry['category'], entry['number'])),
+        _intern(entry['to']),
+    )
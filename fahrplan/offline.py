@@ -0,0 +1,667 @@
+# -*- coding: utf-8 -*-
+"""Offline routing over an imported GTFS timetable (``--offline``).
+
+``fahrplan import-gtfs FEED`` loads a GTFS feed (a zip file or a directory,
+e.g. the Swiss feed of opentransportdata.swiss) into a SQLite database.
+Every pair of consecutive stops of a trip becomes one elementary connection;
+the connections are indexed by departure and by arrival time. Platforms are
+merged into their parent stations.
+
+:class:`OfflineClient` answers the requests produced by ``parse_input`` with
+the Connection Scan Algorithm (Dibbelt et al.): the connections of the
+service days around the requested time are scanned once in order of
+departure (or of arrival, backwards, for arrival time queries) while the
+earliest arrival at every station is kept. The scan stops as soon as no
+connection can improve the arrival at the destination any more, so a query
+only reads the connections up to its arrival time. The results are parsed
+by ``_parse_connection`` like API responses.
+
+The router considers the calendar of the feed, a minimum change time at
+stations and the footpaths between stations of ``transfers.txt``; it doesn't
+consider real-time data, pickup and drop-off restrictions or trip specific
+transfer times.
+"""
+import os
+import csv
+import io
+import heapq
+import sqlite3
+import logging
+import tempfile
+import zipfile
+from datetime import datetime, timedelta, time as dtime
+from zoneinfo import ZoneInfo
+
+from .api import FahrplanError, _parse_connection
+from .cache import default_cache_path, normalize_request
+from .stations import StationIndex, fold
+
+# Minimum time to change trains at a station in seconds.
+DEFAULT_CHANGE_TIME = 120
+
+# How far from the requested time connections are scanned, in seconds.
+SEARCH_HORIZON = 12 * 3600
+
+# Number of connections returned if the request doesn't set a limit.
+DEFAULT_LIMIT = 4
+
+_DAY = 86400
+_INFINITY = float('inf')
+
+_SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE stations (
+    id INTEGER PRIMARY KEY,
+    gtfs_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    folded TEXT NOT NULL,
+    stops INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE trips (id INTEGER PRIMARY KEY, category TEXT, number TEXT);
+CREATE TABLE calendar (
+    service INTEGER PRIMARY KEY,
+    weekdays INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE TABLE calendar_dates (service INTEGER NOT NULL, date INTEGER NOT NULL, added INTEGER NOT NULL);
+CREATE TABLE footpaths (from_station INTEGER NOT NULL, to_station INTEGER NOT NULL, seconds INTEGER NOT NULL);
+CREATE TABLE connections (
+    dep INTEGER NOT NULL,
+    arr INTEGER NOT NULL,
+    from_station INTEGER NOT NULL,
+    to_station INTEGER NOT NULL,
+    trip INTEGER NOT NULL,
+    service INTEGER NOT NULL,
+    from_platform TEXT,
+    to_platform TEXT
+);
+'''
+
+_INDEXES = '''
+CREATE INDEX stations_folded ON stations (folded);
+CREATE INDEX calendar_dates_date ON calendar_dates (date);
+CREATE INDEX connections_dep ON connections (dep);
+CREATE INDEX connections_arr ON connections (arr);
+'''
+
+_WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def default_timetable_path():
+    """Return the default location of the imported timetable."""
+    return os.path.join(os.path.dirname(default_cache_path()), 'timetable.sqlite')
+
+
+def _seconds(value):
+    """Parse a GTFS time (``HH:MM:SS``, may exceed 24 hours) or return None."""
+    if not value:
+        return None
+    hours, minutes, seconds = value.strip().split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+class _Feed(object):
+    """Read the files of a GTFS feed from a zip file or a directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = None if os.path.isdir(path) else zipfile.ZipFile(path)
+
+    def __contains__(self, name):
+        if self.zip is None:
+            return os.path.exists(os.path.join(self.path, name))
+        return name in self.zip.namelist()
+
+    def rows(self, name):
+        """Yield the rows of a file as dictionaries (nothing if it is missing)."""
+        if name not in self:
+            return
+        if self.zip is None:
+            f = open(os.path.join(self.path, name), encoding='utf-8-sig', newline='')
+        else:
+            f = io.TextIOWrapper(self.zip.open(name), encoding='utf-8-sig', newline='')
+        with f:
+            for row in csv.DictReader(f):
+                yield row
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+
+
+def import_gtfs(feed_path, path=None, batch_size=10000):
+    """Import a GTFS feed into a timetable database.
+
+    The database is built next to ``path`` and replaces it when complete.
+    ``stop_times.txt`` has to be grouped by trip, as it is in the feeds
+    published by the agencies.
+
+    Args:
+        feed_path: Path of the feed, a zip file or a directory.
+        path: Path of the database (default ``default_timetable_path()``).
+
+    Returns:
+        A dictionary with the number of imported ``stations``, ``trips`` and
+        ``connections``.
+
+    Raises:
+        IOError: If the feed can't be read.
+        ValueError: If the feed is invalid.
+
+    """
+    path = path or default_timetable_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    try:
+        feed = _Feed(feed_path)
+    except zipfile.BadZipFile as e:
+        raise ValueError('Invalid GTFS feed: {}'.format(e))
+    fd, tmp = tempfile.mkstemp(dir=directory or None, suffix='.tmp')
+    os.close(fd)
+    conn = sqlite3.connect(tmp, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.executescript(_SCHEMA)
+        conn.execute('BEGIN')
+        counts = _import(feed, conn, batch_size)
+        conn.execute('COMMIT')
+        conn.executescript(_INDEXES)
+        conn.execute('ANALYZE')
+        conn.close()
+        os.replace(tmp, path)
+    except (KeyError, ValueError) as e:
+        raise ValueError('Invalid GTFS feed: {}'.format(e))
+    finally:
+        feed.close()
+        conn.close()
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return counts
+
+
+def _import(feed, conn, batch_size):
+    if 'stop_times.txt' not in feed:
+        raise ValueError('stop_times.txt is missing')
+    timezone = next((row['agency_timezone'] for row in feed.rows('agency.txt')), 'Europe/Zurich')
+    conn.execute('INSERT INTO meta VALUES (?, ?)', ('timezone', timezone))
+
+    # Stations, platforms are mapped to their parent station
+    stops = list(feed.rows('stops.txt'))
+    stations = {}  # GTFS station id -> station number
+    for stop in stops:
+        if not stop.get('parent_station'):
+            number = stations[stop['stop_id']] = len(stations)
+            conn.execute('INSERT INTO stations (id, gtfs_id, name, folded) VALUES (?, ?, ?, ?)',
+                         (number, stop['stop_id'], stop['stop_name'], fold(stop['stop_name'])))
+    platforms = {}  # GTFS stop id -> (station number, platform)
+    for stop in stops:
+        station = stations.get(stop.get('parent_station') or stop['stop_id'])
+        if station is None:  # Parent station missing in the feed
+            station = stations[stop['parent_station']] = len(stations)
+            conn.execute('INSERT INTO stations (id, gtfs_id, name, folded) VALUES (?, ?, ?, ?)',
+                         (station, stop['parent_station'], stop['stop_name'], fold(stop['stop_name'])))
+        platforms[stop['stop_id']] = (station, stop.get('platform_code') or None)
+
+    # Trips, labelled like the journeys of the API ("IC 812")
+    routes = {}
+    for route in feed.rows('routes.txt'):
+        short_name = route.get('route_short_name') or ''
+        routes[route['route_id']] = (route.get('route_desc') or short_name, short_name)
+    services = {}
+    trips = {}  # GTFS trip id -> (trip number, service number)
+    for trip in feed.rows('trips.txt'):
+        category, short_name = routes.get(trip['route_id'], ('', ''))
+        service = services.setdefault(trip['service_id'], len(services))
+        number = trips[trip['trip_id']] = (len(trips), service)
+        conn.execute('INSERT INTO trips VALUES (?, ?, ?)',
+                     (number[0], category, trip.get('trip_short_name') or short_name))
+
+    # Calendar
+    for row in feed.rows('calendar.txt'):
+        weekdays = sum(1 << i for i, day in enumerate(_WEEKDAYS) if row[day] == '1')
+        service = services.setdefault(row['service_id'], len(services))
+        conn.execute('INSERT INTO calendar VALUES (?, ?, ?, ?)',
+                     (service, weekdays, int(row['start_date']), int(row['end_date'])))
+    for row in feed.rows('calendar_dates.txt'):
+        service = services.setdefault(row['service_id'], len(services))
+        conn.execute('INSERT INTO calendar_dates VALUES (?, ?, ?)',
+                     (service, int(row['date']), int(row['exception_type'] == '1')))
+
+    # Footpaths between different stations
+    footpaths = {}
+    for row in feed.rows('transfers.txt'):
+        if row.get('transfer_type') != '2' or not row.get('min_transfer_time'):
+            continue
+        ends = (platforms.get(row['from_stop_id']), platforms.get(row['to_stop_id']))
+        if None in ends or ends[0][0] == ends[1][0]:
+            continue
+        key = (ends[0][0], ends[1][0])
+        footpaths[key] = min(footpaths.get(key, _INFINITY), int(row['min_transfer_time']))
+    conn.executemany('INSERT INTO footpaths VALUES (?, ?, ?)',
+                     [(a, b, seconds) for (a, b), seconds in footpaths.items()])
+
+    # Connections between consecutive stops of every trip
+    stops = [0] * len(stations)  # Arrivals and departures per station
+    batch = []
+    count = 0
+    for stop_times in _group_trips(feed.rows('stop_times.txt')):
+        trip, service = trips[stop_times[0]['trip_id']]
+        stop_times.sort(key=lambda row: int(row['stop_sequence']))
+        previous = None
+        for row in stop_times:
+            station, platform = platforms[row['stop_id']]
+            if previous is not None:
+                dep = _seconds(previous[0]['departure_time'])
+                arr = _seconds(row['arrival_time'])
+                if dep is not None and arr is not None:
+                    batch.append((dep, arr, previous[1], station, trip, service, previous[2], platform))
+                    stops[previous[1]] += 1
+                    stops[station] += 1
+            previous = (row, station, platform)
+        if len(batch) >= batch_size:
+            conn.executemany('INSERT INTO connections VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            count += len(batch)
+            batch = []
+    conn.executemany('INSERT INTO connections VALUES (?, ?, ?, ?, ?, ?, ?, ?)', batch)
+    count += len(batch)
+    conn.executemany('UPDATE stations SET stops = ? WHERE id = ?',
+                     [(n, station) for station, n in enumerate(stops) if n])
+    logging.debug('Imported {0} stations, {1} trips, {2} connections'.format(len(stations), len(trips), count))
+    return {'stations': len(stations), 'trips': len(trips), 'connections': count}
+
+
+def _group_trips(rows):
+    """Yield lists of consecutive rows with the same ``trip_id``."""
+    group = []
+    for row in rows:
+        if group and row['trip_id'] != group[0]['trip_id']:
+            yield group
+            group = []
+        group.append(row)
+    if group:
+        yield group
+
+
+class Timetable(object):
+    """Connection Scan Algorithm over an imported timetable.
+
+    Args:
+        path: Path of the database (default ``default_timetable_path()``).
+        change_time: Minimum time to change trains in seconds.
+
+    Raises:
+        FahrplanError: If there is no imported timetable at ``path``.
+
+    """
+
+    def __init__(self, path=None, change_time=DEFAULT_CHANGE_TIME):
+        self.path = path or default_timetable_path()
+        self.change_time = change_time
+        if not os.path.exists(self.path):
+            raise FahrplanError('No timetable at {}, import one with "fahrplan import-gtfs FEED"'.format(
+                self.path))
+        self.conn = sqlite3.connect('file:{}?mode=ro'.format(self.path), uri=True, check_same_thread=False)
+        self.tz = ZoneInfo(self._meta('timezone') or 'Europe/Zurich')
+        self._names = None
+        self._index = None
+        self._services = {}  # date -> active services
+        self._footpaths = None  # station -> [(station, seconds)]
+        self._footpaths_to = None  # station -> [(station, seconds)]
+
+    def close(self):
+        self.conn.close()
+
+    def _meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def name(self, station):
+        if self._names is None:
+            self._names = dict(self.conn.execute('SELECT id, name FROM stations'))
+        return self._names[station]
+
+    def find_station(self, query):
+        """Return the station number matching a name or GTFS id, or None.
+
+        Exact (folded) names win, then the busiest station whose name starts
+        with the query ("zürich" finds "Zürich HB"), then fuzzy matches.
+        """
+        folded = fold(query)
+        row = self.conn.execute(
+            'SELECT id FROM stations WHERE gtfs_id = ? OR folded = ? ORDER BY stops DESC LIMIT 1',
+            (query, folded)).fetchone()
+        if row is None:
+            row = self.conn.execute(
+                'SELECT id FROM stations WHERE folded >= ? AND folded < ? ORDER BY stops DESC LIMIT 1',
+                (folded, folded + '\uffff')).fetchone()
+        if row is not None:
+            return row[0]
+        if self._index is None:
+            self._index = StationIndex({'id': id, 'name': name} for id, name in self.conn.execute(
+                'SELECT id, name FROM stations WHERE stops > 0'))
+        match = self._index.lookup(query)
+        return int(match[0]) if match is not None else None
+
+    def active_services(self, date):
+        """Return the set of services running on a date."""
+        services = self._services.get(date)
+        if services is None:
+            day = int(date.strftime('%Y%m%d'))
+            services = {service for service, in self.conn.execute(
+                'SELECT service FROM calendar WHERE start <= ? AND end >= ? AND weekdays & ?',
+                (day, day, 1 << date.weekday()))}
+            for service, added in self.conn.execute(
+                    'SELECT service, added FROM calendar_dates WHERE date = ?', (day,)):
+                if added:
+                    services.add(service)
+                else:
+                    services.discard(service)
+            self._services[date] = services
+        return services
+
+    def _load_footpaths(self):
+        self._footpaths, self._footpaths_to = {}, {}
+        for a, b, seconds in self.conn.execute('SELECT from_station, to_station, seconds FROM footpaths'):
+            self._footpaths.setdefault(a, []).append((b, seconds))
+            self._footpaths_to.setdefault(b, []).append((a, seconds))
+
+    def _scan(self, date, start, end, backwards=False):
+        """Yield the connections running between ``start`` and ``end``.
+
+        Times are seconds since midnight of ``date``, connections are
+        ``(dep, arr, from, to, trip, from platform, to platform)`` tuples
+        in order of departure (of arrival if ``backwards``). The trip is a
+        ``(trip number, day)`` tuple. The previous and the next service day
+        are included, for trips past midnight.
+        """
+        column = 'arr' if backwards else 'dep'
+        order = 'DESC' if backwards else 'ASC'
+        scans = []
+        for days in (-1, 0, 1):
+            shift = days * _DAY
+            if end - shift < 0 or start - shift > 2 * _DAY:
+                continue
+            services = self.active_services(date + timedelta(days=days))
+            if services:
+                scans.append(self._scan_day(column, order, start - shift, end - shift, shift, services, days))
+        key = (lambda c: c[1]) if backwards else (lambda c: c[0])
+        return heapq.merge(*scans, key=key, reverse=backwards)
+
+    def _scan_day(self, column, order, start, end, shift, services, days):
+        cursor = self.conn.execute(
+            'SELECT dep, arr, from_station, to_station, trip, service, from_platform, to_platform '
+            'FROM connections WHERE {0} >= ? AND {0} <= ? ORDER BY {0} {1}'.format(column, order),
+            (start, end))
+        for dep, arr, a, b, trip, service, from_platform, to_platform in cursor:
+            if service in services:
+                yield (dep + shift, arr + shift, a, b, (trip, days), from_platform, to_platform)
+
+    def earliest_arrival(self, source, target, date, start):
+        """Return the journey arriving first at ``target`` leaving after ``start``.
+
+        Returns:
+            A list of legs, ``('ride', first connection, last connection)``
+            or ``('walk', from, to, departure, arrival)``, or None.
+
+        """
+        if self._footpaths is None:
+            self._load_footpaths()
+        arrival = {source: start}
+        ready = {source: start}  # Earliest time to board a vehicle
+        reached = {}  # Station -> leg reaching it
+        boarded = {}  # Trip -> connection where it was boarded
+        for station, seconds in self._footpaths.get(source, ()):
+            arrival[station] = ready[station] = start + seconds
+            reached[station] = ('walk', source, station, start, start + seconds)
+        best = arrival.get(target, _INFINITY)
+        for c in self._scan(date, start, start + SEARCH_HORIZON):
+            dep, arr, a, b, trip = c[:5]
+            if dep >= best:
+                break
+            board = boarded.get(trip)
+            if board is None:
+                if ready.get(a, _INFINITY) > dep:
+                    continue
+                board = boarded[trip] = c
+            if arr >= arrival.get(b, _INFINITY):
+                continue
+            arrival[b] = arr
+            ready[b] = arr + self.change_time
+            reached[b] = ('ride', board, c)
+            for station, seconds in self._footpaths.get(b, ()):
+                if arr + seconds < arrival.get(station, _INFINITY):
+                    arrival[station] = ready[station] = arr + seconds
+                    reached[station] = ('walk', b, station, arr, arr + seconds)
+            best = arrival.get(target, _INFINITY)
+        if target not in reached:
+            return None
+        legs = []
+        station = target
+        while station != source:
+            leg = reached[station]
+            legs.append(leg)
+            station = leg[1] if leg[0] == 'walk' else leg[1][2]
+        legs.reverse()
+        return legs
+
+    def latest_departure(self, source, target, date, end):
+        """Return the journey leaving ``source`` last and arriving before ``end``.
+
+        Returns:
+            A list of legs like :meth:`earliest_arrival`, or None.
+
+        """
+        if self._footpaths is None:
+            self._load_footpaths()
+        departure = {target: end}
+        ready = {target: end}  # Latest arrival to catch the next vehicle
+        leads = {}  # Station -> leg leaving it
+        alighted = {}  # Trip -> connection where it is left
+        for station, seconds in self._footpaths_to.get(target, ()):
+            departure[station] = ready[station] = end - seconds
+            leads[station] = ('walk', station, target, end - seconds, end)
+        best = departure.get(source, -_INFINITY)
+        for c in self._scan(date, end - SEARCH_HORIZON, end, backwards=True):
+            dep, arr, a, b, trip = c[:5]
+            if arr <= best:
+                break
+            alight = alighted.get(trip)
+            if alight is None:
+                if ready.get(b, -_INFINITY) < arr:
+                    continue
+                alight = alighted[trip] = c
+            if dep <= departure.get(a, -_INFINITY):
+                continue
+            departure[a] = dep
+            ready[a] = dep - self.change_time
+            leads[a] = ('ride', c, alight)
+            for station, seconds in self._footpaths_to.get(a, ()):
+                if dep - seconds > departure.get(station, -_INFINITY):
+                    departure[station] = ready[station] = dep - seconds
+                    leads[station] = ('walk', station, a, dep - seconds, dep)
+            best = departure.get(source, -_INFINITY)
+        if source not in leads:
+            return None
+        legs = []
+        station = source
+        while station != target:
+            leg = leads[station]
+            legs.append(leg)
+            station = leg[2] if leg[0] == 'walk' else leg[2][3]
+        return legs
+
+    def _timestamp(self, date, seconds):
+        when = datetime.combine(date, dtime()) + timedelta(seconds=seconds)
+        return when.replace(tzinfo=self.tz).strftime('%Y-%m-%dT%H:%M:%S%z')
+
+    def _checkpoint(self, date, station, key, seconds, platform):
+        return {'station': {'name': self.name(station)}, key: self._timestamp(date, seconds),
+                'platform': platform}
+
+    def connection(self, date, legs):
+        """Return the legs of a journey as a connection object of the API."""
+        sections = []
+        for leg in legs:
+            if leg[0] == 'walk':
+                kind, a, b, dep, arr = leg
+                sections.append({
+                    'journey': None,
+                    'walk': {'duration': arr - dep},
+                    'departure': self._checkpoint(date, a, 'departure', dep, None),
+                    'arrival': self._checkpoint(date, b, 'arrival', arr, None),
+                })
+                continue
+            kind, first, last = leg
+            category, number = self.conn.execute(
+                'SELECT category, number FROM trips WHERE id = ?', (first[4][0],)).fetchone()
+            sections.append({
+                'journey': {'category': category, 'number': number},
+                'walk': None,
+                'departure': self._checkpoint(date, first[2], 'departure', first[0], first[5]),
+                'arrival': self._checkpoint(date, last[3], 'arrival', last[1], last[6]),
+            })
+        rides = len([leg for leg in legs if leg[0] == 'ride'])
+        return {'transfers': max(0, rides - 1), 'sections': sections}
+
+
+def _departure(legs):
+    leg = legs[0]
+    return leg[3] if leg[0] == 'walk' else leg[1][0]
+
+
+def _arrival(legs):
+    leg = legs[-1]
+    return leg[4] if leg[0] == 'walk' else leg[2][1]
+
+
+def _rides(legs):
+    """Return the ride legs of a journey, which identify it."""
+    return tuple(leg for leg in legs if leg[0] == 'ride')
+
+
+def _latest_start(legs):
+    """Return the latest time to leave for the first ride of a journey.
+
+    Walks found by a search start at the requested time, not when they have
+    to, so the departure of the journey itself is no bound for the next one.
+    """
+    walks = 0
+    for leg in legs:
+        if leg[0] == 'ride':
+            return leg[1][0] - walks
+        walks += leg[4] - leg[3]
+    return None
+
+
+def _earliest_end(legs):
+    """Return the earliest arrival after the last ride of a journey."""
+    walks = 0
+    for leg in reversed(legs):
+        if leg[0] == 'ride':
+            return leg[2][1] + walks
+        walks += leg[4] - leg[3]
+    return None
+
+
+class OfflineClient(object):
+    """Drop-in replacement of :class:`fahrplan.api.FahrplanClient` for
+    connection queries, answered from an imported timetable.
+
+    Args:
+        path: Path of the timetable (default ``default_timetable_path()``).
+        change_time: Minimum time to change trains in seconds.
+
+    """
+    station_index = None
+    cache = None
+
+    def __init__(self, path=None, change_time=DEFAULT_CHANGE_TIME):
+        self.timetable = Timetable(path, change_time)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.timetable.close()
+
+    def warmup(self, background=False):
+        pass
+
+    def _station(self, query):
+        station = self.timetable.find_station(query)
+        if station is None:
+            raise FahrplanError('Station not found: {}'.format(query))
+        return station
+
+    def _journey(self, stations, date, seconds, arrive):
+        """Return the legs of the best journey through ``stations``, or None."""
+        legs = []
+        if arrive:
+            for source, target in reversed(list(zip(stations, stations[1:]))):
+                part = self.timetable.latest_departure(source, target, date, seconds)
+                if part is None:
+                    return None
+                legs = part + legs
+                seconds = _departure(part) - self.timetable.change_time
+        else:
+            for source, target in zip(stations, stations[1:]):
+                part = self.timetable.earliest_arrival(source, target, date, seconds)
+                if part is None:
+                    return None
+                legs += part
+                seconds = _arrival(part) + self.timetable.change_time
+        return legs
+
+    def get_connections(self, request, include_sections=False, cache=None, keep_raw=True):
+        """Get the connections of a request, see ``FahrplanClient.get_connections``.
+
+        Returns the next ``limit`` (default 4) connections leaving after the
+        requested time, or arriving before it. A positive ``page`` selects
+        the following connections, a negative one moves the requested time
+        back by an hour per page. The result only has a ``connections``
+        list, ``keep_raw`` and ``cache`` are ignored.
+        """
+        request = normalize_request(request)
+        date = datetime.strptime(request['date'], '%Y/%m/%d').date()
+        hours, minutes = request['time'].split(':')
+        seconds = int(hours) * 3600 + int(minutes) * 60
+        via = request.get('via') or []
+        if not isinstance(via, list):
+            via = [via]
+        stations = [self._station(name) for name in [request['from']] + via + [request['to']]]
+        arrive = bool(int(request.get('isArrivalTime') or 0))
+        limit = int(request.get('limit') or DEFAULT_LIMIT)
+        page = int(request.get('page') or 0)
+        if page < 0:
+            seconds += page * 3600
+            page = 0
+        journeys = []
+        seen = set()
+        while len(journeys) < (page + 1) * limit:
+            legs = self._journey(stations, date, seconds, arrive)
+            if legs is None:
+                break
+            rides = _rides(legs)
+            if rides not in seen:
+                seen.add(rides)
+                journeys.append(legs)
+            if not rides:
+                # Walking there doesn't depend on the time
+                break
+            seconds = _earliest_end(legs) - 60 if arrive else _latest_start(legs) + 60
+        journeys = journeys[page * limit:]
+        if arrive:
+            journeys.reverse()
+        connections = [_parse_connection(self.timetable.connection(date, legs), include_sections)
+                       for legs in journeys]
+        return {'connections': connections}
+
+    def iter_connections(self, request, include_sections=False):
+        """Yield the connections of a request, see :meth:`get_connections`."""
+        return iter(self.get_connections(request, include_sections)['connections'])
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Machine-readable output formats (``--format json|ndjson|csv|tsv``).
+
+The writers consume an iterable of connections and write every connection
+as soon as it is available, so combined with
+:meth:`fahrplan.api.FahrplanClient.iter_connections` the output starts while
+the response is still being received. Unlike the table output, this module
+doesn't need rich.
+
+* ``json``: a JSON array of connections
+* ``ndjson``: one JSON object per connection and line
+* ``csv``/``tsv``: one row per section, with a header row
+"""
+import csv
+import json
+from datetime import date, datetime
+
+# Columns of the csv and tsv formats.
+COLUMNS = ('connection', 'change_count', 'section', 'station_from', 'platform_from', 'departure',
+           'station_to', 'platform_to', 'arrival', 'travelwith')
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps(value):
+    """Encode a value containing connections and datetimes as JSON."""
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+def write_json(connections, out):
+    out.write('[')
+    for i, connection in enumerate(connections):
+        out.write((',\n' if i else '\n') + dumps(connection))
+        out.flush()
+    out.write('\n]\n')
+
+
+def write_ndjson(connections, out):
+    for connection in connections:
+        out.write(dumps(connection) + '\n')
+        out.flush()
+
+
+def _write_rows(connections, out, delimiter):
+    writer = csv.writer(out, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(COLUMNS)
+    for i, connection in enumerate(connections):
+        for j, section in enumerate(connection['sections']):
+            writer.writerow([
+                i, connection['change_count'], j,
+                section['station_from'], section['platform_from'], section['departure'].isoformat(),
+                section['station_to'], section['platform_to'], section['arrival'].isoformat(),
+                section['travelwith'],
+            ])
+        out.flush()
+
+
+def write_csv(connections, out):
+    _write_rows(connections, out, ',')
+
+
+def write_tsv(connections, out):
+    _write_rows(connections, out, '\t')
+
+
+WRITERS = {
+    'json': write_json,
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+    'tsv': write_tsv,
+}
+
+
+def write(connections, output_format, out):
+    """Write connections in one of the ``WRITERS`` formats to ``out``."""
+    WRITERS[output_format](connections, out)
@@ -47,6 +47,55 @@ keywords = {
 }
 
 
+# Top level keywords per language
+keyword_dicts = {
+    'en': {'from': 'from', 'to': 'to', 'via': 'via',
+           'departure': 'departure', 'arrival': 'arrival'},
+    'de': {'from': 'von', 'to': 'nach', 'via': 'via',
+           'departure': 'ab', 'arrival': 'an'},
+    'fr': {'from': 'de', 'to': 'à', 'via': 'via',
+           'departure': 'départ', 'arrival': 'arrivée'},
+    'it': {'from': 'da', 'to': 'a', 'via': 'via',
+           'departure': 'partenza', 'arrival': 'arrivo'},
+}
+
+
+class _Grammar(object):
+    """Keywords and patterns of one language, compiled once at import."""
+
+    def __init__(self, language):
+        kws = keywords[language]
+        self.language = language
+        # Top level keyword -> role ('from', 'to', ...)
+        self.roles = dict((v, k) for k, v in keyword_dicts[language].items())
+        self.at = frozenset(kws['at'])
+        self.now = frozenset(kws['now'])
+        self.noon = frozenset(kws['noon'])
+        self.midnight = frozenset(kws['midnight'])
+        # Day keywords in ascending priority: if several match, the last one
+        # wins. Values are (is_weekday, number).
+        shifts = [(w, (False, i)) for i, d in enumerate(['today', 'tomorrow']) for w in kws[d]]
+        shifts += [(w, (True, i)) for i, w in enumerate(kws['weekdays'])]
+        self.shift_priority = dict((w, p) for p, (w, _) in enumerate(shifts))
+        self.shifts = dict(shifts)
+        self.shift_re = re.compile('|'.join(
+            re.escape(w) for w in sorted(self.shifts, key=len, reverse=True)))
+        self.days_res = [re.compile(p) for p in kws['days']]
+
+
+_grammars = dict((language, _Grammar(language)) for language in keyword_dicts)
+
+# Token -> list of languages it is a top level keyword of
+_token_languages = {}
+for _language, _keywords in keyword_dicts.items():
+    for _token in _keywords.values():
+        _token_languages.setdefault(_token, []).append(_language)
+
+_time_re = re.compile(r'(?<!/)(\d{2})(?::*)(\d{2})')
+_date_formats = [(re.compile(r"(\d{2}/\d{2}/\d{4})"), "%d/%m/%Y"),
+                 (re.compile(r"(\d{2}/\d{2})"), "%d/%m")]
+
+
 def _process_tokens(tokens, sloppy_validation=False):
     """Parse input tokens.
 
@@ -73,24 +122,14 @@ def _process_tokens(tokens, sloppy_validation=False):
     if len(tokens) < 2:
         return {}, None
 
-    keyword_dicts = {
-        'en': {'from': 'from', 'to': 'to', 'via': 'via',
-               'departure': 'departure', 'arrival': 'arrival'},
-        'de': {'from': 'von', 'to': 'nach', 'via': 'via',
-               'departure': 'ab', 'arrival': 'an'},
-        'fr': {'from': 'de', 'to': 'à', 'via': 'via',
-               'departure': 'départ', 'arrival': 'arrivée'},
-        'it': {'from': 'da', 'to': 'a', 'via': 'via',
-               'departure': 'partenza', 'arrival': 'arrivo'},
-    }
-
     # Detect language
-    language = _detect_language(keyword_dicts, tokens)
-    logging.info('Detected [%s] input' % language)
+    language = _detect_language(tokens)
+    logging.info('Detected [%s] input', language)
 
     # Keywords mapping
-    keywords = dict((v, k) for k, v in keyword_dicts[language].items())
-    logging.debug('Using keywords: ' + ', '.join(keywords.keys()))
+    keywords = _grammars[language].roles
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug('Using keywords: ' + ', '.join(keywords.keys()))
 
     # Prepare variables
     data = {}
@@ -105,7 +144,7 @@ def _process_tokens(tokens, sloppy_validation=False):
 
     # Process tokens
     for token in tokens:
-        if token in keywords.keys():
+        if token in keywords:
             if stack:
                 process_stack()
         elif not stack:
@@ -127,28 +166,24 @@ def _process_tokens(tokens, sloppy_validation=False):
     return data, language
 
 
-def _detect_language(keyword_dicts, tokens):
+def _detect_language(tokens):
     """Detect the language of the tokens by finding the highest intersection
     with the keywords of a specific language."""
+    counts = dict.fromkeys(keyword_dicts, 0)
+    for token in set(tokens):
+        for language in _token_languages.get(token, ()):
+            counts[language] += 1
+    # On ties, the first language wins
+    return max(counts, key=counts.get)
 
-    def intersection_count(a, b):
-        return len(set(a).intersection(b))
-
-    counts = []
-    for lang, keywords in keyword_dicts.items():
-        count = intersection_count(keywords.values(), tokens)
-        counts.append((lang, count))
-
-    language = max(counts, key=lambda x: x[1])[0]
-    return language
 
-
-def _parse_date(datestring, keywords):
+def _parse_date(datestring, grammar, now=None):
     """Parse date tokens.
 
     Args:
         datestring: String containing a date specification.
-        keywords: Language keywords
+        grammar: Compiled language grammar.
+        now: Reference time (default ``datetime.now()``).
 
     Returns:
         date string.
@@ -157,22 +192,23 @@ def _parse_date(datestring, keywords):
         ValueError: If time could not be parsed.
 
     """
+    if now is None:
+        now = datetime.now()
     date = None
     days_shift = None
-    # Keywords
-    for i, d in enumerate(["today", "tomorrow"]):
-        if any([t in datestring for t in keywords[d]]):
-            days_shift = i
-    # Weekdays
-    for i, d in enumerate(keywords["weekdays"]):
-        if d in datestring:
-            days_shift = i - datetime.now().weekday()
+    # Keywords and weekdays
+    matches = grammar.shift_re.findall(datestring)
+    if matches:
+        is_weekday, number = grammar.shifts[max(matches, key=grammar.shift_priority.get)]
+        days_shift = number
+        if is_weekday:
+            days_shift = number - now.weekday()
             if days_shift <= 0:
                 days_shift += 7
     # Shifts
     if days_shift is None:
-        for pattern in keywords["days"]:
-            days_re = re.search(pattern, datestring)
+        for pattern in grammar.days_res:
+            days_re = pattern.search(datestring)
             if days_re:
                 try:
                     days_shift = int(days_re.group(1))
@@ -180,18 +216,18 @@ def _parse_date(datestring, keywords):
                     pass
 
     if days_shift is not None:
-        return datetime.now() + timedelta(days=days_shift)
+        return now + timedelta(days=days_shift)
 
     # Regular date strings
-    for dateformat in [[r"(\d{2}/\d{2}/\d{4})", "%d/%m/%Y"], [r"(\d{2}/\d{2})", "%d/%m"]]:
-        days_re = re.search(dateformat[0], datestring)
+    for pattern, dateformat in _date_formats:
+        days_re = pattern.search(datestring)
         if days_re:
             try:
-                date = datetime.strptime(days_re.group(1), dateformat[1])
+                date = datetime.strptime(days_re.group(1), dateformat)
             except:
                 continue
             if date.year == 1900:
-                date = date.replace(year=datetime.now().year)
+                date = date.replace(year=now.year)
             break
 
     if date is not None:
@@ -200,12 +236,13 @@ def _parse_date(datestring, keywords):
     return None
 
 
-def _parse_time(timestring, keywords):
+def _parse_time(timestring, grammar, now=None):
     """Parse time tokens.
 
     Args:
         timestring: String containing a time specification.
-        keywords: Language keywords
+        grammar: Compiled language grammar.
+        now: Reference time (default ``datetime.now()``).
 
     Returns:
         Time string.
@@ -216,25 +253,24 @@ def _parse_time(timestring, keywords):
     """
 
     # Ignore "at" keywords
-    if timestring.split(' ', 1)[0] in keywords['at']:
+    if timestring.split(' ', 1)[0] in grammar.at:
         timestring = timestring.split(' ', 1)[1]
 
     # Parse regular time strings
-    # regular_time_match = re.search(r'([0-2]?[0-9])[:\-\. ]([0-9]{2})', timestring)
-    regular_time_match = re.search(r'(?<!/)(\d{2})(?::*)(\d{2})', timestring)
+    regular_time_match = _time_re.search(timestring)
     if regular_time_match:
         return ':'.join(regular_time_match.groups())
     timestring = timestring.lower()
-    if timestring in keywords['now']:
-        return datetime.now().strftime('%H:%M')
-    if timestring in keywords['noon']:
+    if timestring in grammar.now:
+        return (now or datetime.now()).strftime('%H:%M')
+    if timestring in grammar.noon:
         return '12:00'
-    if timestring in keywords['midnight']:
+    if timestring in grammar.midnight:
         return '23:59'  # '00:00' would be the first minute of the day, not the last one.
     raise ValueError('Time is missing or could not be parsed')
 
 
-def parse_input(tokens):
+def parse_input(tokens, now=None):
     """Parse input tokens.
 
     Take a list of tokens (usually ``sys.argv[1:]``) and parse the "human
@@ -243,6 +279,8 @@ def parse_input(tokens):
 
     Args:
         tokens: List of tokens (usually ``sys.argv[1:]``.
+        now: Reference time for relative dates and times (default
+            ``datetime.now()``).
 
     Returns:
         A 2-tuple containing the data dictionary and the language string. For
@@ -264,20 +302,49 @@ def parse_input(tokens):
             return {'from': tokens[0], 'to': tokens[1]}, 'en'
         return data, language
 
-    try:
-        kws = keywords[language]
-    except IndexError:
-        raise ValueError('Invalid language: "%s"!' % language)
+    grammar = _grammars[language]
     # Map keys
     for t in ["departure", "arrival"]:
         if t in data:
-            data["time"] = _parse_time(data[t], kws)
-            date = _parse_date(data[t], kws)
+            data["time"] = _parse_time(data[t], grammar, now)
+            date = _parse_date(data[t], grammar, now)
             if date is not None:
                 data["date"] = date
             if t == "arrival":
                 data['isArrivalTime'] = 1
             del data[t]
 
-    logging.debug('Data: ' + repr(data))
+    logging.debug('Data: %r', data)
     return data, language
+
+
+def parse_input_many(queries, now=None, errors='raise'):
+    """Parse many queries with one shared clock snapshot.
+
+    Args:
+        queries: Iterable of queries, either token lists or strings (which
+            are split on whitespace).
+        now: Reference time for all relative dates and times (default
+            ``datetime.now()`` at the time of the call).
+        errors: 'raise' to raise the first ``ValueError``, 'return' to put it
+            into the results in place of the failing query.
+
+    Returns:
+        A list with a ``(data, language)`` tuple (see ``parse_input``) or a
+        ``ValueError`` per query.
+
+    """
+    if errors not in ('raise', 'return'):
+        raise ValueError('Invalid errors value: "%s"!' % errors)
+    if now is None:
+        now = datetime.now()
+    results = []
+    for query in queries:
+        tokens = query.split() if isinstance(query, str) else query
+        try:
+            results.append(parse_input(tokens, now))
+        except ValueError as e:
+            if errors == 'raise':
+                raise
+            results.append(e)
+    return results
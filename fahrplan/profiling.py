@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Timing of the phases of a query.
+
+The stages of the pipeline are measured with ``with timed('decode'): ...``.
+Phases can be nested, the time of a phase excludes the phases nested in it,
+so that the phases of a thread add up to the time it spent. The measured
+phases are, in pipeline order:
+
+- ``parse_input``: parsing the command line query
+- ``import``: importing the modules needed for the query
+- ``cache``: response cache lookups and stores
+- ``rate_limit``: waiting for the rate limiter
+- ``warmup_wait``: waiting for the background connection warm-up
+- ``dns``, ``connect``, ``tls``: opening a new connection to the API
+- ``first_byte``: sending the request and waiting for the response headers
+- ``download``: receiving the response body
+- ``decode``: decoding the JSON response
+- ``parse``: turning the API connections into records
+- ``retry_wait``: waiting before retrying a failed request
+- ``render``: writing the output (without the phases above, when the output
+  is written while the response is still being received)
+
+Every measurement is passed to the callbacks registered with
+:func:`add_listener` as ``callback(phase, seconds)``, from the thread that
+measured it. Nothing is timed while no callback is registered. Callbacks
+with a ``count(name, amount)`` method also receive counters, the bytes of
+the responses on the wire (``bytes_wire``) and decoded (``bytes_decoded``).
+:class:`Profile` is such a callback, summing up the phases for a report::
+
+    with Profile() as profile:
+        client.get_connections(request)
+    profile.report(sys.stderr)
+
+Listeners receive the phases of all threads, e.g. those of the background
+connection warm-up or of all batch workers, so the phases can add up to
+more than the wall time.
+"""
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+PHASES = ('parse_input', 'import', 'cache', 'rate_limit', 'warmup_wait', 'dns', 'connect', 'tls',
+          'first_byte', 'download', 'decode', 'parse', 'retry_wait', 'render')
+
+_listeners = ()
+_listeners_lock = threading.Lock()
+_local = threading.local()
+
+
+def add_listener(callback):
+    """Call ``callback(phase, seconds)`` for every measured phase."""
+    global _listeners
+    with _listeners_lock:
+        _listeners = _listeners + (callback,)
+
+
+def remove_listener(callback):
+    """Remove a callback registered with ``add_listener``."""
+    global _listeners
+    with _listeners_lock:
+        listeners = list(_listeners)
+        listeners.remove(callback)
+        _listeners = tuple(listeners)
+
+
+def active():
+    """Return whether any listener is registered."""
+    return bool(_listeners)
+
+
+def record(phase, seconds):
+    """Pass a measurement to the listeners."""
+    for callback in _listeners:
+        callback(phase, seconds)
+
+
+def count(name, amount):
+    """Pass a counter to the listeners with a ``count`` method."""
+    for callback in _listeners:
+        counter = getattr(callback, 'count', None)
+        if counter is not None:
+            counter(name, amount)
+
+
+@contextmanager
+def timed(phase):
+    """Measure the time spent in the block as ``phase``."""
+    if not _listeners:
+        yield
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)  # Time spent in nested phases
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        record(phase, elapsed - nested)
+
+
+def _format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '{0:.1f} {1}'.format(size, unit)
+        size /= 1024.0
+    return '{0:.1f} GiB'.format(size)
+
+
+class Profile(object):
+    """Sum up the time of each phase while it is running.
+
+    Args:
+        cpu: Optional path to write ``cProfile`` statistics to (readable
+            with ``python -m pstats`` or e.g. snakeviz). Only the thread
+            starting the profile is profiled.
+        memory: Whether to trace memory allocations with ``tracemalloc``,
+            the report then includes the peak memory and the biggest
+            allocation sites.
+
+    Attributes:
+        phases: Dictionary of phase name to ``[calls, seconds]``.
+        counters: Dictionary of counter name to total amount.
+        wall: Wall time between ``start()`` and ``stop()`` in seconds.
+
+    """
+
+    def __init__(self, cpu=None, memory=False):
+        self.cpu = cpu
+        self.memory = memory
+        self.phases = {}
+        self.counters = {}
+        self.wall = None
+        self.peak_memory = None
+        self.allocations = []
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._start = None
+
+    def __call__(self, phase, seconds):
+        with self._lock:
+            entry = self.phases.get(phase)
+            if entry is None:
+                entry = self.phases[phase] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += seconds
+
+    def count(self, name, amount):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        if self.cpu:
+            import cProfile
+            self._profiler = cProfile.Profile()
+        add_listener(self)
+        self._start = time.perf_counter()
+        if self._profiler is not None:
+            self._profiler.enable()
+        return self
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.cpu)
+        self.wall = time.perf_counter() - self._start
+        remove_listener(self)
+        if self.memory:
+            import tracemalloc
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                tracemalloc.Filter(False, '*/cProfile.py'),
+            ])
+            tracemalloc.stop()
+            self.allocations = snapshot.statistics('lineno')
+
+    def report(self, out=None, limit=10):
+        """Write a table of the phases to ``out`` (default stderr).
+
+        Args:
+            limit: Number of allocation sites listed if memory was traced.
+
+        """
+        out = out or sys.stderr
+        wall = self.wall or 0.0
+        order = list(PHASES) + sorted(set(self.phases) - set(PHASES))
+        lines = ['{0:<12} {1:>6} {2:>10} {3:>6}'.format('Phase', 'Calls', 'Time [ms]', '%')]
+        measured = 0.0
+        for phase in order:
+            if phase not in self.phases:
+                continue
+            calls, seconds = self.phases[phase]
+            measured += seconds
+            lines.append('{0:<12} {1:>6} {2:>10.1f} {3:>6.1f}'.format(
+                phase, calls, seconds * 1000, seconds / wall * 100 if wall else 0))
+        if wall > measured:
+            lines.append('{0:<12} {1:>6} {2:>10.1f} {3:>6.1f}'.format(
+                'other', '', (wall - measured) * 1000, (wall - measured) / wall * 100))
+        lines.append('{0:<12} {1:>6} {2:>10.1f}'.format('wall time', '', wall * 1000))
+        if 'bytes_wire' in self.counters:
+            lines.append('')
+            lines.append('Received {0} on the wire, {1} decoded'.format(
+                _format_size(self.counters['bytes_wire']),
+                _format_size(self.counters.get('bytes_decoded', 0))))
+        if self.peak_memory is not None:
+            lines.append('')
+            lines.append('Peak traced memory: {0}'.format(_format_size(self.peak_memory)))
+            for statistic in self.allocations[:limit]:
+                frame = statistic.traceback[0]
+                lines.append('{0:>12}  {1}:{2}'.format(
+                    _format_size(statistic.size), frame.filename, frame.lineno))
+        if self.cpu:
+            lines.append('')
+            lines.append('CPU profile written to {0}'.format(self.cpu))
+        out.write('\n'.join(lines) + '\n')
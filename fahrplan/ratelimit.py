@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Client side rate limiting and retry scheduling.
+
+:class:`RateLimiter` is a token bucket. Its state can be kept in a file, so
+that all threads and processes using the same file share one budget of
+requests, e.g. concurrent batch jobs and the interactive CLI. Within a
+process, waiting requests are served by priority: queries a user is waiting
+for (``INTERACTIVE``) go ahead of background work like prefetching and batch
+jobs (``BULK``). The priority of the requests of a thread is set with
+``with priority(BULK): ...``.
+
+When the API answers with HTTP 429, the limiter pauses all requests for the
+``Retry-After`` period and halves its rate, which then slowly recovers
+(additive increase, multiplicative decrease), so the request rate settles
+just below what the API allows.
+"""
+import os
+import time
+import heapq
+import random
+import struct
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# Request priorities, lower values are served first.
+INTERACTIVE = 0
+BULK = 10
+
+# Default number of retries of failed requests, base and maximum backoff
+# delay in seconds. Requests whose Retry-After exceeds the maximum are not
+# retried.
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+MAX_RETRY_DELAY = 60
+
+# HTTP statuses worth retrying.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# tokens, time of the last update, current rate, paused until
+_STATE = struct.Struct('<dddd')
+
+_local = threading.local()
+
+
+def current_priority():
+    """Return the request priority of the calling thread."""
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+@contextmanager
+def priority(value):
+    """Run the requests of the calling thread with the given priority."""
+    previous = current_priority()
+    _local.priority = value
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def default_state_path():
+    """Return the default location of the shared rate limiter state."""
+    from .cache import default_cache_path
+    return os.path.join(os.path.dirname(default_cache_path()), 'ratelimit.state')
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF, cap=MAX_RETRY_DELAY):
+    """Return the delay before retry number ``attempt`` (starting at 0).
+
+    Exponential backoff with full jitter: a random delay between 0 and
+    ``base * 2 ** attempt``, at most ``cap``.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_delay(headers, now=None):
+    """Return the delay in seconds requested by a ``Retry-After`` header.
+
+    Returns None if the header is missing or invalid.
+    """
+    value = (headers or {}).get('Retry-After')
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+class RateLimiter(object):
+    """Token bucket rate limiter shared by threads and, optionally, processes.
+
+    Args:
+        rate: Maximum number of requests per second.
+        burst: Number of requests that may be sent at once after a quiet
+            period (default 1, i.e. requests are evenly spaced).
+        path: Optional file keeping the state, shared by all processes using
+            the same path. Without it, the limit applies to this instance.
+        adaptive: Whether to lower the rate when the API throttles and to
+            raise it again as long as it doesn't (default True).
+
+    Priorities only order the waiting requests of one process; between
+    processes, requests are served in the order in which they find a token.
+    """
+
+    def __init__(self, rate, burst=None, path=None, adaptive=True):
+        if rate <= 0:
+            raise ValueError('The rate must be positive')
+        self.rate = float(rate)
+        self.burst = float(burst or 1)
+        self.path = path
+        self.adaptive = adaptive
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._state = (self.burst, time.time(), self.rate, 0.0)
+        self._fd = None
+        if path is not None and fcntl is not None:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @contextmanager
+    def _locked_state(self):
+        """Yield a one element list with the state, storing changes."""
+        if self._fd is None:
+            state = [self._state]
+            yield state
+            self._state = state[0]
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            data = os.pread(self._fd, _STATE.size, 0)
+            state = [_STATE.unpack(data) if len(data) == _STATE.size else self._state]
+            yield state
+            os.pwrite(self._fd, _STATE.pack(*state[0]), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _take(self):
+        """Take a token if possible, else return the seconds until one is available."""
+        with self._locked_state() as state:
+            tokens, updated, rate, paused_until = state[0]
+            now = time.time()
+            if now < paused_until:
+                return paused_until - now
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * rate)
+            if tokens >= 1:
+                state[0] = (tokens - 1, now, rate, paused_until)
+                return 0
+            state[0] = (tokens, now, rate, paused_until)
+            return (1 - tokens) / rate
+
+    def acquire(self, priority=None):
+        """Wait until a request may be sent.
+
+        Args:
+            priority: Priority of the request (default: the priority of the
+                calling thread, see ``priority()``).
+
+        Returns:
+            The time waited in seconds.
+
+        """
+        if priority is None:
+            priority = current_priority()
+        start = time.time()
+        with self._cond:
+            entry = (priority, next(self._counter))
+            heapq.heappush(self._waiters, entry)
+            self._cond.notify_all()
+            try:
+                while True:
+                    timeout = None
+                    if self._waiters[0] == entry:
+                        timeout = self._take()
+                        if not timeout:
+                            return time.time() - start
+                    self._cond.wait(timeout)
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def try_acquire(self, priority=None):
+        """Take a token if one is available, without waiting.
+
+        Threads waiting in :meth:`acquire` with the same or a higher
+        priority go first.
+
+        Returns:
+            0 if a request may be sent, else the seconds until it may be
+            worth trying again.
+
+        """
+        if priority is None:
+            priority = current_priority()
+        with self._cond:
+            if self._waiters and self._waiters[0][0] <= priority:
+                return 1 / self.rate
+            return self._take()
+
+    def throttled(self, delay=None):
+        """Record that the API throttled a request.
+
+        Pauses all requests for ``delay`` seconds (e.g. the ``Retry-After``
+        period) and, if adaptive, halves the rate.
+        """
+        with self._cond:
+            with self._locked_state() as state:
+                tokens, updated, rate, paused_until = state[0]
+                if self.adaptive:
+                    rate = max(rate / 2, self.rate / 64)
+                if delay:
+                    paused_until = max(paused_until, time.time() + delay)
+                state[0] = (0.0, time.time(), rate, paused_until)
+                logging.debug('Throttled, rate lowered to {0:.2f}/s'.format(rate))
+            self._cond.notify_all()
+
+    def succeeded(self):
+        """Record a successful request, slowly raising a lowered rate."""
+        if not self.adaptive:
+            return
+        with self._cond:
+            with self._locked_state() as state:
+                tokens, updated, rate, paused_until = state[0]
+                if rate < self.rate:
+                    state[0] = (tokens, updated, min(self.rate, rate + self.rate / 32), paused_until)
+
+    @property
+    def current_rate(self):
+        """The current (possibly lowered) rate in requests per second."""
+        with self._cond:
+            with self._locked_state() as state:
+                return state[0][2]
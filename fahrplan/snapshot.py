@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped snapshots of the connections of fixed routes (``--snapshot``).
+
+``fahrplan snapshot build ROUTES`` fetches all connections of a day for the
+routes in a file (one query per line like ``bern zürich``, see
+:func:`read_routes`) and writes them to a snapshot file. With
+``--snapshot``, queries for these routes are answered from the file without
+any request or JSON decoding; other queries go to the API.
+
+The file consists of a header and arrays of fixed size numbers, which are
+used in place through ``mmap`` and ``memoryview.cast``, so opening a snapshot
+costs about as much as reading its header. All strings are stored once in a
+string table. The connections of a route are stored sorted by departure,
+the first one of a query is found by binary search. Times are stored as
+local wall clock seconds since the epoch (so that requested local times
+compare directly) together with their UTC offset.
+
+Layout (little endian, every array aligned to 8 bytes)::
+
+    header        '<4sHHqqIIII': magic, version, 0, first and last covered
+                  second, number of strings, routes, connections and sections
+    strings       I offsets (n + 1), then the UTF-8 data
+    routes        I from, I to (folded names), I first connection, I count
+    connections   q departure, q arrival, I first section, H sections,
+                  H transfers, I travelwith, B walks
+    sections      q departure, q arrival, h UTC offsets of both in minutes,
+                  I from, I to, I travelwith, I platform from, I platform to
+
+The string ``0xffffffff`` stands for None.
+"""
+import os
+import mmap
+import struct
+import bisect
+import logging
+import tempfile
+import threading
+from array import array
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from .api import FahrplanError
+from .cache import default_cache_path, normalize_request
+from .models import Connection, Section
+from .stations import fold
+
+MAGIC = b'FPSN'
+VERSION = 1
+_HEADER = struct.Struct('<4sHHqqIIII')
+_NONE = 0xffffffff
+_SIZES = {typecode: struct.calcsize(typecode) for typecode in 'BHhIq'}
+
+# Columns of the arrays: (name, array typecode)
+_ROUTE_COLUMNS = (('from', 'I'), ('to', 'I'), ('first', 'I'), ('count', 'I'))
+_CONNECTION_COLUMNS = (('dep', 'q'), ('arr', 'q'), ('first', 'I'), ('sections', 'H'), ('transfers', 'H'),
+                       ('travelwith', 'I'), ('walks', 'B'))
+_SECTION_COLUMNS = (('dep', 'q'), ('arr', 'q'), ('dep_offset', 'h'), ('arr_offset', 'h'), ('from', 'I'),
+                    ('to', 'I'), ('travelwith', 'I'), ('platform_from', 'I'), ('platform_to', 'I'))
+
+# Connections requested per API call while building a snapshot.
+FETCH_LIMIT = 16
+
+# Number of connections returned if the request doesn't set a limit.
+DEFAULT_LIMIT = 4
+
+
+def default_snapshot_path():
+    """Return the default location of the snapshot file."""
+    return os.path.join(os.path.dirname(default_cache_path()), 'snapshot.bin')
+
+
+def _pad(size):
+    return -size % 8
+
+
+def _local_seconds(when):
+    """Return the local wall clock time of an aware datetime as epoch seconds."""
+    return timegm(when.replace(tzinfo=None).timetuple())
+
+
+def read_routes(lines):
+    """Return the ``(from, to)`` routes of the non-empty, non-comment lines.
+
+    A line is a query as accepted on the command line, only its ``from`` and
+    ``to`` stations are used.
+
+    Raises:
+        ValueError: If a line is not a valid query.
+
+    """
+    from .parser import parse_input
+    routes = []
+    for number, line in enumerate(lines, 1):
+        query = line.strip()
+        if not query or query.startswith('#'):
+            continue
+        try:
+            request, language = parse_input(query.split())
+        except ValueError as e:
+            raise ValueError('Line {}: {}'.format(number, e))
+        if 'from' not in request or 'to' not in request:
+            raise ValueError('Line {}: "from" and "to" arguments must be present!'.format(number))
+        routes.append((request['from'], request['to']))
+    return routes
+
+
+def fetch_day(client, origin, destination, date):
+    """Return all connections of a route leaving on ``date``, with sections."""
+    connections = []
+    seen = set()
+    cursor = datetime.combine(date, datetime.min.time())
+    while cursor.date() == date:
+        request = {'from': origin, 'to': destination, 'date': cursor.strftime('%Y/%m/%d'),
+                   'time': cursor.strftime('%H:%M'), 'limit': FETCH_LIMIT}
+        batch = client.get_connections(request, True, keep_raw=False)['connections']
+        new = 0
+        for connection in batch:
+            sections = connection.sections
+            departure = sections[0].departure
+            key = (departure, sections[-1].arrival, connection.travelwith)
+            if departure.date() != date or key in seen:
+                continue
+            seen.add(key)
+            connections.append(connection)
+            new += 1
+        if not new:
+            break
+        latest = max(c.sections[0].departure for c in batch)
+        cursor = max(cursor, latest.replace(tzinfo=None)) + timedelta(minutes=1)
+    connections.sort(key=lambda c: c.sections[0].departure)
+    return connections
+
+
+class _Writer(object):
+    """Collect the strings and columns of a snapshot file."""
+
+    def __init__(self):
+        self.strings = {}
+        self.routes = {name: array(typecode) for name, typecode in _ROUTE_COLUMNS}
+        self.connections = {name: array(typecode) for name, typecode in _CONNECTION_COLUMNS}
+        self.sections = {name: array(typecode) for name, typecode in _SECTION_COLUMNS}
+
+    def string(self, value):
+        if value is None:
+            return _NONE
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    @staticmethod
+    def append(columns, **values):
+        for name, column in columns.items():
+            column.append(values[name])
+
+    def add_connection(self, connection):
+        sections = connection.sections
+        first = len(self.sections['dep'])
+        for section in sections:
+            self.append(self.sections, dep=_local_seconds(section.departure),
+                        arr=_local_seconds(section.arrival),
+                        dep_offset=int(section.departure.utcoffset().total_seconds() // 60),
+                        arr_offset=int(section.arrival.utcoffset().total_seconds() // 60),
+                        travelwith=self.string(section.travelwith),
+                        platform_from=self.string(section.platform_from),
+                        platform_to=self.string(section.platform_to),
+                        **{'from': self.string(section.station_from), 'to': self.string(section.station_to)})
+        # Full connections have ", Walk" appended, store the summary
+        travelwith = connection.travelwith
+        walks = travelwith.endswith(', Walk')
+        if walks:
+            travelwith = travelwith[:-len(', Walk')]
+        self.append(self.connections, dep=_local_seconds(sections[0].departure),
+                    arr=_local_seconds(sections[-1].arrival), first=first, sections=len(sections),
+                    transfers=int(connection.change_count), travelwith=self.string(travelwith),
+                    walks=int(walks))
+
+    def write(self, path, start, end):
+        blob = bytearray()
+        offsets = array('I', [0])
+        for value in sorted(self.strings, key=self.strings.get):
+            blob += value.encode('utf-8')
+            offsets.append(len(blob))
+        parts = [_HEADER.pack(MAGIC, VERSION, 0, start, end, len(self.strings), len(self.routes['from']),
+                              len(self.connections['dep']), len(self.sections['dep'])),
+                 offsets.tobytes(), bytes(blob)]
+        for columns in (self.routes, self.connections, self.sections):
+            parts.extend(column.tobytes() for column in columns.values())
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory or None, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            for part in parts:
+                f.write(part)
+                f.write(b'\0' * _pad(len(part)))
+        # Processes which have the old file mapped keep reading it
+        os.replace(tmp, path)
+
+
+def build(client, routes, date, path=None, workers=4, err=None):
+    """Fetch the connections of the routes on ``date`` and write a snapshot.
+
+    Routes failing to load are reported on ``err`` and left out.
+
+    Returns:
+        A ``(connections, failed routes)`` tuple.
+
+    """
+    path = path or default_snapshot_path()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fahrplan-snapshot') as executor:
+        futures = [(route, executor.submit(fetch_day, client, route[0], route[1], date)) for route in routes]
+    writer = _Writer()
+    failed = []
+    entries = {}  # (from, to) folded names -> (first connection, count)
+    for (origin, destination), future in futures:
+        try:
+            connections = future.result()
+        except FahrplanError as e:
+            logging.debug('Snapshot of {0} - {1} failed: {2}'.format(origin, destination, e))
+            if err is not None:
+                print('Error: {} - {}: {}'.format(origin, destination, e), file=err)
+            failed.append((origin, destination))
+            continue
+        first = len(writer.connections['dep'])
+        for connection in connections:
+            writer.add_connection(connection)
+        # The route can be looked up by the queried and by the found names
+        keys = {(fold(origin), fold(destination))}
+        if connections:
+            sections = connections[0].sections
+            keys.add((fold(sections[0].station_from), fold(sections[-1].station_to)))
+        for key in keys:
+            entries.setdefault(key, (first, len(connections)))
+    # Sorted for the binary search in Snapshot.route()
+    for key, (first, count) in sorted(entries.items()):
+        writer.append(writer.routes, first=first, count=count,
+                      **{'from': writer.string(key[0]), 'to': writer.string(key[1])})
+    start = timegm(date.timetuple())
+    writer.write(path, start, start + 86400)
+    return len(writer.connections['dep']), failed
+
+
+class _Columns(object):
+    """Columns of one array group of a snapshot, cast on first access."""
+
+    def __init__(self, snapshot, group):
+        self._snapshot = snapshot
+        self._group = group
+
+    def __getitem__(self, name):
+        return self._snapshot.column(self._group, name)
+
+
+class Snapshot(object):
+    """Read-only view of a snapshot file.
+
+    The columns are only mapped when first used.
+
+    Raises:
+        FahrplanError: If the file is missing or not a snapshot.
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_snapshot_path()
+        try:
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            raise FahrplanError('No snapshot at {}, build one with "fahrplan snapshot build ROUTES"'.format(
+                self.path))
+        try:
+            (magic, version, _, self.start, self.end, strings, routes, connections,
+             sections) = _HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic = version = None
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise FahrplanError('{} is not a snapshot file of this version'.format(self.path))
+        self.route_count = routes
+        self._view = memoryview(self._mmap)
+        self._views = {}
+        # Offsets of the arrays: {(group, column): (offset, typecode, length)}
+        self._layout = {}
+        offset = _HEADER.size + _pad(_HEADER.size)
+        self._string_offsets = self._view[offset:offset + 4 * (strings + 1)].cast('I')
+        offset += 4 * (strings + 1) + _pad(4 * (strings + 1))
+        size = self._string_offsets[strings]
+        self._blob = self._view[offset:offset + size]
+        offset += size + _pad(size)
+        for group, columns, length in (('routes', _ROUTE_COLUMNS, routes),
+                                       ('connections', _CONNECTION_COLUMNS, connections),
+                                       ('sections', _SECTION_COLUMNS, sections)):
+            for name, typecode in columns:
+                self._layout[group, name] = (offset, typecode, length)
+                size = _SIZES[typecode] * length
+                offset += size + _pad(size)
+        self.routes = _Columns(self, 'routes')
+        self.connections = _Columns(self, 'connections')
+        self.sections = _Columns(self, 'sections')
+        self._strings = {}
+        self._tzinfos = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def column(self, group, name):
+        """Return a column of the ``routes``, ``connections`` or ``sections``."""
+        view = self._views.get((group, name))
+        if view is None:
+            offset, typecode, length = self._layout[group, name]
+            view = self._views[group, name] = self._view[offset:offset + _SIZES[typecode] * length].cast(typecode)
+        return view
+
+    def close(self):
+        for view in self._views.values():
+            view.release()
+        self._string_offsets.release()
+        self._blob.release()
+        self._view.release()
+        self._mmap.close()
+
+    def route(self, origin, destination):
+        """Return ``(first connection, count)`` of a route, or None.
+
+        The names have to be folded with :func:`fahrplan.stations.fold`.
+        """
+        starts, ends = self.routes['from'], self.routes['to']
+        key = (origin, destination)
+        low, high = 0, self.route_count
+        while low < high:
+            middle = (low + high) // 2
+            if (self.string(starts[middle]), self.string(ends[middle])) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.route_count and (self.string(starts[low]), self.string(ends[low])) == key:
+            return self.routes['first'][low], self.routes['count'][low]
+        return None
+
+    def string(self, index):
+        if index == _NONE:
+            return None
+        value = self._strings.get(index)
+        if value is None:
+            start, end = self._string_offsets[index], self._string_offsets[index + 1]
+            value = self._strings[index] = str(self._blob[start:end], 'utf-8')
+        return value
+
+    def _time(self, local, offset):
+        tz = self._tzinfos.get(offset)
+        if tz is None:
+            tz = self._tzinfos[offset] = timezone(timedelta(minutes=offset))
+        return datetime.fromtimestamp(local - offset * 60, tz)
+
+    def _section(self, i, change_count=None):
+        s = self.sections
+        return Section(self.string(s['from'][i]), self.string(s['to'][i]), self.string(s['travelwith'][i]),
+                       self._time(s['dep'][i], s['dep_offset'][i]), self._time(s['arr'][i], s['arr_offset'][i]),
+                       self.string(s['platform_from'][i]), self.string(s['platform_to'][i]), change_count)
+
+    def _connection(self, i, include_sections):
+        c = self.connections
+        first, count = c['first'][i], c['sections'][i]
+        change_count = str(c['transfers'][i])
+        travelwith = self.string(c['travelwith'][i])
+        if include_sections:
+            if c['walks'][i]:
+                travelwith += ', Walk'
+            return Connection.decoded(change_count, travelwith,
+                                      [self._section(j) for j in range(first, first + count)])
+        # Summary section like _parse_connection builds it
+        s, last = self.sections, first + count - 1
+        return Connection.decoded(change_count, travelwith, [Section(
+            self.string(s['from'][first]), self.string(s['to'][last]), travelwith,
+            self._time(s['dep'][first], s['dep_offset'][first]), self._time(s['arr'][last], s['arr_offset'][last]),
+            self.string(s['platform_from'][first]), self.string(s['platform_to'][first]), change_count)])
+
+    def lookup(self, request, include_sections=False):
+        """Return the connections of a request, or None if not covered.
+
+        A request is covered if the snapshot has its route (without ``via``)
+        and its time, and holds enough connections to fill the ``limit``.
+        """
+        if request.get('via'):
+            return None
+        route = self.route(fold(request.get('from', '')), fold(request.get('to', '')))
+        if route is None:
+            return None
+        request = normalize_request(request)
+        try:
+            year, month, day = request['date'].split('/')
+            hour, minute = request['time'].split(':')
+            when = timegm((int(year), int(month), int(day), int(hour), int(minute), 0))
+        except ValueError:
+            return None
+        if not self.start <= when < self.end:
+            return None
+        first, count = route
+        limit = int(request.get('limit') or DEFAULT_LIMIT)
+        page = int(request.get('page') or 0)
+        departures = self.connections['dep']
+        if int(request.get('isArrivalTime') or 0):
+            arrivals = self.connections['arr']
+            end = bisect.bisect_right(departures, when, first, first + count)
+            matches = [i for i in range(first, end) if arrivals[i] <= when]
+            stop = len(matches) - page * limit
+            if stop > len(matches) or stop - limit < 0:
+                return None
+            matches = matches[stop - limit:stop]
+        else:
+            start = bisect.bisect_left(departures, when, first, first + count) + page * limit
+            if start < first or start + limit > first + count:
+                return None
+            matches = range(start, start + limit)
+        return [self._connection(i, include_sections) for i in matches]
+
+
+class SnapshotClient(object):
+    """Client answering queries from a snapshot, and others from the API.
+
+    Args:
+        snapshot: The :class:`Snapshot`.
+        client_factory: Callable returning the client used for queries the
+            snapshot doesn't cover; it is only called when needed.
+
+    """
+    station_index = None
+    cache = None
+
+    def __init__(self, snapshot, client_factory):
+        self.snapshot = snapshot
+        self._client_factory = client_factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.snapshot.close()
+        if self._client is not None:
+            self._client.close()
+
+    def warmup(self, background=False):
+        pass
+
+    @property
+    def client(self):
+        # Queries may come from several threads (e.g. ``--explore``)
+        with self._lock:
+            if self._client is None:
+                self._client = self._client_factory()
+            return self._client
+
+    def get_connections(self, request, include_sections=False, cache=None, keep_raw=True):
+        """Get the connections of a request, see ``FahrplanClient.get_connections``.
+
+        Answers from the snapshot only have a ``connections`` list.
+        """
+        connections = self.snapshot.lookup(request, include_sections)
+        if connections is None:
+            logging.debug('Not in the snapshot: {0!r}'.format(request))
+            return self.client.get_connections(request, include_sections, cache, keep_raw)
+        return {'connections': connections}
+
+    def iter_connections(self, request, include_sections=False):
+        connections = self.snapshot.lookup(request, include_sections)
+        if connections is None:
+            return self.client.iter_connections(request, include_sections)
+        return iter(connections)
@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the transport.opendata.ch API.
+
+Serves ``/v1/connections``, ``/v1/locations`` and ``/v1/stationboard`` from
+recorded responses or, if there is no recording for a request, from
+deterministic synthetic data. Like the API, the stand-in honours
+``fields[]`` parameters and compresses responses with gzip or deflate if the
+client accepts it. Responses carry an ``ETag``, requests with a matching
+``If-None-Match`` header are answered with 304 Not Modified. Latency,
+jitter, server errors and rate limiting (HTTP 429) can be injected, which
+makes it possible to test and benchmark the client without network access::
+
+    $ python -m fahrplan.standin --port 8000 --latency 80 --jitter 20
+    $ FAHRPLAN_API_URL=http://127.0.0.1:8000/v1 fahrplan von bern nach basel
+
+With ``--record UPSTREAM`` unknown requests are forwarded to the real API and
+stored in the recordings directory for later replay.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import hashlib
+import logging
+import argparse
+import threading
+import urllib.request
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .helpers import perror
+from .stations import fold as _fold
+
+STATIONS_FILE = os.path.join(os.path.dirname(__file__), 'data', 'stations.json')
+
+CATEGORIES = ['IC', 'IR', 'RE', 'S', 'EC']
+
+
+def _load_stations():
+    with open(STATIONS_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _parse_when(params, now=None):
+    """Return the requested date and time as a naive datetime."""
+    now = now or datetime.now()
+    when = now.replace(second=0, microsecond=0)
+    date = params.get('date')
+    if date:
+        for fmt in ('%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+            try:
+                d = datetime.strptime(date, fmt)
+            except ValueError:
+                continue
+            when = when.replace(year=d.year, month=d.month, day=d.day)
+            break
+    time_ = params.get('time')
+    if time_:
+        try:
+            t = datetime.strptime(time_, '%H:%M')
+            when = when.replace(hour=t.hour, minute=t.minute)
+        except ValueError:
+            pass
+    return when
+
+
+def project(data, fields):
+    """Keep only the members of a response selected by ``fields[]`` paths.
+
+    Paths like ``connections/sections/departure/station`` select a member and
+    everything below it; arrays along the path are traversed.
+    """
+    tree = {}
+    for field in fields:
+        node = tree
+        for name in field.strip('/').split('/'):
+            node = node.setdefault(name, {})
+        node[None] = True  # Keep the whole member
+    return _project(data, tree)
+
+
+def _project(value, tree):
+    if None in tree:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: _project(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+def _compress(body, accept_encoding):
+    """Return ``(encoding, body)`` compressed with gzip or deflate if accepted."""
+    accepted = [e.split(';')[0].strip().lower() for e in (accept_encoding or '').split(',')]
+    if 'gzip' in accepted:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return 'gzip', compressor.compress(body) + compressor.flush()
+    if 'deflate' in accepted:
+        return 'deflate', zlib.compress(body, 6)
+    return None, body
+
+
+def _timestamp(dt):
+    # Local times, with the offset of the local timezone like the API uses
+    # the one of Switzerland
+    return dt.astimezone().strftime('%Y-%m-%dT%H:%M:%S%z')
+
+
+class SyntheticData(object):
+    """Generator for deterministic, API shaped payloads.
+
+    Args:
+        connections: Default number of connections per response.
+        sections: Number of journey sections per connection (default one,
+            two if a via station is requested).
+        walks: Number of walk sections inserted into every connection.
+        pass_list: Number of intermediate stops per journey.
+
+    """
+
+    def __init__(self, connections=4, sections=None, walks=0, pass_list=3):
+        self.count = connections
+        self.sections = sections
+        self.walks = walks
+        self.pass_list = pass_list
+        self.stations = _load_stations()
+
+    def station(self, query):
+        """Find a bundled station by ID or (prefix of) name, or make one up."""
+        folded = _fold(query)
+        for station in self.stations:
+            if station['id'] == query or _fold(station['name']).startswith(folded):
+                return station
+        digest = int(hashlib.sha1(folded.encode('utf-8')).hexdigest()[:6], 16)
+        return {'id': str(8600000 + digest % 100000), 'name': query.strip().title(),
+                'coordinate': {'type': 'WGS84', 'x': 46.8, 'y': 8.2}}
+
+    def _location(self, station):
+        return {'id': station['id'], 'name': station['name'], 'score': None,
+                'coordinate': station['coordinate'], 'distance': None}
+
+    def _checkpoint(self, station, arrival=None, departure=None, platform=None):
+        return {
+            'station': self._location(station),
+            'arrival': _timestamp(arrival) if arrival else None,
+            'arrivalTimestamp': int(time.mktime(arrival.timetuple())) if arrival else None,
+            'departure': _timestamp(departure) if departure else None,
+            'departureTimestamp': int(time.mktime(departure.timetuple())) if departure else None,
+            'delay': 0,
+            'platform': platform,
+            'prognosis': {'platform': None, 'arrival': None, 'departure': None,
+                          'capacity1st': None, 'capacity2nd': None},
+            'realtimeAvailability': None,
+            'location': self._location(station),
+        }
+
+    def _journey(self, rnd, origin, destination, departure, arrival):
+        category = rnd.choice(CATEGORIES)
+        number = str(rnd.randint(1, 999) if category == 'S' else rnd.randint(100, 3999))
+        step = (arrival - departure) / (self.pass_list + 1)
+        pass_list = [self._checkpoint(origin, departure=departure, platform=str(rnd.randint(1, 12)))]
+        for i in range(self.pass_list):
+            t = departure + step * (i + 1)
+            stop = {'id': str(8590000 + rnd.randint(0, 9999)), 'name': 'Halt {}'.format(rnd.randint(1, 999)),
+                    'coordinate': {'type': 'WGS84', 'x': 46.9, 'y': 7.5}}
+            pass_list.append(self._checkpoint(stop, arrival=t, departure=t + timedelta(minutes=1)))
+        pass_list.append(self._checkpoint(destination, arrival=arrival))
+        return {'name': '{} {}'.format(category, number), 'category': category,
+                'subcategory': None, 'categoryCode': None, 'number': number,
+                'operator': 'SBB', 'to': destination['name'], 'passList': pass_list,
+                'capacity1st': None, 'capacity2nd': None}
+
+    def connection(self, rnd, origin, destination, vias, departure):
+        """Build one connection object starting at ``departure``."""
+        stops = [origin] + vias + [destination]
+        journeys = max(self.sections or len(stops) - 1, len(stops) - 1)
+        while len(stops) < journeys + 1:
+            stops.insert(-1, self.station('Umsteigeort {}'.format(len(stops))))
+        sections = []
+        t = departure
+        for i in range(journeys):
+            leg = timedelta(minutes=rnd.randint(12, 55))
+            sections.append({
+                'journey': self._journey(rnd, stops[i], stops[i + 1], t, t + leg),
+                'walk': None,
+                'departure': self._checkpoint(stops[i], departure=t, platform=str(rnd.randint(1, 12))),
+                'arrival': self._checkpoint(stops[i + 1], arrival=t + leg, platform=str(rnd.randint(1, 12))),
+            })
+            t += leg + timedelta(minutes=rnd.randint(3, 9))
+        for i in range(self.walks):
+            # Walk between two journeys (or to the destination if there is
+            # only one), using the time reserved for the change.
+            index = min(i + 1, len(sections))
+            before = sections[index - 1]
+            start = datetime.strptime(before['arrival']['arrival'][:19], '%Y-%m-%dT%H:%M:%S')
+            place = before['arrival']['station']
+            sections.insert(index, {
+                'journey': None,
+                'walk': {'duration': '00d00:02:00'},
+                'departure': self._checkpoint(place, departure=start, platform=None),
+                'arrival': self._checkpoint(place, arrival=start + timedelta(minutes=2), platform=None),
+            })
+        first, last = sections[0], sections[-1]
+        arrival = datetime.strptime(last['arrival']['arrival'][:19], '%Y-%m-%dT%H:%M:%S')
+        duration = arrival - departure
+        return {
+            'from': first['departure'],
+            'to': last['arrival'],
+            'duration': '00d{:02d}:{:02d}:00'.format(duration.seconds // 3600, duration.seconds % 3600 // 60),
+            'transfers': journeys - 1,
+            'service': None,
+            'products': [s['journey']['name'] for s in sections if s['journey']],
+            'capacity1st': None,
+            'capacity2nd': None,
+            'sections': sections,
+        }
+
+    def connections(self, params):
+        """Build a ``/v1/connections`` response for the query ``params``."""
+        origin = self.station(params.get('from', ''))
+        destination = self.station(params.get('to', ''))
+        vias = [self.station(v) for v in params.get('via[]', params.get('via', '')).split('|') if v]
+        count = int(params.get('limit', self.count))
+        page = int(params.get('page', 0))
+        when = _parse_when(params)
+        seed = '|'.join([origin['id'], destination['id'], when.isoformat(), str(page)])
+        rnd = random.Random(seed)
+        start = when + timedelta(minutes=30 * count * page)
+        if params.get('isArrivalTime') in ('1', 'true'):
+            start -= timedelta(hours=1)
+        connections = [
+            self.connection(rnd, origin, destination, vias, start + timedelta(minutes=30 * i + rnd.randint(0, 9)))
+            for i in range(count)
+        ]
+        return {
+            'connections': connections,
+            'from': self._location(origin),
+            'to': self._location(destination),
+            'stations': {'from': [self._location(origin)], 'to': [self._location(destination)]},
+        }
+
+    def locations(self, params):
+        """Build a ``/v1/locations`` response for the query ``params``."""
+        folded = _fold(params.get('query', ''))
+        matches = [s for s in self.stations if folded and folded in _fold(s['name'])]
+        if not matches and folded:
+            matches = [self.station(params['query'])]
+        return {'stations': [self._location(s) for s in matches[:int(params.get('limit', 10))]]}
+
+    def stationboard(self, params):
+        """Build a ``/v1/stationboard`` response for the query ``params``."""
+        station = self.station(params.get('station', params.get('id', '')))
+        when = _parse_when({'date': params.get('datetime', '')[:10],
+                            'time': params.get('datetime', '')[11:16]})
+        rnd = random.Random('|'.join([station['id'], when.isoformat()]))
+        entries = []
+        t = when
+        for _ in range(int(params.get('limit', 40))):
+            t += timedelta(minutes=rnd.randint(1, 6))
+            destination = rnd.choice(self.stations)
+            journey = self._journey(rnd, station, destination, t, t + timedelta(minutes=rnd.randint(10, 90)))
+            entries.append({
+                'stop': self._checkpoint(station, departure=t, platform=str(rnd.randint(1, 12))),
+                'name': journey['name'], 'category': journey['category'],
+                'subcategory': None, 'categoryCode': None, 'number': journey['number'],
+                'operator': 'SBB', 'to': destination['name'], 'passList': journey['passList'],
+                'capacity1st': None, 'capacity2nd': None,
+            })
+        return {'station': self._location(station), 'stationboard': entries}
+
+
+class StandInServer(object):
+    """Threaded HTTP server imitating the transport.opendata.ch API.
+
+    Args:
+        host: Address to bind to.
+        port: Port to bind to (0 picks a free port).
+        latency: Added response latency in milliseconds.
+        jitter: Maximum random deviation from ``latency`` in milliseconds.
+        error_rate: Fraction of requests answered with HTTP 500.
+        throttle_rate: Fraction of requests answered with HTTP 429.
+        retry_after: Value of the ``Retry-After`` header of 429 responses.
+        recordings: Directory with recorded responses.
+        upstream: Base URL of the real API; unknown requests are forwarded
+            there and recorded into ``recordings``.
+        synthetic: :class:`SyntheticData` instance for unrecorded requests.
+        seed: Seed for latency and error injection.
+        rate_limit: Maximum number of requests per second (with a burst of
+            one second worth of requests), further requests are answered
+            with HTTP 429. Counted in ``throttled``.
+        compress: Whether to compress responses if the client accepts it
+            (default True). The bytes of the sent bodies are counted in
+            ``bytes_sent``.
+
+    Accepted TCP connections are counted in ``connections``.
+
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, recordings=None, upstream=None,
+                 synthetic=None, seed=None, rate_limit=None, compress=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.recordings = recordings
+        self.upstream = upstream
+        self.synthetic = synthetic or SyntheticData()
+        self.random = random.Random(seed)
+        self.rate_limit = rate_limit
+        self.compress = compress
+        self.requests = 0
+        self.connections = 0
+        self.throttled = 0
+        self.bytes_sent = 0
+        self._tokens = rate_limit or 0
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/v1'.format(host, port)
+
+    def start(self):
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _recording_path(self, endpoint, pairs):
+        key = json.dumps([endpoint, sorted(pairs)], ensure_ascii=False)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.recordings, '{}-{}.json'.format(endpoint, digest))
+
+    def respond(self, path, query):
+        """Return ``(status, headers, body)`` for a request."""
+        with self._lock:
+            self.requests += 1
+            delay = max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            roll = self.random.random()
+            limited = False
+            if self.rate_limit:
+                now = time.time()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+                self._updated = now
+                limited = self._tokens < 1
+                if limited:
+                    self.throttled += 1
+                else:
+                    self._tokens -= 1
+        if limited:
+            return 429, {'Retry-After': str(self.retry_after)}, b'{"errors": [{"message": "Too Many Requests"}]}'
+        if delay:
+            time.sleep(delay / 1000.0)
+        if roll < self.throttle_rate:
+            return 429, {'Retry-After': str(self.retry_after)}, b'{"errors": [{"message": "Too Many Requests"}]}'
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}, b'{"errors": [{"message": "Internal Server Error"}]}'
+
+        endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+        pairs = parse_qsl(query, keep_blank_values=True)
+        if self.recordings is not None:
+            recording = self._recording_path(endpoint, pairs)
+            if os.path.exists(recording):
+                with open(recording, 'rb') as f:
+                    return 200, {}, f.read()
+            if self.upstream is not None:
+                url = '{}/{}?{}'.format(self.upstream.rstrip('/'), endpoint, query)
+                with urllib.request.urlopen(url) as response:
+                    body = response.read()
+                with open(recording, 'wb') as f:
+                    f.write(body)
+                return 200, {}, body
+
+        params = dict((k, v) for k, v in pairs if k != 'fields[]')
+        fields = [v for k, v in pairs if k == 'fields[]']
+        generate = getattr(self.synthetic, endpoint, None) if endpoint in ('connections', 'locations', 'stationboard') else None
+        if generate is None:
+            return 404, {}, b'{"errors": [{"message": "Not Found"}]}'
+        data = generate(params)
+        if fields:
+            data = project(data, fields)
+        return 200, {}, json.dumps(data).encode('utf-8')
+
+    def encode(self, body, accept_encoding):
+        """Return ``(headers, body)`` of a response body as sent."""
+        headers = {}
+        if self.compress:
+            encoding, body = _compress(body, accept_encoding)
+            if encoding is not None:
+                headers['Content-Encoding'] = encoding
+        with self._lock:
+            self.bytes_sent += len(body)
+        return headers, body
+
+
+def _make_handler(server):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            with server._lock:
+                server.connections += 1
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                status, headers, body = server.respond(url.path, url.query)
+            except Exception:
+                logging.exception('Error while handling %s', self.path)
+                status, headers, body = 500, {}, b'{"errors": [{"message": "Internal Server Error"}]}'
+            if status == 200:
+                etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                headers['ETag'] = etag
+            encoding, body = server.encode(body, self.headers.get('Accept-Encoding'))
+            headers.update(encoding)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m fahrplan.standin',
+                                     description='Local stand-in for the transport.opendata.ch API.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind to (default %(default)s)')
+    parser.add_argument('--port', type=int, default=8000, help='Port to bind to (default %(default)s)')
+    parser.add_argument('--latency', type=float, default=0, help='Response latency in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='Random latency deviation in ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of HTTP 500 responses')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='Fraction of HTTP 429 responses')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After of 429 responses in s')
+    parser.add_argument('--rate-limit', type=float, help='Answer requests beyond this rate per second with 429')
+    parser.add_argument('--no-compress', action='store_true', help="Don't compress responses")
+    parser.add_argument('--connections', type=int, default=4, help='Synthetic connections per response')
+    parser.add_argument('--sections', type=int, help='Synthetic journey sections per connection')
+    parser.add_argument('--walks', type=int, default=0, help='Synthetic walk sections per connection')
+    parser.add_argument('--pass-list', type=int, default=3, help='Intermediate stops per journey')
+    parser.add_argument('--recordings', help='Directory with recorded responses')
+    parser.add_argument('--record', metavar='UPSTREAM', help='Forward unknown requests to UPSTREAM and record them')
+    parser.add_argument('--seed', type=int, help='Seed for latency and error injection')
+    parser.add_argument('--debug', '-d', action='store_true', help='Log requests')
+    options = parser.parse_args()
+
+    if options.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    if options.record and not options.recordings:
+        perror('Error: --record requires --recordings')
+        sys.exit(1)
+    if options.recordings and not os.path.isdir(options.recordings):
+        os.makedirs(options.recordings)
+
+    synthetic = SyntheticData(options.connections, options.sections, options.walks, options.pass_list)
+    server = StandInServer(options.host, options.port, options.latency, options.jitter,
+                           options.error_rate, options.throttle_rate, options.retry_after,
+                           options.recordings, options.record, synthetic, options.seed,
+                           options.rate_limit, not options.no_compress)
+    print('Serving on {}'.format(server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
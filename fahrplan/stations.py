@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Local station index.
+
+Resolves the free text station names of a request (``from``, ``to`` and
+``via``) to station IDs before the request is sent, which avoids ambiguous
+or misspelled names causing extra round trips. Names are matched exactly,
+through previously seen aliases or fuzzily via a trigram index (for typos
+only), all after folding case, diacritics and punctuation. Unknown names are
+looked up with ``/v1/locations`` and the result is remembered.
+"""
+import os
+import re
+import json
+import logging
+import tempfile
+import threading
+import unicodedata
+from collections import defaultdict
+
+from .cache import default_cache_path
+
+BUNDLED_STATIONS = os.path.join(os.path.dirname(__file__), 'data', 'stations.json')
+
+# Minimum trigram similarity (Dice coefficient) of a fuzzy match.
+DEFAULT_THRESHOLD = 0.75
+
+# A fuzzy match is ambiguous if another station scores within this margin.
+AMBIGUITY_MARGIN = 0.1
+
+_separators = re.compile(r'[\s,.;:/()\'"-]+')
+_umlauts = [('ae', 'a'), ('oe', 'o'), ('ue', 'u')]
+
+
+def default_index_path():
+    """Return the default location of the station index."""
+    return os.path.join(os.path.dirname(default_cache_path()), 'stations.json')
+
+
+def fold(name):
+    """Normalize a station name for matching.
+
+    Lowercases, strips diacritics, spells out German umlauts the same way as
+    their transliterations ("zürich" and "zuerich" both become "zurich") and
+    collapses punctuation and whitespace.
+    """
+    decomposed = unicodedata.normalize('NFKD', name.lower())
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    for old, new in _umlauts:
+        folded = folded.replace(old, new)
+    return _separators.sub(' ', folded).strip()
+
+
+def _trigrams(folded):
+    padded = '  {} '.format(folded)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _typos(a, b):
+    """Return the edit distance of two words, counting swapped letters once."""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def _covers(name, query):
+    """Return whether every word of ``query`` is a word of ``name`` or a typo of one."""
+    words = name.split()
+    return all(any(_typos(word, other) <= len(word) // 4 for other in words) for word in query.split())
+
+
+class StationIndex(object):
+    """In-memory station index with trigram based fuzzy lookup.
+
+    The index may be used from several threads at once (batch and board
+    workers, the daemon).
+
+    Args:
+        stations: Iterable of ``{'id': ..., 'name': ...}`` dictionaries.
+        threshold: Minimum similarity of fuzzy matches.
+
+    """
+
+    def __init__(self, stations=(), threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.path = None
+        self.dirty = False
+        self._stations = []  # (id, name) tuples
+        self._by_name = {}  # folded name -> station number
+        self._by_id = {}  # station id -> station number
+        self._aliases = {}  # folded query -> station number
+        self._grams = defaultdict(list)  # trigram -> station numbers
+        self._gram_counts = []  # number of trigrams per station
+        self._lock = threading.RLock()
+        for station in stations:
+            self.add(station['id'], station['name'])
+
+    def __len__(self):
+        return len(self._stations)
+
+    def add(self, id, name):
+        """Add a station, return its number in the index."""
+        id = str(id)
+        folded = fold(name)
+        grams = _trigrams(folded)
+        with self._lock:
+            number = self._by_id.get(id)
+            if number is not None:
+                return number
+            number = len(self._stations)
+            self._stations.append((id, name))
+            self._by_id[id] = number
+            self._by_name.setdefault(folded, number)
+            for gram in grams:
+                self._grams[gram].append(number)
+            self._gram_counts.append(len(grams))
+            return number
+
+    def add_alias(self, query, id):
+        """Remember that ``query`` refers to the station ``id``."""
+        with self._lock:
+            number = self._by_id.get(str(id))
+            if number is not None:
+                self._aliases[fold(query)] = number
+                self.dirty = True
+
+    def lookup(self, query):
+        """Find a station in the index.
+
+        Returns:
+            An ``(id, name)`` tuple or None if no station matches well enough.
+
+        """
+        folded = fold(query)
+        with self._lock:
+            number = self._by_id.get(query)
+            if number is None:
+                number = self._by_name.get(folded)
+            if number is None:
+                number = self._aliases.get(folded)
+            if number is None:
+                number = self._fuzzy(folded)
+            return self._stations[number] if number is not None else None
+
+    def _fuzzy(self, folded):
+        """Find the station of a misspelled name.
+
+        Only typos are corrected: the best match has to cover every word of
+        the query and no other station may score almost as well, so that
+        e.g. "winterthur grüze" doesn't match Winterthur.
+        """
+        grams = _trigrams(folded)
+        shared = defaultdict(int)
+        for gram in grams:
+            for number in self._grams.get(gram, ()):
+                shared[number] += 1
+        scores = sorted(((2.0 * count / (len(grams) + self._gram_counts[number]), number)
+                         for number, count in shared.items()), reverse=True)
+        if not scores or scores[0][0] < self.threshold:
+            return None
+        best_score, best = scores[0]
+        if len(scores) > 1 and scores[1][0] >= best_score - AMBIGUITY_MARGIN:
+            return None
+        if not _covers(fold(self._stations[best][1]), folded):
+            return None
+        return best
+
+    def resolve(self, query, client=None):
+        """Resolve a station name to a station ID.
+
+        Looks the name up locally first and asks the API (``/v1/locations``)
+        if a client is given and there is no local match. New resolutions are
+        remembered.
+
+        Returns:
+            The station ID or None if the station is unknown.
+
+        """
+        station = self.lookup(query)
+        if station is not None:
+            return station[0]
+        if client is None:
+            return None
+        stations = client.request('locations', {'query': query, 'type': 'station'}).get('stations') or []
+        stations = [s for s in stations if s.get('id')]
+        if not stations:
+            return None
+        for station in stations:
+            self.add(station['id'], station['name'])
+        self.add_alias(query, stations[0]['id'])
+        logging.debug('Resolved station {0!r} to {1!r}'.format(query, stations[0]['name']))
+        return str(stations[0]['id'])
+
+    def resolve_request(self, request, client=None):
+        """Return a copy of a request with station names replaced by IDs.
+
+        Names that can't be resolved are left untouched.
+        """
+        data = dict(request)
+        for key in ('from', 'to', 'via'):
+            if data.get(key):
+                id = self.resolve(data[key], client)
+                if id is not None:
+                    data[key] = id
+        return data
+
+    @classmethod
+    def load(cls, path=None, threshold=DEFAULT_THRESHOLD):
+        """Load the bundled stations and the index stored at ``path``.
+
+        ``path`` defaults to ``default_index_path()`` and may not exist yet.
+        """
+        with open(BUNDLED_STATIONS, encoding='utf-8') as f:
+            index = cls(json.load(f), threshold)
+        index.path = path or default_index_path()
+        try:
+            with open(index.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return index
+        for station in data.get('stations', []):
+            index.add(station['id'], station['name'])
+        for query, id in data.get('aliases', {}).items():
+            number = index._by_id.get(id)
+            if number is not None:
+                index._aliases[query] = number
+        return index
+
+    def save(self, path=None):
+        """Store stations and aliases at ``path`` (default: the loaded path)."""
+        path = path or self.path or default_index_path()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            data = {
+                'stations': [{'id': id, 'name': name} for id, name in self._stations],
+                'aliases': {q: self._stations[n][0] for q, n in self._aliases.items()},
+            }
+            self.dirty = False
+        # Write atomically, other processes may read the file concurrently
+        try:
+            fd, tmp = tempfile.mkstemp(dir=directory or None, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except Exception:
+            self.dirty = True
+            raise
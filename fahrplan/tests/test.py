@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+import io
+import os
 import sys
-from datetime import datetime
+import json
+import shutil
+import logging
+import socket
+import contextlib
+import asyncio
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 
 from subprocess import Popen, PIPE
 if sys.version_info[0] == 2 and sys.version_info[1] < 7:
@@ -12,6 +23,26 @@ else:
 
 from .. import meta
 from .. import parser
+from .. import api
+from .. import decoding
+from .. import helpers
+from .. import cache
+from .. import aio
+from .. import standin
+from .. import stations
+from .. import daemon
+from .. import batch
+from .. import output
+from .. import display
+from .. import ratelimit
+from .. import profiling
+from .. import watch
+from .. import board
+from .. import models
+from .. import offline
+from .. import snapshot
+from .. import explore
+from .. import main
 
 
 BASE_COMMAND = 'python -m fahrplan.main'
@@ -20,6 +51,24 @@ try:
 except AttributeError:
     ENCODING = 'utf-8'
 
+# The tests run against a local stand-in of the API unless FAHRPLAN_API_URL
+# points them somewhere else (e.g. to the real API).
+API_URL = os.environ.get('FAHRPLAN_API_URL')
+STANDIN = None
+
+
+def setUpModule():
+    global API_URL, STANDIN
+    if API_URL is None:
+        STANDIN = standin.StandInServer().start()
+        API_URL = os.environ['FAHRPLAN_API_URL'] = STANDIN.url
+
+
+def tearDownModule():
+    if STANDIN is not None:
+        STANDIN.stop()
+        del os.environ['FAHRPLAN_API_URL']
+
 
 # Run command
 class CommandOutput(object):
@@ -56,6 +105,17 @@ class TestBasicArgumentHandling(unittest.TestCase):
             self.assertTrue('positional arguments:' in r.std_out)
             self.assertTrue('Examples:' in r.std_out)
 
+    def testLazyImports(self):
+        """Version info and usage errors don't import requests or rich."""
+        script = ('import sys; sys.argv = [\'fahrplan\'] + sys.argv[1:]\n'
+                  'from fahrplan.main import main\n'
+                  'try:\n    main()\nexcept SystemExit:\n    pass\n'
+                  'print(sorted(m for m in ("requests", "rich") if m in sys.modules))')
+        for args in (['-v'], ['--no-such-option']):
+            p = Popen([sys.executable, '-c', script] + args, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = p.communicate()
+            self.assertTrue(stdout.decode(ENCODING).endswith('[]\n'), stdout)
+
 
 class TestInputParsing(unittest.TestCase):
 
@@ -182,6 +242,31 @@ class TestInputParsing(unittest.TestCase):
             self.assertEqual('{}/10/22'.format(year), data['date'])
 
 
+class TestParseInputMany(unittest.TestCase):
+
+    def testSharedClock(self):
+        now = datetime(2024, 10, 16, 7, 30)  # A wednesday
+        queries = [
+            'from basel to bern departure now',
+            'von basel nach bern ab morgen 08:00'.split(),
+            'de basel à bern départ lundi 12:00',
+            'von basel nach bern ab in 3 tagen 09:00',
+        ]
+        results = parser.parse_input_many(queries, now=now)
+        self.assertEqual('07:30', results[0][0]['time'])
+        self.assertEqual(datetime(2024, 10, 17, 7, 30), results[1][0]['date'])
+        self.assertEqual(datetime(2024, 10, 21, 7, 30), results[2][0]['date'])
+        self.assertEqual(datetime(2024, 10, 19, 7, 30), results[3][0]['date'])
+        self.assertEqual(['en', 'de', 'fr', 'de'], [r[1] for r in results])
+
+    def testErrors(self):
+        queries = ['von basel nach bern', 'von bern']
+        self.assertRaises(ValueError, parser.parse_input_many, queries)
+        results = parser.parse_input_many(queries, errors='return')
+        self.assertEqual(({'from': 'basel', 'to': 'bern'}, 'de'), results[0])
+        self.assertIsInstance(results[1], ValueError)
+
+
 class TestBasicQuery(unittest.TestCase):
 
     @classmethod
@@ -232,6 +317,1322 @@ class TestLanguages(unittest.TestCase):
         self.assertTrue(stdout_values[1:] == stdout_values[:-1])
 
 
+class FakeResponse(object):
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeTransport(object):
+    """Transport returning canned responses and recording the requests."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, params, timeout):
+        self.calls.append((url, params))
+        return self.responses.pop(0)
+
+
+SAMPLE_CONNECTION = {
+    'transfers': 0,
+    'sections': [{
+        'journey': {'category': 'IC', 'number': '708'},
+        'walk': None,
+        'departure': {'station': {'name': 'Bern'}, 'departure': '2024-10-16T15:02:00+0200', 'platform': '7'},
+        'arrival': {'station': {'name': 'Basel SBB'}, 'arrival': '2024-10-16T15:57:00+0200', 'platform': '9'},
+    }],
+}
+
+
+class TestApiClient(unittest.TestCase):
+
+    def testTransportIsReused(self):
+        body = json.dumps({'connections': [SAMPLE_CONNECTION]}).encode('utf-8')
+        transport = FakeTransport(FakeResponse(200, body), FakeResponse(200, body))
+        client = api.FahrplanClient(api_url='http://example.invalid/v1', transport=transport)
+        for _ in range(2):
+            data = client.get_connections({'from': 'bern', 'to': 'basel'})
+            self.assertEqual('Basel SBB', data['connections'][0]['sections'][0]['station_to'])
+        self.assertEqual(2, len(transport.calls))
+        self.assertEqual('http://example.invalid/v1/connections', transport.calls[0][0])
+
+    def testFieldSelection(self):
+        body = json.dumps({'connections': [SAMPLE_CONNECTION]}).encode('utf-8')
+        transport = FakeTransport(FakeResponse(200, body), FakeResponse(200, body))
+        client = api.FahrplanClient(transport=transport)
+        client.get_connections({'from': 'bern', 'to': 'basel'}, keep_raw=False)
+        self.assertEqual(list(api.CONNECTION_FIELDS), transport.calls[0][1]['fields[]'])
+        # The whole response is requested if it is kept
+        client.get_connections({'from': 'bern', 'to': 'basel'})
+        self.assertNotIn('fields[]', transport.calls[1][1])
+
+    def testErrorsAreRaised(self):
+        client = api.FahrplanClient(transport=FakeTransport(FakeResponse(500, b'')), retries=0)
+        with self.assertRaises(api.ServerError) as cm:
+            client.request('connections', {})
+        self.assertEqual(500, cm.exception.status_code)
+        client = api.FahrplanClient(transport=FakeTransport(FakeResponse(200, b'<html>')))
+        self.assertRaises(api.InvalidResponseError, client.request, 'connections', {})
+
+
+class SlowTransport(object):
+    """Transport answering every request after a delay, counting the calls."""
+
+    def __init__(self, response, delay=0.2):
+        self.response = response
+        self.delay = delay
+        self.calls = 0
+
+    def get(self, url, params, timeout):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+class TestRequestCoalescing(unittest.TestCase):
+
+    def fetchConcurrently(self, client, requests):
+        results = [None] * len(requests)
+
+        def fetch(i):
+            try:
+                results[i] = client.get_connections(requests[i])
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=fetch, args=(i,)) for i in range(len(requests))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def testIdenticalRequestsShareOneCall(self):
+        body = json.dumps({'connections': [SAMPLE_CONNECTION]}).encode('utf-8')
+        transport = SlowTransport(FakeResponse(200, body))
+        client = api.FahrplanClient(api_url='http://example.invalid/v1', transport=transport)
+        request = {'from': 'bern', 'to': 'basel', 'time': '07:30'}
+        results = self.fetchConcurrently(client, [request] * 5 + [dict(request, time='07:31')])
+        self.assertEqual(2, transport.calls)
+        self.assertEqual(results[0], results[4])
+        self.assertIsNot(results[0]['connections'], results[4]['connections'])
+        self.assertEqual({}, client._inflight)
+        # Finished requests are not reused
+        client.get_connections(request)
+        self.assertEqual(3, transport.calls)
+
+    def testErrorsAreShared(self):
+        transport = SlowTransport(api.NetworkError('Could not reach network.'))
+        client = api.FahrplanClient(api_url='http://example.invalid/v1', transport=transport, retries=0)
+        results = self.fetchConcurrently(client, [{'from': 'bern', 'to': 'basel'}] * 3)
+        self.assertEqual(1, transport.calls)
+        for result in results:
+            self.assertIsInstance(result, api.NetworkError)
+
+    def testDisabled(self):
+        body = json.dumps({'connections': [SAMPLE_CONNECTION]}).encode('utf-8')
+        transport = SlowTransport(FakeResponse(200, body), delay=0.05)
+        client = api.FahrplanClient(api_url='http://example.invalid/v1', transport=transport,
+                                    coalesce=False)
+        self.fetchConcurrently(client, [{'from': 'bern', 'to': 'basel'}] * 3)
+        self.assertEqual(3, transport.calls)
+
+
+class RaisingTransport(FakeTransport):
+    """Transport raising a network error for the first ``failures`` calls."""
+
+    def __init__(self, failures, *responses):
+        FakeTransport.__init__(self, *responses)
+        self.failures = failures
+
+    def get(self, url, params, timeout):
+        if len(self.calls) < self.failures:
+            self.calls.append((url, params))
+            raise api.NetworkError('Could not reach network.')
+        return FakeTransport.get(self, url, params, timeout)
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        self.body = json.dumps({'connections': [SAMPLE_CONNECTION]}).encode('utf-8')
+
+    def testTransientErrorsAreRetried(self):
+        transport = FakeTransport(FakeResponse(429, b'', {'Retry-After': '0'}), FakeResponse(503, b''),
+                                  FakeResponse(200, self.body))
+        client = api.FahrplanClient(transport=transport, backoff=0.01)
+        data = client.get_connections({'from': 'bern', 'to': 'basel'})
+        self.assertEqual(1, len(data['connections']))
+        self.assertEqual(3, len(transport.calls))
+
+    def testRetriesAreLimited(self):
+        transport = FakeTransport(*[FakeResponse(502, b'') for _ in range(3)])
+        client = api.FahrplanClient(transport=transport, retries=2, backoff=0.01)
+        with self.assertRaises(api.ServerError) as cm:
+            client.request('connections', {})
+        self.assertEqual(502, cm.exception.status_code)
+        self.assertEqual(3, len(transport.calls))
+        # Client errors and long Retry-After periods are not retried
+        for response in (FakeResponse(404, b''), FakeResponse(429, b'', {'Retry-After': '3600'})):
+            transport = FakeTransport(response)
+            client = api.FahrplanClient(transport=transport, backoff=0.01)
+            self.assertRaises(api.ServerError, client.request, 'connections', {})
+            self.assertEqual(1, len(transport.calls))
+
+    def testNetworkErrorsAreRetried(self):
+        transport = RaisingTransport(2, FakeResponse(200, self.body))
+        client = api.FahrplanClient(transport=transport, backoff=0.01)
+        self.assertEqual(1, len(client.request('connections', {})['connections']))
+        self.assertEqual(3, len(transport.calls))
+
+    def testThrottlingPausesRateLimiter(self):
+        limiter = ratelimit.RateLimiter(100)
+        transport = FakeTransport(FakeResponse(429, b'', {'Retry-After': '0'}), FakeResponse(200, self.body))
+        client = api.FahrplanClient(transport=transport, rate_limiter=limiter, backoff=0.01)
+        client.request('connections', {})
+        self.assertEqual(50 + 100 / 32.0, limiter.current_rate)
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRate(self):
+        limiter = ratelimit.RateLimiter(50)
+        start = time.time()
+        for _ in range(11):
+            limiter.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.19)
+
+    def testSharedBetweenProcesses(self):
+        path = os.path.join(self.tmpdir, 'ratelimit.state')
+        a = ratelimit.RateLimiter(5, path=path)
+        b = ratelimit.RateLimiter(5, path=path)
+        self.assertLess(a.acquire(), 0.05)
+        self.assertGreaterEqual(b.acquire(), 0.15)
+        a.close()
+        b.close()
+
+    def testPriority(self):
+        limiter = ratelimit.RateLimiter(20)
+        limiter.acquire()
+        order = []
+
+        def acquire(name, value):
+            limiter.acquire(value)
+            order.append(name)
+
+        threads = [threading.Thread(target=acquire, args=('bulk', ratelimit.BULK)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.01)
+        threads.append(threading.Thread(target=acquire, args=('interactive', ratelimit.INTERACTIVE)))
+        threads[-1].start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual('interactive', order[0])
+
+    def testThrottled(self):
+        limiter = ratelimit.RateLimiter(100)
+        limiter.throttled(0.2)
+        self.assertEqual(50, limiter.current_rate)
+        self.assertGreaterEqual(limiter.acquire(), 0.15)
+        limiter.succeeded()
+        self.assertGreater(limiter.current_rate, 50)
+
+    def testRetryAfter(self):
+        self.assertEqual(7, ratelimit.retry_after_delay({'Retry-After': '7'}))
+        self.assertEqual(30, ratelimit.retry_after_delay({'Retry-After': 'Wed, 21 Oct 2015 07:28:30 GMT'},
+                                                         now=1445412480))
+        self.assertIsNone(ratelimit.retry_after_delay({'Retry-After': 'soon'}))
+        self.assertIsNone(ratelimit.retry_after_delay({}))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = cache.ResponseCache(os.path.join(self.tmpdir, 'cache.sqlite'), ttl=60, max_entries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testNormalizeRequest(self):
+        now = datetime(2024, 10, 16, 7, 30)
+        request = {'from': 'bern', 'to': 'basel', 'date': datetime(2024, 10, 17, 7, 30, 12)}
+        expected = {'from': 'bern', 'to': 'basel', 'date': '2024/10/17', 'time': '07:30'}
+        self.assertEqual(expected, cache.normalize_request(request, now))
+
+    def testCacheHitSkipsRequest(self):
+        body = json.dumps({'connections': [SAMPLE_CONNECTION]}).encode('utf-8')
+        transport = FakeTransport(FakeResponse(200, body))
+        client = api.FahrplanClient(transport=transport, cache=self.cache)
+        request = {'from': 'bern', 'to': 'basel', 'time': '15:00'}
+        first = client.get_connections(request)
+        second = client.get_connections(request)
+        self.assertEqual(1, len(transport.calls))
+        self.assertEqual(first, second)
+
+    def testLruEviction(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+        self.assertEqual(2, len(self.cache))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual('c', self.cache.get('c'))
+
+
+@unittest.skipIf(aio.aiohttp is None, 'aiohttp is not installed')
+class TestCacheOptions(unittest.TestCase):
+
+    def testZeroTtl(self):
+        tmpdir = tempfile.mkdtemp()
+        environ = dict(os.environ)
+        os.environ['XDG_CACHE_HOME'] = tmpdir
+        try:
+            for argv, ttl in ((['--cache'], cache.DEFAULT_TTL), (['--cache', '--cache-ttl', '0'], 0)):
+                with main.make_client(main.build_parser().parse_args(argv)) as client:
+                    self.assertEqual(ttl, client.cache.ttl)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            shutil.rmtree(tmpdir)
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def testMatchesSyncClient(self):
+        request = {'from': 'bern', 'to': 'basel', 'via': 'olten', 'time': '15:00'}
+        sync = api.FahrplanClient(api_url=API_URL).get_connections(request, True)
+
+        async def fetch():
+            async with aio.AsyncFahrplanClient(api_url=API_URL, max_concurrency=2) as client:
+                return await client.gather_connections([request] * 5, include_sections=True)
+
+        results = asyncio.run(fetch())
+        self.assertEqual(5, len(results))
+        for result in results:
+            self.assertEqual(sync, result)
+
+    def testCancelledWhileRateLimited(self):
+        limiter = ratelimit.RateLimiter(10)
+        self.assertEqual(0, limiter.try_acquire())
+        self.assertGreater(limiter.try_acquire(), 0)
+
+        async def cancel():
+            async with aio.AsyncFahrplanClient(api_url=API_URL, rate_limiter=limiter) as client:
+                task = asyncio.ensure_future(client._acquire())
+                await asyncio.sleep(0.02)
+                task.cancel()
+                await asyncio.sleep(0.15)
+                self.assertTrue(task.cancelled())
+
+        asyncio.run(cancel())
+        # The cancelled task didn't spend the next token
+        self.assertEqual(0, limiter.try_acquire())
+
+
+class CountingAsyncClient(aio.AsyncFahrplanClient):
+    calls = 0
+
+    async def request(self, action, params):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return {'connections': [SAMPLE_CONNECTION]}
+
+
+class TestAsyncRequestCoalescing(unittest.TestCase):
+
+    def testIdenticalRequestsShareOneCall(self):
+        request = {'from': 'bern', 'to': 'basel'}
+
+        async def fetch():
+            client = CountingAsyncClient()
+            results = await client.gather_connections([request] * 4 + [dict(request, via='olten')])
+            return client, results
+
+        client, results = asyncio.run(fetch())
+        self.assertEqual(2, client.calls)
+        self.assertEqual(results[0], results[3])
+        self.assertEqual({}, client._inflight)
+
+    def testCancellation(self):
+        request = {'from': 'bern', 'to': 'basel'}
+
+        async def fetch():
+            client = CountingAsyncClient()
+            first = asyncio.ensure_future(client.get_connections(request))
+            second = asyncio.ensure_future(client.get_connections(request))
+            await asyncio.sleep(0.01)
+            # The request continues while anybody is waiting for it
+            first.cancel()
+            data = await second
+            third = asyncio.ensure_future(client.get_connections(request))
+            await asyncio.sleep(0.01)
+            task = client._inflight[aio.make_key(client.api_url, 'connections', request, False, True)][0]
+            third.cancel()
+            await asyncio.sleep(0.01)
+            return client, data, task
+
+        client, data, task = asyncio.run(fetch())
+        self.assertEqual('Basel SBB', data['connections'][0]['sections'][0]['station_to'])
+        self.assertTrue(task.cancelled())
+        self.assertEqual(2, client.calls)
+
+
+class TestConnectionRecords(unittest.TestCase):
+
+    def setUp(self):
+        synthetic = standin.SyntheticData(connections=2, sections=2, walks=1)
+        self.payload = synthetic.connections({'from': 'bern', 'to': 'basel', 'time': '07:00'})
+
+    def testLazySections(self):
+        connection = api._parse_connection(self.payload['connections'][0], include_sections=True)
+        self.assertIsNone(connection._sections)
+        self.assertTrue(connection['travelwith'].endswith(', Walk'))
+        sections = connection['sections']
+        self.assertEqual(3, len(sections))
+        self.assertEqual('Bern', sections[0]['station_from'])
+        self.assertEqual('', sections[1].get('platform_from'))
+        self.assertLess(sections[0]['departure'], sections[-1]['arrival'])
+
+    def testSummarySection(self):
+        connection = api._parse_connection(self.payload['connections'][0])
+        section, = connection['sections']
+        self.assertEqual('Bern', section['station_from'])
+        self.assertEqual('Basel SBB', section['station_to'])
+        self.assertEqual('1', section['change_count'])
+        self.assertEqual(connection['travelwith'], section['travelwith'])
+
+    def testInternedStations(self):
+        a, b = [api._parse_connection(c, True) for c in self.payload['connections']]
+        self.assertIs(a['sections'][0]['station_from'], b['sections'][0]['station_from'])
+
+
+class TestOutputFormats(unittest.TestCase):
+
+    def setUp(self):
+        synthetic = standin.SyntheticData(connections=3, sections=2)
+        payload = synthetic.connections({'from': 'bern', 'to': 'basel', 'time': '07:00'})
+        self.connections = [api._parse_connection(c, True) for c in payload['connections']]
+
+    def testJson(self):
+        for output_format in ('json', 'ndjson'):
+            out = io.StringIO()
+            output.write(iter(self.connections), output_format, out)
+            text = out.getvalue()
+            data = json.loads(text) if output_format == 'json' else [json.loads(line) for line in text.splitlines()]
+            self.assertEqual([c.to_dict()['travelwith'] for c in self.connections], [c['travelwith'] for c in data])
+            departure = self.connections[0]['sections'][0]['departure']
+            self.assertEqual(departure.isoformat(), data[0]['sections'][0]['departure'])
+
+    def testCsv(self):
+        out = io.StringIO()
+        output.write(iter(self.connections), 'tsv', out)
+        rows = [line.split('\t') for line in out.getvalue().splitlines()]
+        self.assertEqual(list(output.COLUMNS), rows[0])
+        self.assertEqual(1 + 3 * 2, len(rows))
+        self.assertEqual(['2', '1', 'Basel SBB'], [rows[-1][0], rows[-1][2], rows[-1][6]])
+
+    def testEmpty(self):
+        out = io.StringIO()
+        output.write(iter([]), 'json', out)
+        self.assertEqual([], json.loads(out.getvalue()))
+
+    def testCommand(self):
+        script = ('import sys; sys.argv = [\'fahrplan\'] + sys.argv[1:]\n'
+                  'from fahrplan.main import main\n'
+                  'main()\n'
+                  'print("rich" in sys.modules)')
+        args = ['--format', 'ndjson', 'von', 'bern', 'nach', 'basel']
+        p = Popen([sys.executable, '-c', script] + args, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = p.communicate()
+        lines = stdout.decode(ENCODING).splitlines()
+        self.assertEqual('False', lines[-1], stderr)
+        self.assertTrue(all(json.loads(line)['sections'] for line in lines[:-1]))
+
+
+class TestPlainRenderer(unittest.TestCase):
+
+    def setUp(self):
+        synthetic = standin.SyntheticData(connections=3, sections=2, walks=1)
+        payload = synthetic.connections({'from': 'bern', 'to': 'basel', 'time': '07:00'})
+        self.connections = [api._parse_connection(c, True) for c in payload['connections']]
+
+    def testIncremental(self):
+        out = io.StringIO()
+        written = []
+
+        def connections():
+            for connection in self.connections:
+                yield connection
+                written.append(out.getvalue())
+
+        self.assertEqual(3, display.printPlainTable(connections(), out))
+        lines = written[0].splitlines()
+        self.assertEqual(['#', 'Station', 'Platform'], lines[0].split()[:3])
+        self.assertEqual(2 + 3 * 2, len(lines))
+        self.assertTrue(lines[2].startswith('0    Bern '))
+        self.assertIn('Basel SBB', lines[-1])
+        self.assertEqual(written[-1], out.getvalue())
+
+    def testCellFormats(self):
+        section = self.connections[0]['sections'][0]
+        cells = display._section_cells(section)
+        self.assertEqual(section['departure'].strftime('%d/%m/%y'), cells[2][0])
+        self.assertEqual(section['arrival'].strftime('%H:%M'), cells[3][1])
+
+    def testTruncation(self):
+        line = display._plain_line(['1', 'x' * 40, '', '', '', '', '', 'IC 1'])
+        self.assertIn('x' * 27 + '…  ', line)
+
+    def testEmpty(self):
+        out = io.StringIO()
+        self.assertEqual(0, display.printPlainTable(iter([]), out))
+        self.assertEqual('', out.getvalue())
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def testFastPathMatchesDateutil(self):
+        import dateutil.parser
+        for value in ['2024-10-16T15:02:00+0200', '2024-01-31T23:59:59-0130', '2024-10-16T15:02:00+0000']:
+            parsed = helpers.parse_timestamp(value)
+            self.assertEqual(dateutil.parser.parse(value), parsed)
+            self.assertEqual(dateutil.parser.parse(value).utcoffset(), parsed.utcoffset())
+
+    def testTzinfoIsCached(self):
+        a = helpers.parse_timestamp('2024-10-16T15:02:00+0200')
+        b = helpers.parse_timestamp('2024-10-17T08:00:00+0200')
+        self.assertIs(a.tzinfo, b.tzinfo)
+
+    def testFallback(self):
+        self.assertEqual(datetime(2024, 10, 16, 15, 2), helpers.parse_timestamp('2024-10-16 15:02'))
+
+
+class TestStreamingDecoding(unittest.TestCase):
+
+    def setUp(self):
+        synthetic = standin.SyntheticData(connections=5, sections=2)
+        self.payload = synthetic.connections({'from': 'bern', 'to': 'basel', 'time': '07:00'})
+        self.payload['count'] = 12345
+        self.body = json.dumps(self.payload, ensure_ascii=False).encode('utf-8')
+
+    def testSmallChunks(self):
+        chunks = [self.body[i:i + 7] for i in range(0, len(self.body), 7)]
+        items = decoding.ArrayStream(chunks, 'connections')
+        self.assertEqual(self.payload['connections'], list(items))
+        self.assertEqual(self.payload['to'], items.members['to'])
+        self.assertEqual(12345, items.members['count'])
+
+    def testTruncatedDocument(self):
+        items = decoding.ArrayStream([self.body[:len(self.body) // 2]], 'connections')
+        self.assertRaises(ValueError, list, items)
+
+    def testIterConnections(self):
+        client = api.FahrplanClient(api_url=API_URL)
+        request = {'from': 'bern', 'to': 'basel', 'time': '07:00'}
+        expected = client.get_connections(request, include_sections=True)['connections']
+        self.assertEqual(expected, list(client.iter_connections(request, include_sections=True)))
+
+    def testBackends(self):
+        default = decoding.get_backend()
+        try:
+            for backend in decoding.BACKENDS:
+                decoding.set_backend(backend)
+                self.assertEqual(self.payload, decoding.loads(self.body))
+        finally:
+            decoding.set_backend(default)
+        self.assertRaises(ValueError, decoding.set_backend, 'foo')
+
+
+class TestInteractiveShell(unittest.TestCase):
+
+    def testPagingUsesPrefetchedPages(self):
+        from ..interactive import InteractiveShell
+        out = io.StringIO()
+        shell = InteractiveShell(api.FahrplanClient(api_url=API_URL), stdin=io.StringIO(), stdout=out)
+        shell.onecmd('from bern to basel departure 07:00')
+        pages = shell._pages[cache.make_key(shell.request)]
+        self.assertEqual({0, 1}, set(pages))
+        prefetched = pages[1]
+        shell.onecmd('later')
+        self.assertIs(prefetched, shell._future(1))
+        self.assertIn(2, pages)
+        self.assertEqual(2, out.getvalue().count('Station'))
+        shell.onecmd('earlier')
+        self.assertEqual(0, shell.page)
+        self.assertEqual(3, out.getvalue().count('Station'))
+        shell.onecmd('quit')
+        shell.postloop()
+
+    def testClientIsClosed(self):
+        closed = []
+
+        class Client(api.FahrplanClient):
+            def close(self):
+                closed.append(self)
+                api.FahrplanClient.close(self)
+
+        make_client, stdin = main.make_client, sys.stdin
+        main.make_client = lambda options: Client(api_url=API_URL)
+        sys.stdin = io.StringIO('quit\n')
+        try:
+            self.assertEqual(0, main.run(['--interactive'], stdout=io.StringIO(), stderr=io.StringIO()))
+        finally:
+            main.make_client, sys.stdin = make_client, stdin
+        self.assertEqual(1, len(closed))
+
+    def testErrors(self):
+        from ..interactive import InteractiveShell
+        out = io.StringIO()
+        shell = InteractiveShell(api.FahrplanClient(api_url=API_URL), stdin=io.StringIO(), stdout=out)
+        shell.onecmd('later')
+        shell.onecmd('von bern')
+        self.assertEqual('Error: Enter a query first.\n'
+                         'Error: "from" and "to" arguments must be present!\n', out.getvalue())
+        shell.onecmd('from bern to basel departure 07:00')
+        out.seek(0)
+        out.truncate()
+        shell.onecmd('earlier')
+        self.assertEqual(0, shell.page)
+        self.assertEqual('Error: No earlier pages, enter the query with an earlier time.\n', out.getvalue())
+        self.assertEqual({0, 1}, set(shell._pages[cache.make_key(shell.request)]))
+        shell.postloop()
+
+
+class TestStationIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = stations.StationIndex([
+            {'id': '8503000', 'name': 'Zürich HB'},
+            {'id': '8501120', 'name': 'Lausanne'},
+            {'id': '8591186', 'name': 'Zürich, Helvetiaplatz'},
+        ])
+
+    def testFolding(self):
+        self.assertEqual('zurich helvetiaplatz', stations.fold('Zürich,  Helvetiaplatz'))
+        self.assertEqual(stations.fold('Zürich HB'), stations.fold('zuerich hb'))
+
+    def testLookup(self):
+        self.assertEqual(('8591186', 'Zürich, Helvetiaplatz'), self.index.lookup('zürich, helvetiaplatz'))
+        self.assertEqual('8503000', self.index.resolve('ZUERICH HB'))
+        self.assertEqual('8501120', self.index.resolve('lausane'))
+        self.assertEqual('8501120', self.index.resolve('8501120'))
+        self.assertIsNone(self.index.resolve('olten'))
+
+    def testNearMisses(self):
+        index = stations.StationIndex.load(os.path.join(tempfile.gettempdir(), 'missing', 'stations.json'))
+        self.assertEqual('8506000', index.resolve('winterthr'))
+        # Other stations of the same town are not typos of its main station
+        for query in ('winterthur grüze', 'lausanne-flon', 'st. gallen st. fiden'):
+            self.assertIsNone(index.lookup(query), query)
+        client = api.FahrplanClient(api_url=API_URL)
+        id = index.resolve('winterthur grüze', client)
+        self.assertNotEqual('8506000', id)
+        self.assertEqual(id, index.resolve('Winterthur Grüze'))
+        self.assertTrue(index.dirty)
+
+    def testResolveUpstream(self):
+        client = api.FahrplanClient(api_url=API_URL)
+        request = self.index.resolve_request({'from': 'basel', 'to': 'zürich hb', 'time': '07:00'}, client)
+        self.assertEqual({'from': '8500010', 'to': '8503000', 'time': '07:00'}, request)
+        self.assertTrue(self.index.dirty)
+        self.assertEqual('8500010', self.index.resolve('Basel'))
+
+    def testConcurrentUpdates(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'stations.json')
+
+            def add(offset):
+                for i in range(300):
+                    id = str(9000000 + offset * 1000 + i)
+                    self.index.add(id, 'Station {} {}'.format(offset, i))
+                    self.index.add_alias('alias {} {}'.format(offset, i), id)
+                    if i % 10 == 0:
+                        self.index.save(path)
+
+            threads = [threading.Thread(target=add, args=(offset,)) for offset in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(3 + 4 * 300, len(self.index))
+            self.assertEqual('9002007', self.index.resolve('alias 2 7'))
+            self.assertEqual('9003299', self.index.resolve('Station 3 299'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testSaveAndLoad(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'stations.json')
+            self.index.add('8500218', 'Olten')
+            self.index.add_alias('oltn', '8500218')
+            self.index.save(path)
+            index = stations.StationIndex.load(path)
+            self.assertEqual('8500218', index.resolve('oltn'))
+            self.assertEqual('8591186', index.resolve('zurich helvetiaplatz'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestStandIn(unittest.TestCase):
+
+    def testInjectedErrors(self):
+        server = standin.StandInServer(throttle_rate=0.5, error_rate=0.5, retry_after=7)
+        statuses = set()
+        for _ in range(20):
+            status, headers, _ = server.respond('/v1/connections', 'from=bern&to=basel')
+            statuses.add(status)
+            if status == 429:
+                self.assertEqual('7', headers['Retry-After'])
+        server.httpd.server_close()
+        self.assertEqual({429, 500}, statuses)
+
+    def testSyntheticPayloadSize(self):
+        synthetic = standin.SyntheticData(connections=10, sections=3, walks=1)
+        data = synthetic.connections({'from': 'bern', 'to': 'zürich', 'time': '07:00'})
+        self.assertEqual(10, len(data['connections']))
+        self.assertEqual(4, len(data['connections'][0]['sections']))
+        self.assertEqual('Zürich HB', data['to']['name'])
+
+    def testFieldsAndCompression(self):
+        with standin.StandInServer() as server:
+            with api.FahrplanClient(api_url=server.url) as client:
+                projected = client.request('connections', {'from': 'bern', 'to': 'basel',
+                                                           'fields[]': list(api.CONNECTION_FIELDS)})
+                full = client.request('connections', {'from': 'bern', 'to': 'basel'})
+                self.assertEqual(['connections'], list(projected))
+                section = projected['connections'][0]['sections'][0]
+                self.assertEqual({'station', 'departure', 'platform'}, set(section['departure']))
+                self.assertEqual({'name'}, set(section['departure']['station']))
+                self.assertEqual(full['connections'][0]['sections'][0]['departure']['station']['name'],
+                                 section['departure']['station']['name'])
+                sent = server.bytes_sent
+                response = client.transport.get(server.url + '/connections', {'from': 'bern', 'to': 'basel'}, 5)
+                self.assertEqual('gzip', response.headers['Content-Encoding'])
+                self.assertEqual(server.bytes_sent - sent, response.raw.tell())
+                self.assertLess(response.raw.tell(), len(response.content))
+
+
+def watched_response(departure, delay=0, platform=None):
+    connection = json.loads(json.dumps(SAMPLE_CONNECTION))
+    section = connection['sections'][0]
+    section['departure']['departure'] = departure.strftime('%Y-%m-%dT%H:%M:%S+0000')
+    section['arrival']['arrival'] = (departure + timedelta(minutes=55)).strftime('%Y-%m-%dT%H:%M:%S+0000')
+    section['departure']['delay'] = delay
+    section['departure']['prognosis'] = {'platform': platform}
+    return FakeResponse(200, json.dumps({'connections': [connection]}).encode('utf-8'))
+
+
+class TestWarmup(unittest.TestCase):
+
+    def testNoReconnect(self):
+        with standin.StandInServer() as server, api.FahrplanClient(api_url=server.url) as client:
+            client.warmup()
+            for _ in range(3):
+                client.request('locations', {'query': 'bern'})
+                client.warmup()
+            self.assertEqual(1, server.connections)
+
+    def testSharedClientAcrossRuns(self):
+        with standin.StandInServer() as server:
+            options = main.build_parser().parse_args(['--api-url', server.url])
+            with main.make_client(options) as client:
+                for _ in range(5):
+                    status = main.run(['--format', 'json', '--api-url', server.url, 'von', 'bern', 'nach', 'basel'],
+                                      stdout=io.StringIO(), stderr=io.StringIO(),
+                                      client_factory=lambda options: client)
+                    self.assertEqual(0, status)
+            self.assertEqual(5, server.requests)
+            self.assertEqual(1, server.connections)
+
+
+class TestWatch(unittest.TestCase):
+
+    def testOnlyChangedLinesAreRedrawn(self):
+        departure = datetime.now(timezone.utc) + timedelta(hours=1)
+        transport = FakeTransport(watched_response(departure), watched_response(departure),
+                                  watched_response(departure, 5, '8'))
+        client = api.FahrplanClient(transport=transport)
+        out = io.StringIO()
+        status = watch.run(client, {'from': 'bern', 'to': 'basel'}, 0.001, out=out, polls=3, tty=False)
+        self.assertEqual(0, status)
+        self.assertEqual(list(watch.WATCH_FIELDS), transport.calls[0][1]['fields[]'])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(5, len(lines))
+        self.assertTrue(lines[2].startswith('0    Bern  '))
+        # Only the departure line changed
+        self.assertRegex(lines[4], r'^\d\d:\d\d:\d\d 0    Bern +7 → 8 .* \+5 ')
+
+    def testTimeIsFixed(self):
+        departure = datetime.now(timezone.utc) + timedelta(hours=1)
+        transport = FakeTransport(*[watched_response(departure) for _ in range(3)])
+        client = api.FahrplanClient(transport=transport)
+        watch.run(client, {'from': 'bern', 'to': 'basel'}, 0.001, out=io.StringIO(), polls=3, tty=False)
+        sent = [(params.get('date'), params.get('time')) for url, params in transport.calls]
+        self.assertEqual(3, len(sent))
+        self.assertTrue(all(sent[0]))
+        self.assertEqual([sent[0]] * 3, sent)
+
+    def testTerminalUpdates(self):
+        out = io.StringIO()
+        screen = watch.Screen(out, tty=True, width=80)
+        screen.update(['a', 'b', 'c'])
+        screen.update(['a', 'B', 'c'])
+        self.assertEqual('a\nb\nc\n\x1b[2A\r\x1b[2KB\x1b[2B\r', out.getvalue())
+        self.assertEqual(1, screen.redrawn)
+        screen.update(['a', 'B'])
+        self.assertEqual(2, screen.redrawn)
+
+    def testStopsAfterDeparture(self):
+        departure = datetime.now(timezone.utc) - timedelta(minutes=10)
+        client = api.FahrplanClient(transport=FakeTransport(watched_response(departure, 5)))
+        out = io.StringIO()
+        self.assertEqual(0, watch.run(client, {'from': 'bern', 'to': 'basel'}, 60, out=out, tty=False))
+        self.assertTrue(out.getvalue().endswith('All connections have departed.\n'))
+
+    def testConditionalRequests(self):
+        with standin.StandInServer() as server, api.FahrplanClient(api_url=server.url) as client:
+            params = {'from': 'bern', 'to': 'basel', 'time': '08:00'}
+            data, validator = client.request_if_changed('connections', params)
+            self.assertTrue(data['connections'])
+            self.assertTrue(validator[0])
+            self.assertEqual((None, validator), client.request_if_changed('connections', params, validator))
+            data, _ = client.request_if_changed('connections', dict(params, time='09:00'), validator)
+            self.assertTrue(data['connections'])
+
+
+class TestBoard(unittest.TestCase):
+
+    def testMerge(self):
+        start = datetime(2026, 5, 1, 8, 0)
+
+        def departures(station, *minutes):
+            return [models.Departure(station, start + timedelta(minutes=m), 0, '1', 'S 1', 'Thun')
+                    for m in minutes]
+
+        boards = [departures('Bern', 1, 4, 9), departures('Thun', 2, 3), departures('Biel', 5)]
+        merged = board.merge(boards)
+        self.assertEqual(['Bern', 'Thun', 'Thun', 'Bern', 'Biel', 'Bern'], [d.station for d in merged])
+        self.assertEqual(3, len(board.merge(boards, 3)))
+
+    def testRefresh(self):
+        with api.FahrplanClient(api_url=API_URL) as client, \
+                board.Board(client, ['bern', 'basel', 'thun'], window=10, workers=3) as b:
+            departures = b.refresh()
+            self.assertEqual(10, len(departures))
+            times = [d.departure for d in departures]
+            self.assertEqual(sorted(times), times)
+            self.assertLessEqual(2, len(set(d.station for d in departures)))
+            self.assertEqual({}, b.errors)
+            # Departures drop out of the board as they leave
+            later = b.refresh(now=times[4] + timedelta(seconds=1))
+            self.assertTrue(all(d.departure > times[4] for d in later))
+
+    def testCommand(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = main.run(['--format', 'plain', '--window', '5', '--api-url', API_URL,
+                           'board', 'bern', 'zürich'], stdout=stdout, stderr=stderr)
+        self.assertEqual(0, status, stderr.getvalue())
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(7, len(lines))
+        self.assertTrue(lines[0].startswith('Time   Delay  Station'))
+        status = main.run(['--format', 'csv', 'board', 'bern'], stdout=stdout, stderr=stderr)
+        self.assertEqual(2, status)
+
+
+GTFS_FEED = {
+    'agency.txt': ['agency_id,agency_name,agency_url,agency_timezone',
+                   '11,SBB,https://www.sbb.ch,Europe/Zurich'],
+    'stops.txt': ['stop_id,stop_name,parent_station,platform_code',
+                  '8507000,Bern,,', '8507000:0:1,Bern,8507000,1', '8507000:0:2,Bern,8507000,2',
+                  '8500218,Olten,,', '8500218:0:7,Olten,8500218,7', '8500218:0:8,Olten,8500218,8',
+                  '8500010,Basel SBB,,', '8500010:0:5,Basel SBB,8500010,5',
+                  '8503000,Zürich HB,,', '8503000:0:31,Zürich HB,8503000,31',
+                  '8500090,Basel Bad Bf,,'],
+    'routes.txt': ['route_id,agency_id,route_short_name,route_desc,route_type',
+                   'ic,11,IC8,IC,2', 'ir,11,IR,IR,2'],
+    'trips.txt': ['route_id,service_id,trip_id,trip_short_name',
+                  'ic,daily,t1,812', 'ir,daily,t2,2065', 'ic,daily,t3,962', 'ir,daily,t4,2067',
+                  'ir,daily,t5,2099', 'ic,not_4_may,t6,900', 'ir,daily,t7,2570', 'ir,daily,t8,2100',
+                  'ir,daily,t9,2102'],
+    'stop_times.txt': ['trip_id,arrival_time,departure_time,stop_id,stop_sequence',
+                       't1,08:02:00,08:02:00,8507000:0:1,1', 't1,08:28:00,08:30:00,8500218:0:7,2',
+                       't1,09:00:00,09:00:00,8503000:0:31,3',
+                       't2,08:35:00,08:35:00,8500218:0:8,1', 't2,09:00:00,09:00:00,8500010:0:5,2',
+                       't3,08:32:00,08:32:00,8507000:0:2,1', 't3,08:58:00,08:58:00,8500218:0:7,2',
+                       't4,09:05:00,09:05:00,8500218:0:8,1', 't4,09:30:00,09:30:00,8500010:0:5,2',
+                       't5,23:58:00,24:10:00,8500218:0:8,1', 't5,24:40:00,24:40:00,8500010:0:5,2',
+                       't6,08:10:00,08:10:00,8507000:0:1,1', 't6,08:50:00,08:50:00,8500010:0:5,2',
+                       't7,09:07:00,09:07:00,8503000:0:31,1', 't7,10:00:00,10:00:00,8500010:0:5,2',
+                       't8,08:20:00,08:20:00,8500010:0:5,1', 't8,08:45:00,08:45:00,8500218:0:7,2',
+                       't9,08:50:00,08:50:00,8500010:0:5,1', 't9,09:15:00,09:15:00,8500218:0:7,2'],
+    'calendar.txt': ['service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date',
+                     'daily,1,1,1,1,1,1,1,20260101,20271231', 'not_4_may,1,1,1,1,1,1,1,20260101,20271231'],
+    'calendar_dates.txt': ['service_id,date,exception_type', 'not_4_may,20260504,2'],
+    'transfers.txt': ['from_stop_id,to_stop_id,transfer_type,min_transfer_time',
+                      '8500010:0:5,8500090,2,600', '8500090,8500010:0:5,2,600'],
+}
+
+
+def import_feed(directory):
+    """Import ``GTFS_FEED`` into a timetable in ``directory``, return its path."""
+    path = os.path.join(directory, 'timetable.sqlite')
+    feed = os.path.join(directory, 'feed')
+    os.mkdir(feed)
+    for name, lines in GTFS_FEED.items():
+        with open(os.path.join(feed, name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+    return path, offline.import_gtfs(feed, path)
+
+
+class TestOffline(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path, counts = import_feed(self.directory)
+        self.assertEqual({'stations': 5, 'trips': 9, 'connections': 10}, counts)
+        self.client = offline.OfflineClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.directory)
+
+    def query(self, include_sections=False, **request):
+        return self.client.get_connections(request, include_sections)['connections']
+
+    def testEarliestArrival(self):
+        connections = self.query(True, **{'from': 'bern', 'to': 'basel', 'time': '08:00', 'date': '2026/05/04'})
+        self.assertEqual(['1', '1'], [c.change_count for c in connections])
+        first = connections[0]
+        self.assertEqual('IC 812, IR 2065', first.travelwith)
+        self.assertEqual(['Bern', 'Olten'], [s.station_from for s in first.sections])
+        self.assertEqual('1', first.sections[0].platform_from)
+        self.assertEqual(datetime(2026, 5, 4, 9, 0), first.sections[1].arrival.replace(tzinfo=None))
+        self.assertEqual(timedelta(hours=2), first.sections[1].arrival.utcoffset())
+        # The direct train doesn't run on 4 May
+        connections = self.query(**{'from': 'bern', 'to': 'basel', 'time': '08:00', 'date': '2026/05/05'})
+        self.assertEqual(('0', 'IC 900'), (connections[0].change_count, connections[0].travelwith))
+
+    def testPastMidnight(self):
+        connections = self.query(**{'from': 'olten', 'to': 'basel sbb', 'time': '23:00', 'date': '2026/05/04'})
+        section = connections[0].sections[0]
+        self.assertEqual(datetime(2026, 5, 5, 0, 40), section.arrival.replace(tzinfo=None))
+
+    def testArrivalTimeViaAndFootpaths(self):
+        connections = self.query(**{'from': 'bern', 'to': 'basel', 'time': '09:20', 'date': '2026/05/04',
+                                    'isArrivalTime': 1})
+        self.assertEqual(datetime(2026, 5, 4, 8, 2), connections[-1].sections[0].departure.replace(tzinfo=None))
+        connections = self.query(True, **{'from': 'bern', 'to': 'basel', 'via': 'zürich hb', 'time': '08:00',
+                                          'date': '2026/05/04'})
+        self.assertEqual('IC 812, IR 2570', connections[0].travelwith)
+        connections = self.query(True, **{'from': 'bern', 'to': 'basel bad', 'time': '08:00',
+                                          'date': '2026/05/04'})
+        walk = connections[0].sections[-1]
+        self.assertEqual(('Basel SBB', 'Basel Bad Bf', ''), (walk.station_from, walk.station_to, walk.travelwith))
+        self.assertEqual(datetime(2026, 5, 4, 9, 10), walk.arrival.replace(tzinfo=None))
+        with self.assertRaises(api.FahrplanError):
+            self.query(**{'from': 'bern', 'to': 'genf'})
+
+    def testLeadingFootpath(self):
+        connections = self.query(True, **{'from': 'basel sbb', 'to': 'basel bad', 'time': '08:00',
+                                          'date': '2026/05/04'})
+        self.assertEqual(1, len(connections))
+        self.assertEqual('Basel Bad Bf', connections[0].sections[0].station_to)
+        # The next journey isn't the same train with a later walk
+        request = {'from': 'basel bad', 'to': 'olten', 'time': '08:00', 'date': '2026/05/04', 'limit': 3}
+        connections = self.query(**request)
+        self.assertEqual(['IR 2100', 'IR 2102'], [c.travelwith for c in connections])
+        connections = self.query(**dict(request, time='09:30', isArrivalTime=1))
+        self.assertEqual(['IR 2100', 'IR 2102'], [c.travelwith for c in connections])
+
+    def testCommand(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = main.run(['--offline', '--timetable', self.path, '--format', 'plain',
+                           'von', 'bern', 'nach', 'olten', 'ab', '08:00'], stdout=stdout, stderr=stderr)
+        self.assertEqual(0, status, stderr.getvalue())
+        self.assertIn('Olten', stdout.getvalue())
+        status = main.run(['--offline', '--timetable', os.path.join(self.directory, 'missing'),
+                           'von', 'bern', 'nach', 'olten'], stdout=stdout, stderr=stderr)
+        self.assertEqual(1, status)
+        self.assertIn('import-gtfs', stderr.getvalue())
+
+
+class TestSnapshot(unittest.TestCase):
+
+    request = {'from': 'Bern', 'to': 'Zürich', 'date': '2026/05/04', 'time': '08:00'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot.bin')
+        routes = os.path.join(self.directory, 'routes.txt')
+        with open(routes, 'w', encoding='utf-8') as f:
+            f.write('# Commute\nbern zürich\nvon thun nach basel\n')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = main.run(['--api-url', API_URL, '--snapshot-file', self.path,
+                           'snapshot', 'build', routes, '2026-05-04'], stdout=stdout, stderr=stderr)
+        self.assertEqual(0, status, stderr.getvalue())
+        self.assertIn('of 2 routes on 2026-05-04', stdout.getvalue())
+        self.snapshot = snapshot.Snapshot(self.path)
+
+    def tearDown(self):
+        self.snapshot.close()
+        shutil.rmtree(self.directory)
+
+    def testRoundTrip(self):
+        with api.FahrplanClient(api_url=API_URL) as client:
+            fetched = snapshot.fetch_day(client, 'bern', 'zürich', datetime(2026, 5, 4).date())
+        day = dict(self.request, time='00:00', limit=len(fetched))
+        self.assertEqual([c.to_dict() for c in fetched],
+                         [c.to_dict() for c in self.snapshot.lookup(day, True)])
+        summary = self.snapshot.lookup(day)[-1].sections[0]
+        self.assertEqual((fetched[-1].sections[0].departure, fetched[-1].sections[-1].arrival),
+                         (summary.departure, summary.arrival))
+        self.assertEqual(fetched[-1].change_count, summary.change_count)
+
+    def testLookup(self):
+        connections = self.snapshot.lookup(self.request)
+        self.assertEqual(4, len(connections))
+        departures = [c.sections[0].departure for c in connections]
+        self.assertEqual(sorted(departures), departures)
+        self.assertGreaterEqual(departures[0].strftime('%H:%M'), '08:00')
+        later = self.snapshot.lookup(dict(self.request, page=1))
+        self.assertLess(departures[-1], later[0].sections[0].departure)
+        arriving = self.snapshot.lookup(dict(self.request, isArrivalTime=1))
+        self.assertTrue(all(c.sections[0].arrival.strftime('%H:%M') <= '08:00' for c in arriving))
+        # Found by the station names of the results as well
+        self.assertEqual(4, len(self.snapshot.lookup(dict(self.request, to='Zürich HB'))))
+        # Not covered: other routes, dates, vias and the end of the day
+        for request in [dict(self.request, to='Genf'), dict(self.request, date='2026/05/05'),
+                        dict(self.request, via='Olten'), dict(self.request, time='23:50')]:
+            self.assertIsNone(self.snapshot.lookup(request))
+
+    def testClient(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return api.FahrplanClient(api_url=API_URL)
+
+        with snapshot.SnapshotClient(snapshot.Snapshot(self.path), factory) as client:
+            self.assertEqual(4, len(client.get_connections(self.request)['connections']))
+            self.assertEqual([], calls)
+            self.assertTrue(client.get_connections(dict(self.request, to='Genf'))['connections'])
+            self.assertEqual([1], calls)
+        stderr = io.StringIO()
+        status = main.run(['--snapshot', '--snapshot-file', os.path.join(self.directory, 'missing'),
+                           'von', 'bern', 'nach', 'olten'], stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(1, status)
+        self.assertIn('snapshot build', stderr.getvalue())
+
+    def testClientCreatedOnce(self):
+        calls = []
+
+        def factory():
+            calls.append(1)
+            time.sleep(0.05)
+            return FailingClient()
+
+        clients = []
+        with snapshot.SnapshotClient(snapshot.Snapshot(self.path), factory) as client:
+            threads = [threading.Thread(target=lambda: clients.append(client.client)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(1, len(set(map(id, clients))))
+        self.assertEqual([1], calls)
+
+
+class FailingClient(object):
+    """Client failing every query, for the error handling of exploration."""
+
+    def get_connections(self, request, include_sections=False, cache=None, keep_raw=True):
+        raise api.FahrplanError('No connections found')
+
+    def close(self):
+        pass
+
+
+class TestExplore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path, _ = import_feed(self.directory)
+        self.client = offline.OfflineClient(self.path)
+        self.request = {'from': 'bern', 'to': 'basel', 'time': '08:00', 'date': '2026/05/04'}
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.directory)
+
+    def testVariants(self):
+        requests = explore.variants(dict(self.request, via='olten'), ['Olten', 'Zürich HB', 'Bern', 'zurich hb'])
+        self.assertEqual(['olten', 'Zürich HB'], [r['via'] for r in requests])
+        self.assertEqual(1 + len(explore.DEFAULT_VIAS) - 2, len(explore.variants(self.request)))  # Bern, Basel SBB
+
+    def testParetoFront(self):
+        start = datetime(2026, 5, 4, 8, 0)
+
+        def connection(number, departure, arrival, changes):
+            section = models.Section('Bern', 'Basel', 'IC {}'.format(number), start + timedelta(minutes=departure),
+                                     start + timedelta(minutes=arrival), '1', '2', str(changes))
+            return models.Connection.decoded(str(changes), section.travelwith, [section])
+
+        fast, direct, early, slow = connection(1, 10, 60, 1), connection(2, 0, 70, 0), connection(3, 5, 60, 1), \
+            connection(4, 20, 80, 1)
+        front = explore.pareto_front([slow, direct, early, fast, connection(1, 10, 60, 1)])
+        self.assertEqual(['IC 2', 'IC 1'], [c.travelwith for c in front])
+        # For arrival time queries, later departures are better
+        front = explore.pareto_front([slow, direct, early, fast], arrival_time=True)
+        self.assertEqual(['IC 2', 'IC 1', 'IC 4'], [c.travelwith for c in front])
+
+    def testExplore(self):
+        connections = explore.explore(self.client, self.request, ['Olten', 'Zürich HB', 'Genf'], workers=3,
+                                      include_sections=True)
+        # Via Olten finds the same journeys, via Zürich arrives later
+        self.assertEqual(['IC 812, IR 2065'], [c.travelwith for c in connections])
+        request = dict(self.request, time='09:40', isArrivalTime=1)
+        connections = explore.explore(self.client, request, ['Olten'])
+        self.assertEqual([datetime(2026, 5, 4, 8, 32)],
+                         [c.sections[0].departure.replace(tzinfo=None) for c in connections])
+        with self.assertRaises(api.FahrplanError):
+            explore.explore(FailingClient(), self.request, ['Olten'])
+
+    def testCommand(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = main.run(['--offline', '--timetable', self.path, '--format', 'json', '--explore-via', 'olten',
+                           'von', 'bern', 'nach', 'basel', 'ab', '08:00', 'am', '4.5.2026'],
+                          stdout=stdout, stderr=stderr)
+        self.assertEqual(0, status, stderr.getvalue())
+        self.assertEqual(1, len(json.loads(stdout.getvalue())))
+        status = main.run(['--explore', '--watch', '30', 'von', 'bern', 'nach', 'basel'],
+                          stdout=stdout, stderr=stderr)
+        self.assertEqual(2, status)
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'fahrplan.sock')
+        options = main.build_parser().parse_args(['--daemon', '--api-url', API_URL])
+        self.server = daemon.create_server(options, self.path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def testQuery(self):
+        for _ in range(2):
+            response = daemon.request(['-f', 'von', 'bern', 'nach', 'basel'], self.path, width=120)
+            self.assertEqual(0, response['status'], response['stderr'])
+            self.assertIn('Basel SBB', response['stdout'])
+        # Both queries share one client
+        self.assertEqual(1, len(self.server._clients))
+
+    def testConnectionReuse(self):
+        with standin.StandInServer() as upstream:
+            for _ in range(5):
+                response = daemon.request(['--api-url', upstream.url, 'von', 'bern', 'nach', 'basel'],
+                                          self.path)
+                self.assertEqual(0, response['status'], response['stderr'])
+            self.assertEqual(5, upstream.requests)
+            self.assertEqual(1, upstream.connections)
+
+    def testErrors(self):
+        response = daemon.request(['von', 'bern'], self.path)
+        self.assertEqual(1, response['status'])
+        self.assertEqual('Error: "from" and "to" arguments must be present!\n', response['stderr'])
+        response = daemon.request(['--interactive'], self.path)
+        self.assertEqual(2, response['status'])
+        response = daemon.request(['--no-such-option'], self.path)
+        self.assertEqual(2, response['status'])
+
+    def testSocketInUse(self):
+        options = main.build_parser().parse_args(['--daemon'])
+        self.assertRaises(RuntimeError, daemon.create_server, options, self.path)
+
+    def testSocketOwner(self):
+        environ = dict(os.environ)
+        try:
+            os.environ.pop('FAHRPLAN_SOCKET', None)
+            os.environ.pop('XDG_RUNTIME_DIR', None)
+            os.environ['TMPDIR'] = self.tmpdir
+            path = daemon.default_socket_path()
+            directory = os.path.dirname(path)
+            self.assertEqual(self.tmpdir, os.path.dirname(directory))
+            # A directory others may write to is refused
+            os.mkdir(directory, 0o777)
+            os.chmod(directory, 0o777)
+            options = main.build_parser().parse_args(['--daemon'])
+            self.assertRaises(RuntimeError, daemon.create_server, options, path)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            daemon._check_peer(sock, self.path)
+            self.assertRaises(PermissionError, daemon._check_peer, sock, self.path, os.getuid() + 1)
+        finally:
+            sock.close()
+
+    def testClientFallback(self):
+        path = os.path.join(self.tmpdir, 'missing.sock')
+        self.assertRaises(OSError, daemon.request, ['-v'], path)
+        r = run_command('python -m fahrplan.daemon --socket {0} von bern nach basel'.format(path))
+        self.assertEqual(0, r.status_code, r.std_err)
+        self.assertIn('Basel SBB', r.std_out)
+
+
+class TestBatch(unittest.TestCase):
+    lines = ['von bern nach basel\n', '# comment\n', 'von bern\n', '\n',
+             'de lausanne à vevey\n', 'from thun to burgdorf\n']
+
+    def testOrderedResults(self):
+        with api.FahrplanClient(api_url=API_URL) as client:
+            results = list(batch.iter_results(client, self.lines, workers=2))
+        self.assertEqual([1, 3, 5, 6], [r['line'] for r in results])
+        self.assertEqual('"from" and "to" arguments must be present!', results[1]['error'])
+        self.assertEqual({'from': 'lausanne', 'to': 'vevey'}, results[2]['request'])
+        self.assertTrue(results[0]['connections'])
+        record = json.loads(batch.dumps(results[0]))
+        departure = record['connections'][0]['sections'][0]['departure']
+        self.assertEqual(results[0]['connections'][0]['sections'][0]['departure'].isoformat(), departure)
+
+    def testUnorderedResults(self):
+        with api.FahrplanClient(api_url=API_URL) as client:
+            results = list(batch.iter_results(client, self.lines * 3, workers=3, ordered=False))
+        self.assertEqual(12, len(results))
+        self.assertEqual(3, len([r for r in results if 'error' in r]))
+
+    def testUnexpectedErrors(self):
+        class Client(api.FahrplanClient):
+            def get_connections(self, request, *args, **kwargs):
+                if request['from'] == 'thun':
+                    raise KeyError('sections')
+                return api.FahrplanClient.get_connections(self, request, *args, **kwargs)
+
+        logger = logging.getLogger()
+        level = logger.level
+        logger.setLevel(logging.CRITICAL)
+        try:
+            with Client(api_url=API_URL) as client:
+                results = list(batch.iter_results(client, self.lines, workers=2))
+        finally:
+            logger.setLevel(level)
+        self.assertEqual([1, 3, 5, 6], [r['line'] for r in results])
+        self.assertTrue(results[2]['connections'])
+        self.assertEqual("KeyError: 'sections'", results[3]['error'])
+
+    def testCommand(self):
+        r = run_command('printf "von bern nach basel\\nvon bern\\n" | {0} --batch -'.format(BASE_COMMAND))
+        self.assertEqual(1, r.status_code)
+        records = [json.loads(line) for line in r.std_out.splitlines()]
+        self.assertEqual([1, 2], [record['line'] for record in records])
+        self.assertIn('connections', records[0])
+        self.assertIn('error', records[1])
+
+
+class TestProfiling(unittest.TestCase):
+
+    def testNestedPhases(self):
+        calls = []
+
+        def listener(phase, seconds):
+            calls.append((phase, seconds))
+
+        with profiling.timed('ignored'):
+            pass
+        profiling.add_listener(listener)
+        try:
+            with profiling.timed('outer'):
+                time.sleep(0.02)
+                with profiling.timed('inner'):
+                    time.sleep(0.02)
+        finally:
+            profiling.remove_listener(listener)
+        self.assertEqual(['inner', 'outer'], [phase for phase, seconds in calls])
+        self.assertGreaterEqual(calls[0][1], 0.02)
+        # The outer phase excludes the inner one
+        self.assertLess(calls[1][1], 0.035)
+        self.assertFalse(profiling.active())
+
+    def testClientPhases(self):
+        with api.FahrplanClient(api_url=API_URL) as client, profiling.Profile() as profile:
+            client.get_connections({'from': 'bern', 'to': 'basel'})
+            list(client.iter_connections({'from': 'bern', 'to': 'thun'}))
+        for phase in ['connect', 'first_byte', 'download', 'decode', 'parse']:
+            self.assertIn(phase, profile.phases)
+        self.assertEqual(2, profile.phases['first_byte'][0])
+        # Both responses are compressed
+        self.assertLess(profile.counters['bytes_wire'], profile.counters['bytes_decoded'])
+        self.assertGreater(profile.wall, sum(seconds for calls, seconds in profile.phases.values()))
+
+    def testReport(self):
+        profile = profiling.Profile(memory=True).start()
+        with profiling.timed('decode'):
+            [str(i) for i in range(1000)]
+        profile.stop()
+        out = io.StringIO()
+        profile.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith('decode'))
+        self.assertIn('wall time', out.getvalue())
+        self.assertIn('Peak traced memory', out.getvalue())
+
+    def testCommand(self):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = main.run(['--profile', '--format', 'plain', '--api-url', API_URL,
+                           'von', 'bern', 'nach', 'basel'], stdout=stdout, stderr=stderr)
+        self.assertEqual(0, status, stderr.getvalue())
+        self.assertIn('Basel SBB', stdout.getvalue())
+        for phase in ['parse_input', 'first_byte', 'render', 'wall time']:
+            self.assertIn(phase, stderr.getvalue())
+        status = main.run(['--profile', 'von', 'bern', 'nach', 'basel'], stdout=stdout, stderr=stderr,
+                          interactive=False)
+        self.assertEqual(2, status)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+
+    def testCompare(self):
+        from benchmarks import suite
+
+        def results(python='3.11', **throughputs):
+            return {'python': python, 'implementation': 'CPython', 'payload': {'connections': 16},
+                    'results': {name: {'throughput': value, 'unit': 'connections/s'}
+                                for name, value in throughputs.items()}}
+
+        baseline = results(parse=1000, render=1000, plain=1000)
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            # Drops within the threshold are allowed
+            self.assertEqual([], suite.compare(baseline, results(parse=1200, render=910, plain=1000), 0.1))
+            self.assertEqual(['render'], suite.compare(baseline, results(parse=950, render=899, new=5), 0.1))
+            self.assertEqual(['parse', 'render'], suite.compare(
+                baseline, results('3.12', parse=500, render=700, plain=1000), 0.25))
+        self.assertIn('REGRESSION', out.getvalue())
+        self.assertRegex(out.getvalue(), r'\nnew +- +5 +new\n')
+        self.assertIn('Warning: python differs', err.getvalue())
+
+
 class RegressionTests(unittest.TestCase):
 
     def testIss11(self):
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Watch mode (``fahrplan --watch SECONDS``).
+
+Polls a connection query and shows the expected platforms, times and delays
+from the ``prognosis`` of the API. On a terminal, only the lines that changed
+are redrawn; otherwise the table is written once and then every changed line
+again, prefixed with the time of the change.
+
+Polling uses conditional requests (see
+:meth:`fahrplan.api.FahrplanClient.request_if_changed`), so an unchanged
+response is neither decoded nor rendered again. It ends when all connections
+have departed.
+"""
+import sys
+import time
+import shutil
+from datetime import datetime, timedelta, timezone
+
+from .api import FahrplanError, CONNECTION_FIELDS
+from .cache import normalize_request
+from .display import _format_date, _format_time, _plain_line
+from .helpers import parse_timestamp, perror
+
+# Members of a connections response shown in watch mode.
+WATCH_FIELDS = CONNECTION_FIELDS + (
+    'connections/sections/departure/delay',
+    'connections/sections/departure/prognosis/platform',
+    'connections/sections/departure/prognosis/departure',
+    'connections/sections/arrival/delay',
+    'connections/sections/arrival/prognosis/platform',
+    'connections/sections/arrival/prognosis/arrival',
+)
+
+# Columns of the table: (title, width). The last column isn't padded.
+WATCH_COLUMNS = (
+    ('#', 3),
+    ('Station', 28),
+    ('Platform', 8),
+    ('Date', 8),
+    ('Time', 5),
+    ('Delay', 5),
+    ('Changes', 7),
+    ('With', 0),
+)
+
+
+def _delay(checkpoint, key):
+    """Return the delay of a departure or arrival in minutes, or None."""
+    delay = checkpoint.get('delay')
+    expected = (checkpoint.get('prognosis') or {}).get(key)
+    if delay is None and expected and checkpoint.get(key):
+        delay = int((parse_timestamp(expected) - parse_timestamp(checkpoint[key])).total_seconds() // 60)
+    return delay
+
+
+def _platform(checkpoint):
+    planned = checkpoint.get('platform') or ''
+    expected = (checkpoint.get('prognosis') or {}).get('platform')
+    if expected and expected != planned:
+        return '{} → {}'.format(planned, expected) if planned else expected
+    return planned or '-'
+
+
+def _checkpoint_line(checkpoint, key, number='', changes='', travelwith=''):
+    when = parse_timestamp(checkpoint[key])
+    delay = _delay(checkpoint, key)
+    return _plain_line([
+        number,
+        checkpoint['station']['name'],
+        _platform(checkpoint),
+        _format_date(when),
+        _format_time(when),
+        '+{}'.format(delay) if delay else '',
+        changes,
+        travelwith,
+    ], WATCH_COLUMNS)
+
+
+def _travelwith(section):
+    journey = section.get('journey')
+    if journey is not None:
+        return '{} {}'.format(journey['category'], journey['number'])
+    return 'Walk' if section.get('walk') else ''
+
+
+def connection_lines(number, connection, include_sections=False):
+    """Return the lines of a connection, two per (summary) section."""
+    sections = sorted(connection['sections'], key=lambda s: s['departure']['departure'])
+    if include_sections:
+        legs = [(s['departure'], s['arrival'], _travelwith(s)) for s in sections]
+    else:
+        travelwith = ', '.join(_travelwith(s) for s in sections if s.get('journey'))
+        legs = [(sections[0]['departure'], sections[-1]['arrival'], travelwith)]
+    lines = []
+    for i, (departure, arrival, travelwith) in enumerate(legs):
+        first = not i
+        lines.append(_checkpoint_line(departure, 'departure', str(number) if first else '',
+                                      str(connection['transfers']) if first else '', travelwith))
+        lines.append(_checkpoint_line(arrival, 'arrival'))
+    return lines
+
+
+def departed(connection, now=None):
+    """Return whether a connection has departed (including its delay)."""
+    departure = min((s['departure'] for s in connection['sections']), key=lambda c: c['departure'])
+    expected = parse_timestamp(departure['departure']) + timedelta(minutes=_delay(departure, 'departure') or 0)
+    return (now or datetime.now(timezone.utc)) >= expected
+
+
+def table_lines(connections, include_sections=False):
+    """Return the lines of the table of all connections."""
+    lines = [_plain_line([title for title, width in WATCH_COLUMNS], WATCH_COLUMNS).rstrip('\n'),
+             _plain_line(['-' * (width or len(title)) for title, width in WATCH_COLUMNS],
+                         WATCH_COLUMNS).rstrip('\n')]
+    for i, connection in enumerate(connections):
+        if i:
+            lines.append('')
+        lines.extend(line.rstrip('\n') for line in connection_lines(i, connection, include_sections))
+    return lines
+
+
+class Screen(object):
+    """Show lines on a stream, redrawing only the lines that changed.
+
+    On a terminal, changed lines are rewritten in place with ANSI escape
+    sequences (the whole table is redrawn if the number of lines changes).
+    Otherwise, the first table is written as is and later only the changed
+    lines, prefixed with the current time.
+
+    Args:
+        out: The output stream.
+        tty: Whether ``out`` is a terminal (default: ``out.isatty()``).
+        width: Width of the terminal, longer lines are cut off (default:
+            the size of the terminal).
+
+    """
+
+    def __init__(self, out, tty=None, width=None):
+        self.out = out
+        self.tty = out.isatty() if tty is None else tty
+        if width is None and self.tty:
+            width = shutil.get_terminal_size().columns
+        self.width = width
+        self.lines = []  # Lines currently shown, the cursor is below them
+        self.redrawn = 0  # Number of lines written by the last update
+
+    def _fit(self, line):
+        if self.width and len(line) >= self.width:
+            return line[:self.width - 1]
+        return line
+
+    def update(self, lines):
+        lines = [self._fit(line) for line in lines]
+        old = self.lines
+        parts = []
+        if not old or (self.tty and len(lines) != len(old)):
+            if old:
+                parts.append('\x1b[{}A\r\x1b[J'.format(len(old)))
+            parts.extend(line + '\n' for line in lines)
+            self.redrawn = len(lines)
+        else:
+            self.redrawn = 0
+            stamp = time.strftime('%H:%M:%S ')
+            for i, line in enumerate(lines):
+                if i < len(old) and line == old[i]:
+                    continue
+                self.redrawn += 1
+                if not self.tty:
+                    parts.append(stamp + line + '\n')
+                    continue
+                up = len(lines) - i
+                parts.append('\x1b[{0}A\r\x1b[2K{1}\x1b[{0}B\r'.format(up, line))
+        self.lines = lines
+        self.out.write(''.join(parts))
+        self.out.flush()
+
+
+def run(client, request, interval, include_sections=False, out=None, err=None, polls=None,
+        width=None, tty=None):
+    """Poll a connection query every ``interval`` seconds and show it.
+
+    Args:
+        client: The :class:`fahrplan.api.FahrplanClient` to use.
+        request: Request dictionary as returned by ``parse_input``.
+        interval: Seconds between the start of two polls.
+        include_sections: Whether to show all sections of a connection.
+        out: Output stream (default stdout).
+        err: Stream for errors if ``out`` isn't a terminal (default stderr).
+        polls: Maximum number of polls (default: until all connections have
+            departed or the user interrupts).
+        width: Width of the terminal, see :class:`Screen`.
+        tty: Whether ``out`` is a terminal, see :class:`Screen`.
+
+    Returns:
+        The exit status.
+
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+    screen = Screen(out, tty, width)
+    if client.station_index is not None:
+        request = client.station_index.resolve_request(request, client)
+    # Fix "now" once, a window moving with every poll would never depart
+    params = dict(normalize_request(request), **{'fields[]': list(WATCH_FIELDS)})
+    validator = None
+    connections = None
+    table = []
+    count = 0
+    try:
+        while polls is None or count < polls:
+            start = time.time()
+            count += 1
+            status = None
+            try:
+                data, validator = client.request_if_changed('connections', params, validator)
+            except FahrplanError as e:
+                if connections is None:
+                    perror('Error:', e, file=err)
+                    return 1
+                status = 'Error: {} (retrying in {:g}s)'.format(e, interval)
+            else:
+                if data is not None:
+                    connections = data.get('connections') or []
+                    if not connections:
+                        print('No connections found', file=out)
+                        return 0
+                    table = table_lines(connections, include_sections)
+            if all(departed(c) for c in connections):
+                if screen.tty:
+                    screen.update(table + ['', 'All connections have departed.'])
+                else:
+                    screen.update(table)
+                    print('All connections have departed.', file=out)
+                return 0
+            if screen.tty:
+                screen.update(table + ['', status or 'Updated {}, every {:g}s (Ctrl-C to stop)'.format(
+                    time.strftime('%H:%M:%S'), interval)])
+            else:
+                screen.update(table)
+                if status:
+                    perror(status, file=err)
+            if polls is None or count < polls:
+                time.sleep(max(0, interval - (time.time() - start)))
+    except KeyboardInterrupt:
+        pass
+    return 0
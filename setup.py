@@ -19,15 +19,21 @@ setup(name='fahrplan',
       author_email=meta.author_email,
       url=meta.url,
       packages=['fahrplan'],
+      package_data={'fahrplan': ['data/*.json']},
       zip_safe=False,
       include_package_data=True,
       license=meta.license,
       keywords=meta.keywords,
       long_description=readme,
       install_requires=requirements,
+      extras_require={
+          'async': ['aiohttp>=3,<4'],
+          'fast': ['orjson>=3'],
+      },
       entry_points={
           'console_scripts': [
               '%s = fahrplan.main:main' % meta.title,
+              '%s-client = fahrplan.daemon:client_main' % meta.title,
           ]
       },
       classifiers=[